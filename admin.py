@@ -3,9 +3,15 @@ from flask_login import login_required, current_user
 from functools import wraps
 from app import db
 from models import User, Listing
-from forms import AdminUserForm, AdminListingForm, AdminSearchForm
-from sqlalchemy import or_
-import time
+from forms import AdminUserForm, AdminListingForm, AdminSearchForm, AdminBulkListingForm
+from bulk import apply_bulk_action, bulk_form_conditions, delete_listings, listing_conditions
+from cache import invalidate_listing
+from pagination import keyset_page
+from search import search_listings, search_users
+from stats import change_status, daily_stats, record_user_deleted, site_stats
+from metrics import render_metrics
+from user_cache import invalidate_user
+import hmac
 
 admin = Blueprint('admin', __name__, url_prefix='/admin')
 
@@ -13,41 +19,43 @@ def admin_required(f):
     @wraps(f)
     @login_required
     def decorated_function(*args, **kwargs):
-        current_app.logger.debug(f"Admin check for user {current_user.id}")
+        current_app.logger.debug("Admin check for user %s", current_user.id)
         if not current_user.is_admin:
-            current_app.logger.warning(f"Non-admin user {current_user.id} attempted to access admin panel")
+            current_app.logger.warning("Non-admin user %s attempted to access admin panel", current_user.id)
             flash('You do not have permission to access this page.', 'error')
             return redirect(url_for('main.index'))
-        current_app.logger.debug(f"Admin access granted for user {current_user.id}")
+        current_app.logger.debug("Admin access granted for user %s", current_user.id)
         return f(*args, **kwargs)
     return decorated_function
 
 @admin.route('/', methods=['GET', 'POST'])
 @admin_required
 def admin_panel():
-    start_time = time.time()
-    current_app.logger.info(f"Admin panel accessed by user {current_user.id}")
+    current_app.logger.info("Admin panel accessed by user %s", current_user.id)
     
     page = request.args.get('page', 1, type=int)
     per_page = 10
     search_form = AdminSearchForm()
 
     if search_form.validate_on_submit():
-        search_query = search_form.search.data
-        current_app.logger.debug(f"Search query: {search_query}")
-        users = User.query.filter(or_(User.username.ilike(f'%{search_query}%'), User.email.ilike(f'%{search_query}%'))).paginate(page=page, per_page=per_page)
-        listings = Listing.query.filter(or_(Listing.title.ilike(f'%{search_query}%'), Listing.description.ilike(f'%{search_query}%'))).paginate(page=page, per_page=per_page)
-    else:
-        users = User.query.paginate(page=page, per_page=per_page)
-        listings = Listing.query.paginate(page=page, per_page=per_page)
-    
-    current_app.logger.debug(f"Number of users: {users.total}")
-    current_app.logger.debug(f"Number of listings: {listings.total}")
-    
-    end_time = time.time()
-    current_app.logger.info(f"Total admin panel load time: {end_time - start_time:.4f} seconds")
-    
-    return render_template('admin/panel.html', users=users, listings=listings, search_form=search_form)
+        # Redirect so the query lives in the URL and survives paging
+        return redirect(url_for('admin.admin_panel', q=search_form.search.data))
+
+    search_query = request.args.get('q', '').strip()
+    if search_query:
+        current_app.logger.debug("Search query: %s", search_query)
+        search_form.search.data = search_query
+        users = search_users(search_query, page=page, per_page=per_page)
+        listings = search_listings(search_query, page=page, per_page=per_page, status=None)
+        return render_template('admin/panel.html', users=users, listings=listings,
+                               search_form=search_form, search_query=search_query,
+                               bulk_form=AdminBulkListingForm())
+
+    # Keyset pages keep deep pages cheap and skip the COUNT paginate() runs
+    users = keyset_page(User.query, [User.id], request.args.get('users_cursor'), per_page)
+    listings = keyset_page(Listing.query, [Listing.id], request.args.get('listings_cursor'), per_page)
+    return render_template('admin/panel.html', users=users, listings=listings, search_form=search_form,
+                           bulk_form=AdminBulkListingForm())
 
 @admin.route('/user/<int:user_id>', methods=['GET', 'POST'])
 @admin_required
@@ -59,8 +67,9 @@ def admin_edit_user(user_id):
         user.email = form.email.data
         user.is_admin = form.is_admin.data
         user.enable_cross_platform_posting = form.enable_cross_platform_posting.data
+        invalidate_user(user.id)
         db.session.commit()
-        current_app.logger.info(f"User {user_id} updated by admin {current_user.id}")
+        current_app.logger.info("User %s updated by admin %s", user_id, current_user.id)
         flash('User updated successfully.', 'success')
         return redirect(url_for('admin.admin_panel'))
     return render_template('admin/edit_user.html', form=form, user=user)
@@ -76,9 +85,10 @@ def admin_edit_listing(listing_id):
         listing.price = form.price.data
         listing.location = form.location.data
         listing.negotiable = form.negotiable.data
-        listing.status = form.status.data
+        change_status(listing, form.status.data)
+        invalidate_listing(listing.id)
         db.session.commit()
-        current_app.logger.info(f"Listing {listing_id} updated by admin {current_user.id}")
+        current_app.logger.info("Listing %s updated by admin %s", listing_id, current_user.id)
         flash('Listing updated successfully.', 'success')
         return redirect(url_for('admin.admin_panel'))
     return render_template('admin/edit_listing.html', form=form, listing=listing)
@@ -91,28 +101,65 @@ def admin_delete_user(user_id):
         flash('You cannot delete your own account.', 'error')
     else:
         db.session.delete(user)
+        record_user_deleted()
+        invalidate_user(user.id)
         db.session.commit()
-        current_app.logger.info(f"User {user_id} deleted by admin {current_user.id}")
+        current_app.logger.info("User %s deleted by admin %s", user_id, current_user.id)
         flash('User deleted successfully.', 'success')
     return redirect(url_for('admin.admin_panel'))
 
 @admin.route('/listing/<int:listing_id>/delete', methods=['POST'])
 @admin_required
 def admin_delete_listing(listing_id):
-    listing = Listing.query.get_or_404(listing_id)
-    db.session.delete(listing)
+    Listing.query.get_or_404(listing_id)
+    delete_listings(listing_conditions(listing_ids=[listing_id]))
     db.session.commit()
-    current_app.logger.info(f"Listing {listing_id} deleted by admin {current_user.id}")
+    current_app.logger.info("Listing %s deleted by admin %s", listing_id, current_user.id)
     flash('Listing deleted successfully.', 'success')
     return redirect(url_for('admin.admin_panel'))
 
+@admin.route('/listings/bulk', methods=['POST'])
+@admin_required
+def admin_bulk_listings():
+    form = AdminBulkListingForm()
+    if not form.validate_on_submit():
+        for errors in form.errors.values():
+            for error in errors:
+                flash(error, 'error')
+        return redirect(url_for('admin.admin_panel'))
+
+    conditions = bulk_form_conditions(form, request.form.getlist('listing_ids', type=int))
+    if conditions is None:
+        flash('Select at least one listing.', 'error')
+        return redirect(url_for('admin.admin_panel'))
+    try:
+        count = apply_bulk_action(form.action.data, conditions, form.percent.data)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error("Error applying bulk %s for admin %s: %s", form.action.data, current_user.id, e)
+        flash('An error occurred while updating the listings. Please try again.', 'error')
+        return redirect(url_for('admin.admin_panel'))
+    current_app.logger.info("Bulk %s on %s listing(s) by admin %s", form.action.data, count, current_user.id)
+    flash(f'Updated {count} listing(s).', 'success')
+    return redirect(url_for('admin.admin_panel'))
+
 @admin.route('/stats')
 @admin_required
 def admin_stats():
-    total_users = User.query.count()
-    total_listings = Listing.query.count()
-    active_listings = Listing.query.filter_by(status='active').count()
-    sold_listings = Listing.query.filter_by(status='sold').count()
+    stats = site_stats()
+    days = daily_stats()
+
+    current_app.logger.info("Admin stats viewed by admin %s", current_user.id)
+    return render_template('admin/stats.html', total_users=stats.users, total_listings=stats.listings,
+                           active_listings=stats.active_listings, sold_listings=stats.sold_listings, days=days)
+
+def _metrics_response():
+    return current_app.response_class(render_metrics(), mimetype='text/plain; version=0.0.4')
 
-    current_app.logger.info(f"Admin stats viewed by admin {current_user.id}")
-    return render_template('admin/stats.html', total_users=total_users, total_listings=total_listings, active_listings=active_listings, sold_listings=sold_listings)
+@admin.route('/metrics')
+def metrics():
+    token = current_app.config['METRICS_TOKEN']
+    if token and hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return _metrics_response()
+    return admin_required(_metrics_response)()
@@ -2,42 +2,95 @@ from flask import Flask, render_template
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.orm import DeclarativeBase
 from flask_login import LoginManager
-from flask_migrate import Migrate
 from flask_wtf.csrf import CSRFProtect
 from werkzeug.utils import secure_filename
 import os
-import logging
 
 class Base(DeclarativeBase):
     pass
 
 db = SQLAlchemy(model_class=Base)
 login_manager = LoginManager()
-migrate = Migrate()
 csrf = CSRFProtect()
 
-def create_app():
+def create_app(config=None, web=True, cli=True):
+    """Build the app.
+
+    The config class comes from ``APP_CONFIG`` (``config.Config`` by
+    default, ``config.ProductionConfig`` for deployments). ``web=False``
+    skips the blueprints, for workers and scripts that never serve a
+    page; ``cli=False`` skips Flask-Migrate and the command groups, for
+    WSGI servers (see wsgi.py).
+    """
     app = Flask(__name__)
-    app.config.from_object('config.Config')
+    app.config.from_object(os.environ.get('APP_CONFIG', 'config.Config'))
+    if config:
+        app.config.update(config)
 
-    # Set up logging
-    logging.basicConfig(level=logging.DEBUG)
-    app.logger.setLevel(logging.DEBUG)
+    from logs import configure_logging
+    configure_logging(app)
 
     db.init_app(app)
     login_manager.init_app(app)
-    migrate.init_app(app, db)
     csrf.init_app(app)
     login_manager.login_view = 'auth.login'
 
+    if cli:
+        # Alembic is slow to import and only the 'flask db' commands need it
+        from flask_migrate import Migrate
+        Migrate(app, db)
+
+    from metrics import init_metrics
+    init_metrics(app)
+
+    from external_platforms import init_platforms
+    init_platforms(app)
+
+    from cache import init_cache
+    init_cache(app)
+
+    from user_cache import init_user_cache
+    init_user_cache(app)
+
+    from passwords import init_passwords
+    init_passwords(app)
+
+    from assets import init_assets
+    init_assets(app)
+
     # Custom file upload configuration
     app.config['UPLOAD_FOLDER'] = os.path.join(app.root_path, 'static', 'uploads')
     os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
-    with app.app_context():
-        from models import User, Listing, CustomField
-        db.create_all()
+    if app.config['AUTO_CREATE_TABLES']:
+        with app.app_context():
+            from models import User, Listing, CustomField
+            import search  # registers the full-text index DDL with create_all
+            db.create_all()
+            # Don't hand this connection down to workers forked after startup
+            db.engine.dispose()
+
+    from events import init_events
+    init_events(app)
+
+    if web:
+        from oidc import init_oidc
+        init_oidc(app)
+        from uploads import init_uploads
+        init_uploads(app)
+        register_blueprints(app)
+
+    if cli:
+        register_commands(app)
+
+    @app.errorhandler(403)
+    def forbidden_error(error):
+        app.logger.error("403 Forbidden: %s", error)
+        return render_template('errors/403.html'), 403
+
+    return app
 
+def register_blueprints(app):
     from auth import auth as auth_blueprint
     app.register_blueprint(auth_blueprint)
 
@@ -48,9 +101,48 @@ def create_app():
     app.register_blueprint(admin_blueprint)
     app.logger.debug("Admin blueprint registered")
 
-    @app.errorhandler(403)
-    def forbidden_error(error):
-        app.logger.error(f"403 Forbidden: {error}")
-        return render_template('errors/403.html'), 403
+    from events import events as events_blueprint
+    app.register_blueprint(events_blueprint)
 
-    return app
+    from uploads import uploads as uploads_blueprint
+    app.register_blueprint(uploads_blueprint)
+
+def register_commands(app):
+    from external_platforms import platforms_cli
+    app.cli.add_command(platforms_cli)
+
+    from assets import assets_cli
+    app.cli.add_command(assets_cli)
+
+    from jobs import jobs_cli
+    app.cli.add_command(jobs_cli)
+
+    from poller import poller_cli
+    app.cli.add_command(poller_cli)
+
+    from images import images_cli
+    app.cli.add_command(images_cli)
+
+    from storage import storage_cli
+    app.cli.add_command(storage_cli)
+
+    from uploads import uploads_cli
+    app.cli.add_command(uploads_cli)
+
+    from perf import perf_cli
+    app.cli.add_command(perf_cli)
+
+    from search import search_cli
+    app.cli.add_command(search_cli)
+
+    from stats import stats_cli
+    app.cli.add_command(stats_cli)
+
+    from notifications import notifications_cli
+    app.cli.add_command(notifications_cli)
+
+    from bulk import bulk_cli
+    app.cli.add_command(bulk_cli)
+
+    from bench import bench_cli
+    app.cli.add_command(bench_cli)
@@ -0,0 +1,192 @@
+"""Fingerprinted, precompressed static files.
+
+``url_for('static', ...)`` gains a ``v=<content hash>`` argument, so a URL
+changes whenever the file does and can be cached forever. Requests carrying
+the current hash, and content-addressed blobs, are served with
+``Cache-Control: immutable``; anything else is revalidated.
+
+``flask assets build`` (run at deploy time, or at startup with
+``ASSETS_BUILD_ON_STARTUP``) hashes the bundled assets into a manifest and
+writes ``.gz`` and, if the optional ``brotli`` package is installed,
+``.br`` copies of text assets. These are picked by ``Accept-Encoding``.
+Uploads are hashed lazily from their size and mtime.
+
+With ``ASSETS_SENDFILE`` set to ``x-sendfile`` or ``x-accel-redirect`` the
+response only names the file and the front proxy sends the bytes. For
+nginx, map ``ASSETS_ACCEL_PREFIX`` to an ``internal`` location over the
+static folder with ``gzip_static``/``brotli_static`` enabled.
+"""
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+from functools import lru_cache
+from urllib.parse import quote
+
+import click
+from flask import current_app, request, send_file
+from flask.cli import AppGroup
+from werkzeug.exceptions import NotFound
+from werkzeug.security import safe_join
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+assets_cli = AppGroup('assets', help='Static asset commands.')
+
+MANIFEST = '.assets-manifest.json'
+UPLOADS = 'uploads/'
+# Uploads under here are named after their content and never change
+IMMUTABLE_PREFIX = 'uploads/blobs/'
+COMPRESSIBLE = ('text/', 'application/javascript', 'application/json', 'image/svg+xml')
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+ONE_YEAR = 365 * 24 * 3600
+
+def _hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(64 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:12]
+
+@lru_cache(maxsize=4096)
+def _hash_upload(path, mtime_ns, size):
+    return _hash_file(path)
+
+def _compressible(filename):
+    mimetype = mimetypes.guess_type(filename)[0] or ''
+    return mimetype.startswith(COMPRESSIBLE)
+
+def _bundled_files(static_folder):
+    for root, dirs, files in os.walk(static_folder):
+        rel_root = os.path.relpath(root, static_folder).replace(os.sep, '/')
+        if rel_root == 'uploads' or rel_root.startswith(UPLOADS):
+            dirs[:] = []
+            continue
+        for name in files:
+            if name == MANIFEST or name.endswith(('.gz', '.br')):
+                continue
+            yield os.path.normpath(os.path.join(rel_root, name)).replace(os.sep, '/')
+
+def build_assets(static_folder):
+    """Write the manifest and compressed copies; return ``(files, compressed)``."""
+    manifest = {}
+    compressed = 0
+    for filename in _bundled_files(static_folder):
+        path = os.path.join(static_folder, filename)
+        manifest[filename] = _hash_file(path)
+        if not _compressible(filename):
+            continue
+        with open(path, 'rb') as f:
+            data = f.read()
+        outputs = [('.gz', lambda: gzip.compress(data, compresslevel=9, mtime=0))]
+        if brotli is not None:
+            outputs.append(('.br', lambda: brotli.compress(data, quality=11)))
+        for suffix, compress in outputs:
+            target = path + suffix
+            if os.path.exists(target) and os.path.getmtime(target) >= os.path.getmtime(path):
+                continue
+            tmp = target + '.tmp'
+            with open(tmp, 'wb') as out:
+                out.write(compress())
+            os.replace(tmp, target)
+            compressed += 1
+    tmp = os.path.join(static_folder, MANIFEST + '.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp, os.path.join(static_folder, MANIFEST))
+    return len(manifest), compressed
+
+def _load_manifest(static_folder):
+    try:
+        with open(os.path.join(static_folder, MANIFEST)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def fingerprint(filename):
+    """Content hash for a static filename, or ``None`` if it needs none."""
+    if filename.startswith(IMMUTABLE_PREFIX):
+        return None
+    manifest = current_app.extensions['assets_manifest']
+    if filename in manifest:
+        return manifest[filename]
+    path = safe_join(current_app.static_folder, filename)
+    try:
+        stat = os.stat(path)
+    except (OSError, TypeError):
+        return None
+    return _hash_upload(path, stat.st_mtime_ns, stat.st_size)
+
+def _add_fingerprint(endpoint, values):
+    if endpoint == 'static' and 'v' not in values and 'filename' in values:
+        version = fingerprint(values['filename'])
+        if version:
+            values['v'] = version
+
+def _pick_encoding(path, filename):
+    if not _compressible(filename):
+        return None, path
+    accepted = request.accept_encodings
+    mtime = os.path.getmtime(path)
+    for encoding, suffix in ENCODINGS:
+        # A copy older than its source is stale until the next build
+        if accepted[encoding] and os.path.exists(path + suffix) and os.path.getmtime(path + suffix) >= mtime:
+            return encoding, path + suffix
+    return None, path
+
+def serve_static(filename):
+    static_folder = current_app.static_folder
+    path = safe_join(static_folder, filename)
+    if path is None or not os.path.isfile(path):
+        raise NotFound()
+
+    immutable = filename.startswith(IMMUTABLE_PREFIX) or (
+        request.args.get('v') is not None and request.args.get('v') == fingerprint(filename))
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    encoding, served_path = _pick_encoding(path, filename)
+
+    mode = current_app.config['ASSETS_SENDFILE']
+    if mode == 'x-accel-redirect':
+        # The proxy negotiates gzip/brotli itself for internal locations
+        response = current_app.response_class(mimetype=mimetype)
+        response.headers['X-Accel-Redirect'] = current_app.config['ASSETS_ACCEL_PREFIX'] + quote(filename)
+    elif mode == 'x-sendfile':
+        response = current_app.response_class(mimetype=mimetype)
+        response.headers['X-Sendfile'] = served_path
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+    else:
+        response = send_file(served_path, mimetype=mimetype, conditional=True, max_age=None)
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+
+    if _compressible(filename):
+        response.vary.add('Accept-Encoding')
+    if immutable:
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = ONE_YEAR
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True
+    return response
+
+def init_assets(app):
+    if app.config['ASSETS_BUILD_ON_STARTUP']:
+        build_assets(app.static_folder)
+    app.extensions['assets_manifest'] = _load_manifest(app.static_folder)
+    app.url_defaults(_add_fingerprint)
+    app.view_functions['static'] = serve_static
+
+@assets_cli.command('build')
+def build_command():
+    """Hash static assets and write compressed copies for deployment."""
+    files, compressed = build_assets(current_app.static_folder)
+    current_app.extensions['assets_manifest'] = _load_manifest(current_app.static_folder)
+    click.echo(f"Fingerprinted {files} file(s), wrote {compressed} compressed copies.")
+    if brotli is None:
+        click.echo("brotli is not installed; only gzip copies were written.")
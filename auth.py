@@ -1,21 +1,20 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request, current_app
+from flask import Blueprint, render_template, redirect, url_for, flash, request, current_app, session
 from flask_login import login_user, logout_user, login_required, current_user
 from urllib.parse import urlparse, urljoin
 from app import db, login_manager
 from models import User
 from forms import LoginForm, RegistrationForm
-from oauthlib.oauth2 import WebApplicationClient
-import requests
-import json
-import os
+from stats import record_user_created
+from oidc import OIDCError, get_provider
+from user_cache import invalidate_user, load_user as load_cached_user
+from passwords import PasswordVerifierBusy, dummy_verify, needs_rehash
+import secrets
 
 auth = Blueprint('auth', __name__)
 
-client = WebApplicationClient(os.environ.get("GOOGLE_CLIENT_ID"))
-
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    return load_cached_user(int(user_id))
 
 def is_safe_url(target):
     ref_url = urlparse(request.host_url)
@@ -30,14 +29,32 @@ def login():
         return redirect(url_for('main.index'))
     form = LoginForm()
     if form.validate_on_submit():
-        current_app.logger.debug(f"Login form submitted for email: {form.email.data}")
+        current_app.logger.debug("Login form submitted for email: %s", form.email.data)
         user = User.query.filter_by(email=form.email.data).first()
-        if user is None or not user.check_password(form.password.data):
-            current_app.logger.warning(f"Login attempt failed: Invalid email or password for {form.email.data}")
+        try:
+            if user is None:
+                dummy_verify(form.password.data)
+                valid = False
+            else:
+                valid = user.check_password(form.password.data)
+        except PasswordVerifierBusy:
+            current_app.logger.warning("Login attempt for %s refused: password checks saturated", form.email.data)
+            flash('Too many sign-in attempts right now. Please try again in a moment.')
+            response = current_app.make_response((render_template('login.html', title='Sign In', form=form), 503))
+            response.headers['Retry-After'] = '5'
+            return response
+        if not valid:
+            current_app.logger.warning("Login attempt failed: Invalid email or password for %s", form.email.data)
             flash('Invalid email or password')
             return redirect(url_for('auth.login'))
+        if needs_rehash(user.password_hash):
+            # Stored with an older cost setting; upgrade while we know the password
+            user.set_password(form.password.data)
+            invalidate_user(user.id)
+            db.session.commit()
+            current_app.logger.info("Rehashed password for user %s", user.id)
         login_user(user, remember=form.remember_me.data)
-        current_app.logger.info(f"User {user.id} logged in successfully")
+        current_app.logger.info("User %s logged in successfully", user.id)
         next_page = request.args.get('next')
         if not next_page or not is_safe_url(next_page):
             next_page = url_for('main.index')
@@ -59,6 +76,7 @@ def register():
         user = User(username=form.username.data, email=form.email.data)
         user.set_password(form.password.data)
         db.session.add(user)
+        record_user_created()
         db.session.commit()
         flash('Congratulations, you are now a registered user!')
         return redirect(url_for('auth.login'))
@@ -66,45 +84,38 @@ def register():
 
 @auth.route('/login/google')
 def google_login():
-    google_provider_cfg = requests.get(os.environ.get("GOOGLE_DISCOVERY_URL")).json()
-    authorization_endpoint = google_provider_cfg["authorization_endpoint"]
-
-    request_uri = client.prepare_request_uri(
-        authorization_endpoint,
-        redirect_uri=request.base_url + "/callback",
-        scope=["openid", "email", "profile"],
-    )
+    # state ties the callback to this browser, nonce ties the ID token to this login
+    session['oidc_state'] = secrets.token_urlsafe(16)
+    session['oidc_nonce'] = secrets.token_urlsafe(16)
+    try:
+        request_uri = get_provider().authorization_url(request.base_url + "/callback",
+                                                       session['oidc_state'], session['oidc_nonce'])
+    except OIDCError as e:
+        current_app.logger.error("Google sign-in unavailable: %s", e)
+        flash('Google sign-in is unavailable right now. Please try again later.')
+        return redirect(url_for('auth.login'))
     return redirect(request_uri)
 
 @auth.route('/login/google/callback')
 def google_callback():
+    state = session.pop('oidc_state', None)
+    nonce = session.pop('oidc_nonce', None)
+    if state is None or not secrets.compare_digest(request.args.get("state", ""), state):
+        return "Invalid or expired sign-in request.", 400
     code = request.args.get("code")
-    google_provider_cfg = requests.get(os.environ.get("GOOGLE_DISCOVERY_URL")).json()
-    token_endpoint = google_provider_cfg["token_endpoint"]
-
-    token_url, headers, body = client.prepare_token_request(
-        token_endpoint,
-        authorization_response=request.url,
-        redirect_url=request.base_url,
-        code=code
-    )
-    token_response = requests.post(
-        token_url,
-        headers=headers,
-        data=body,
-        auth=(os.environ.get("GOOGLE_CLIENT_ID"), os.environ.get("GOOGLE_CLIENT_SECRET")),
-    )
-
-    client.parse_request_body_response(json.dumps(token_response.json()))
-
-    userinfo_endpoint = google_provider_cfg["userinfo_endpoint"]
-    uri, headers, body = client.add_token(userinfo_endpoint)
-    userinfo_response = requests.get(uri, headers=headers, data=body)
-
-    if userinfo_response.json().get("email_verified"):
-        unique_id = userinfo_response.json()["sub"]
-        users_email = userinfo_response.json()["email"]
-        users_name = userinfo_response.json()["given_name"]
+    if not code:
+        return "Sign-in was cancelled.", 400
+
+    try:
+        claims = get_provider().authenticate(code, request.base_url, nonce)
+    except OIDCError as e:
+        current_app.logger.warning("Google sign-in failed: %s", e)
+        return "Could not verify your Google account.", 400
+
+    if claims.get("email_verified"):
+        unique_id = claims["sub"]
+        users_email = claims["email"]
+        users_name = claims.get("given_name") or users_email.split("@")[0]
     else:
         return "User email not available or not verified by Google.", 400
 
@@ -112,6 +123,7 @@ def google_callback():
     if not user:
         user = User(username=users_name, email=users_email, google_id=unique_id)
         db.session.add(user)
+        record_user_created()
         db.session.commit()
 
     login_user(user)
@@ -0,0 +1,408 @@
+"""Synthetic data and a route benchmark.
+
+``flask bench seed`` fills the configured database with realistic data:
+users with a skewed number of listings, photos with variants, custom
+fields and notifications. Rows go in with multi-row inserts, one commit
+per batch, so a million listings take minutes rather than hours. Seeded
+users share the password ``bench``, and ``benchadmin@example.com`` is an
+admin.
+
+``flask bench run`` drives the main routes and writes throughput,
+p50/p95/p99 latency and SQL query counts per route to a JSON file. By
+default it runs in-process through the test client against the
+configured database. With ``--url`` it talks HTTP to a running server,
+with ``--concurrency`` sessions at once. Query counts then come from the
+``X-Query-Count`` header, which the server only sends when
+``METRICS_SERVER_TIMING`` is on. ``flask bench compare`` diffs two result
+files, e.g. from two commits or from SQLite and Postgres.
+
+Runs create listings through ``create_listing``, so point them at a
+disposable database.
+"""
+import json
+import math
+import platform
+import random
+import re
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import func, insert, select, update
+
+from app import db
+from models import CustomField, Listing, Notification, Photo, PhotoVariant, User
+from notifications import recount_unread
+from passwords import hash_password
+from perf import QueryCounter
+from stats import rebuild_stats
+
+bench_cli = AppGroup('bench', help='Synthetic data and benchmarks.')
+
+PASSWORD = 'bench'
+ADMIN_EMAIL = 'benchadmin@example.com'
+SEARCH_TERM = 'vintage'
+ADJECTIVES = ('Vintage', 'Modern', 'Antique', 'Handmade', 'Rustic', 'Compact', 'Classic', 'Retro', 'Sturdy',
+              'Lightweight', 'Mint', 'Refurbished')
+ITEMS = ('oak table', 'road bike', 'leather jacket', 'record player', 'desk lamp', 'camera lens', 'bookshelf',
+         'guitar', 'espresso machine', 'armchair', 'snowboard', 'sewing machine', 'mirror', 'rug', 'kayak')
+LOCATIONS = ('Portland', 'Seattle', 'Austin', 'Denver', 'Chicago', 'Boston', 'Oakland', 'Brooklyn')
+FIELD_NAMES = ('Condition', 'Brand', 'Color', 'Size', 'Material', 'Year')
+FIELD_VALUES = ('Good', 'Like new', 'Fair', 'Black', 'Walnut', 'Large', 'Steel', '1978')
+PLATFORMS = ('OfferUp', 'Facebook Marketplace')
+STATUS_WEIGHTS = (('active', 80), ('sold', 15), ('deleted', 5))
+CSRF_INPUT = re.compile(r'name="csrf_token"[^>]*value="([^"]+)"|value="([^"]+)"[^>]*name="csrf_token"')
+
+def _status(rng):
+    roll = rng.randrange(100)
+    for status, weight in STATUS_WEIGHTS:
+        if roll < weight:
+            return status
+        roll -= weight
+    return 'active'
+
+def _insert_returning_ids(model, rows):
+    if not rows:
+        return []
+    return db.session.execute(
+        insert(model).returning(model.id, sort_by_parameter_order=True), rows
+    ).scalars().all()
+
+def seed_users(count, batch_size, rng):
+    """Insert ``count`` users sharing the bench password; return their IDs."""
+    password_hash = hash_password(PASSWORD)
+    start = (db.session.query(func.max(User.id)).scalar() or 0) + 1
+    user_ids = []
+    for offset in range(0, count, batch_size):
+        rows = [{'username': f'bench{n}', 'email': f'bench{n}@example.com', 'password_hash': password_hash,
+                 'enable_cross_platform_posting': rng.random() < 0.3}
+                for n in range(start + offset, start + min(offset + batch_size, count))]
+        user_ids.extend(_insert_returning_ids(User, rows))
+        db.session.commit()
+    if not User.query.filter_by(email=ADMIN_EMAIL).first():
+        db.session.add(User(username='benchadmin', email=ADMIN_EMAIL, password_hash=password_hash, is_admin=True))
+        db.session.commit()
+    return user_ids
+
+def seed_listing_batch(user_ids, count, photos, fields, notifications, rng, now):
+    """Insert ``count`` listings with their photos, variants, fields and notifications."""
+    listings = []
+    for _ in range(count):
+        # Cubing skews ownership: a few power sellers own most listings
+        owner = user_ids[int(len(user_ids) * rng.random() ** 3)]
+        created_at = now - timedelta(seconds=rng.randrange(90 * 24 * 3600))
+        status = _status(rng)
+        listings.append({
+            'title': f'{rng.choice(ADJECTIVES)} {rng.choice(ITEMS)}',
+            'description': f'{rng.choice(ADJECTIVES)} condition, pickup in {rng.choice(LOCATIONS)}.',
+            'price': round(rng.uniform(5, 2000), 2),
+            'location': rng.choice(LOCATIONS),
+            'negotiable': rng.random() < 0.5,
+            'status': status,
+            'created_at': created_at,
+            'sold_at': created_at + timedelta(days=rng.randrange(1, 30)) if status == 'sold' else None,
+            'user_id': owner,
+        })
+    listing_ids = _insert_returning_ids(Listing, listings)
+
+    photo_rows = [{'listing_id': listing_id, 'filename': f'seed/{listing_id}-{j}.jpg'}
+                  for listing_id in listing_ids for j in range(photos)]
+    photo_ids = _insert_returning_ids(Photo, photo_rows)
+    if photo_ids:
+        db.session.execute(insert(PhotoVariant), [
+            {'photo_id': photo_id, 'width': 320, 'height': 240, 'format': 'jpeg',
+             'filename': f'seed/variants/{photo_id}-320.jpeg'}
+            for photo_id in photo_ids
+        ])
+        first_photo = (select(func.min(Photo.id)).where(Photo.listing_id == Listing.id)
+                       .correlate(Listing).scalar_subquery())
+        db.session.execute(update(Listing).where(Listing.id.in_(listing_ids))
+                           .values(primary_photo_id=first_photo)
+                           .execution_options(synchronize_session=False))
+
+    field_rows = [{'listing_id': listing_id, 'name': name, 'value': rng.choice(FIELD_VALUES)}
+                  for listing_id in listing_ids for name in rng.sample(FIELD_NAMES, min(fields, len(FIELD_NAMES)))]
+    if field_rows:
+        db.session.execute(insert(CustomField), field_rows)
+
+    notification_rows = []
+    for listing_id, listing in zip(listing_ids, listings):
+        for _ in range(notifications):
+            notification_rows.append({
+                'user_id': listing['user_id'],
+                'listing_id': listing_id,
+                'content': f'New comment on "{listing["title"]}"',
+                'platform': rng.choice(PLATFORMS),
+                'timestamp': listing['created_at'] + timedelta(seconds=rng.randrange(7 * 24 * 3600)),
+                'is_read': rng.random() < 0.7,
+            })
+    if notification_rows:
+        db.session.execute(insert(Notification), notification_rows)
+    db.session.commit()
+
+@bench_cli.command('seed')
+@click.option('--users', default=1000, show_default=True)
+@click.option('--listings', default=10000, show_default=True)
+@click.option('--photos', default=2, show_default=True, help='Photos per listing.')
+@click.option('--fields', default=3, show_default=True, help='Custom fields per listing.')
+@click.option('--notifications', default=1, show_default=True, help='Notifications per listing.')
+@click.option('--batch-size', default=5000, show_default=True, help='Rows per insert and commit.')
+@click.option('--seed', 'random_seed', default=0, show_default=True, help='Random seed, for repeatable data.')
+def seed_command(users, listings, photos, fields, notifications, batch_size, random_seed):
+    """Fill the database with synthetic users, listings and notifications."""
+    rng = random.Random(random_seed)
+    started = time.perf_counter()
+    user_ids = seed_users(users, batch_size, rng)
+    click.echo(f"Inserted {len(user_ids)} users")
+    now = datetime.utcnow()
+    for offset in range(0, listings, batch_size):
+        seed_listing_batch(user_ids, min(batch_size, listings - offset), photos, fields, notifications, rng, now)
+        click.echo(f"Inserted {min(offset + batch_size, listings)}/{listings} listings")
+    # Counters and rollups are cheaper to rebuild once than to bump per row
+    recount_unread()
+    rebuild_stats()
+    click.echo(f"Seeded in {time.perf_counter() - started:.1f}s")
+
+class TestClientDriver:
+    """Sends requests through ``app.test_client()`` and counts their SQL."""
+
+    mode = 'test-client'
+
+    def __init__(self, app):
+        self.app = app
+        self.client = app.test_client()
+
+    def request(self, method, path, data=None):
+        # A fresh app context per request, or ``g`` (and with it the logged
+        # in user and CSRF token) would carry over from the CLI's context
+        with self.app.app_context(), QueryCounter(db.engine) as counter:
+            response = self.client.open(path, method=method, data=data)
+            body = response.get_data(as_text=True)
+        return response.status_code, body, counter.count
+
+class HTTPDriver:
+    """Sends requests to a running server with ``requests``."""
+
+    mode = 'http'
+
+    def __init__(self, base_url):
+        import requests
+
+        self.base_url = base_url.rstrip('/')
+        self.session = requests.Session()
+
+    def request(self, method, path, data=None):
+        response = self.session.request(method, self.base_url + path, data=data, allow_redirects=False)
+        queries = response.headers.get('X-Query-Count')
+        return response.status_code, response.text, int(queries) if queries is not None else None
+
+def _csrf_token(driver, path):
+    status, body, _ = driver.request('GET', path)
+    match = CSRF_INPUT.search(body)
+    return (match.group(1) or match.group(2)) if match else None
+
+def log_in(driver, email):
+    token = _csrf_token(driver, '/login')
+    status, _, _ = driver.request('POST', '/login', {'email': email, 'password': PASSWORD, 'csrf_token': token})
+    if status != 302:
+        raise click.ClickException(f"Could not log in as {email} (HTTP {status}); seed with 'flask bench seed' first")
+    return driver
+
+def _percentile(values, percent):
+    """Nearest-rank percentile of an already sorted list."""
+    if not values:
+        return None
+    return values[max(0, math.ceil(percent / 100 * len(values)) - 1)]
+
+def _summary(latencies, queries, errors, wall):
+    latencies = sorted(latencies)
+    queries = sorted(q for q in queries if q is not None)
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'throughput_rps': round(len(latencies) / wall, 2) if wall else None,
+        'latency_ms': {
+            'p50': round(_percentile(latencies, 50) * 1000, 3),
+            'p95': round(_percentile(latencies, 95) * 1000, 3),
+            'p99': round(_percentile(latencies, 99) * 1000, 3),
+            'mean': round(sum(latencies) / len(latencies) * 1000, 3),
+            'max': round(latencies[-1] * 1000, 3),
+        } if latencies else None,
+        'queries': {
+            'p50': _percentile(queries, 50),
+            'max': queries[-1],
+        } if queries else None,
+    }
+
+def bench_routes(seller_email, listing_ids):
+    """``(name, user email, method, path, data, expected status)`` per route.
+
+    ``path`` may be a callable taking the random generator, ``data`` one
+    taking the generator and a CSRF token.
+    """
+    counter = iter(range(10 ** 9))
+    return [
+        ('index', seller_email, 'GET', '/', None, 200),
+        ('view_listing', seller_email, 'GET', lambda rng: f'/listing/{rng.choice(listing_ids)}', None, 200),
+        ('my_listings', seller_email, 'GET', '/my_listings', None, 200),
+        ('notifications', seller_email, 'GET', '/notifications', None, 200),
+        ('search', seller_email, 'GET', f'/search?q={SEARCH_TERM}', None, 200),
+        ('admin_panel_search', ADMIN_EMAIL, 'GET', f'/admin/?q={SEARCH_TERM}', None, 200),
+        ('create_listing', seller_email, 'POST', '/create_listing',
+         lambda rng, token: {'title': f'Bench listing {next(counter)}', 'description': 'Created by flask bench run',
+                             'price': str(rng.randint(5, 500)), 'location': rng.choice(LOCATIONS),
+                             'custom_fields-0-name': 'Condition', 'custom_fields-0-value': 'Good',
+                             'csrf_token': token, 'custom_fields-0-csrf_token': token}, 302),
+    ]
+
+def _run_route(drivers, route, requests_count, warmup, rng):
+    name, _, method, path, data, expected = route
+    tokens = [_csrf_token(driver, '/create_listing') if method == 'POST' else None for driver in drivers]
+    lock = threading.Lock()
+    latencies, queries = [], []
+    errors = 0
+
+    def one(index, record):
+        nonlocal errors
+        with lock:
+            request_path = path(rng) if callable(path) else path
+            request_data = data(rng, tokens[index % len(drivers)]) if callable(data) else data
+        start = time.perf_counter()
+        status, _, query_count = drivers[index % len(drivers)].request(method, request_path, request_data)
+        elapsed = time.perf_counter() - start
+        if record:
+            with lock:
+                latencies.append(elapsed)
+                queries.append(query_count)
+                if status != expected:
+                    errors += 1
+
+    for i in range(warmup):
+        one(i, False)
+    started = time.perf_counter()
+    if len(drivers) == 1:
+        for i in range(requests_count):
+            one(0, True)
+    else:
+        with ThreadPoolExecutor(max_workers=len(drivers)) as pool:
+            list(pool.map(lambda i: one(i, True), range(requests_count)))
+    return _summary(latencies, queries, errors, time.perf_counter() - started)
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=current_app.root_path, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def _dataset():
+    return {
+        'users': db.session.query(func.count(User.id)).scalar(),
+        'listings': db.session.query(func.count(Listing.id)).scalar(),
+        'photos': db.session.query(func.count(Photo.id)).scalar(),
+        'notifications': db.session.query(func.count(Notification.id)).scalar(),
+    }
+
+def _default_seller():
+    """The seeded user with the most listings, i.e. the heaviest pages."""
+    row = (db.session.query(User.email)
+           .join(Listing, Listing.user_id == User.id)
+           .filter(User.username.like('bench%'))
+           .group_by(User.id, User.email)
+           .order_by(func.count(Listing.id).desc())
+           .first())
+    if row is None:
+        raise click.ClickException("No seeded users found; run 'flask bench seed' first")
+    return row.email
+
+@bench_cli.command('run')
+@click.option('--output', '-o', default='bench.json', show_default=True, help='Where to write the results.')
+@click.option('--requests', 'requests_count', default=200, show_default=True, help='Measured requests per route.')
+@click.option('--warmup', default=10, show_default=True, help='Unmeasured requests per route first.')
+@click.option('--route', 'only', multiple=True, help='Only run these routes (repeatable).')
+@click.option('--user', 'seller_email', help='Seller to browse as [default: the seeded user with most listings].')
+@click.option('--url', help='Benchmark a running server over HTTP instead of the test client.')
+@click.option('--concurrency', default=1, show_default=True, help='Parallel sessions (HTTP only).')
+@click.option('--seed', 'random_seed', default=0, show_default=True)
+def run_command(output, requests_count, warmup, only, seller_email, url, concurrency, random_seed):
+    """Benchmark the main routes and write the results as JSON."""
+    rng = random.Random(random_seed)
+    seller_email = seller_email or _default_seller()
+    listing_ids = [listing_id for (listing_id,) in db.session.query(Listing.id).filter_by(status='active')
+                   .order_by(Listing.id.desc()).limit(1000)]
+    if not listing_ids:
+        raise click.ClickException("No active listings to view; run 'flask bench seed' first")
+    database = db.engine.dialect.name
+    db.session.remove()
+
+    if url:
+        make_driver = lambda: HTTPDriver(url)
+    else:
+        if concurrency != 1:
+            raise click.BadParameter('only supported with --url', param_hint='--concurrency')
+        make_driver = lambda: TestClientDriver(current_app._get_current_object())
+        # Per-request debug logging would dominate in-process timings
+        current_app.logger.setLevel('WARNING')
+
+    sessions = {}
+    results = {}
+    for route in bench_routes(seller_email, listing_ids):
+        name, email = route[0], route[1]
+        if only and name not in only:
+            continue
+        if email not in sessions:
+            sessions[email] = [log_in(make_driver(), email) for _ in range(concurrency)]
+        results[name] = _run_route(sessions[email], route, requests_count, warmup, rng)
+        latency = results[name]['latency_ms'] or {}
+        click.echo(f"{name}: {results[name]['throughput_rps']} req/s, p50 {latency.get('p50')}ms, "
+                   f"p95 {latency.get('p95')}ms, p99 {latency.get('p99')}ms, "
+                   f"{(results[name]['queries'] or {}).get('p50')} queries, {results[name]['errors']} errors")
+
+    report = {
+        'meta': {
+            'commit': _git_commit(),
+            'database': database,
+            'mode': 'http' if url else 'test-client',
+            'url': url,
+            'concurrency': concurrency,
+            'requests_per_route': requests_count,
+            'timestamp': datetime.utcnow().isoformat(timespec='seconds') + 'Z',
+            'python': platform.python_version(),
+            'dataset': _dataset(),
+        },
+        'routes': results,
+    }
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    click.echo(f"Wrote {output}")
+
+def _change(before, after):
+    if before in (None, 0) or after is None:
+        return ''
+    return f' ({(after - before) / before * 100:+.1f}%)'
+
+@bench_cli.command('compare')
+@click.argument('baseline', type=click.File())
+@click.argument('candidate', type=click.File())
+def compare_command(baseline, candidate):
+    """Compare two 'flask bench run' result files route by route."""
+    before, after = json.load(baseline), json.load(candidate)
+    click.echo(f"{before['meta'].get('commit')} ({before['meta']['database']}) -> "
+               f"{after['meta'].get('commit')} ({after['meta']['database']})")
+    for name, new in after['routes'].items():
+        old = before['routes'].get(name)
+        if old is None or not old['latency_ms'] or not new['latency_ms']:
+            click.echo(f"{name}: no baseline")
+            continue
+        parts = [f"{p} {old['latency_ms'][p]} -> {new['latency_ms'][p]}ms{_change(old['latency_ms'][p], new['latency_ms'][p])}"
+                 for p in ('p50', 'p95', 'p99')]
+        old_queries = (old['queries'] or {}).get('p50')
+        new_queries = (new['queries'] or {}).get('p50')
+        parts.append(f"queries {old_queries} -> {new_queries}")
+        parts.append(f"{old['throughput_rps']} -> {new['throughput_rps']} req/s")
+        click.echo(f"{name}: " + ', '.join(parts))
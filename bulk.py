@@ -0,0 +1,462 @@
+"""Bulk listing work: import, export and set-based updates.
+
+Import and export use CSV or JSON Lines.
+
+Both formats carry the ``ListingForm`` fields, custom fields and photo
+references. In CSV, custom fields are ``field:<name>`` columns and
+``photos`` is a space-separated list; in JSONL, ``custom_fields`` is a list
+of ``{"name": ..., "value": ...}`` objects (or a plain mapping) and
+``photos`` a list. A photo reference names an already stored blob, either
+by its path as exported (``blobs/ab/cd/<sha256>.jpg``) or by its SHA-256.
+Exports also carry ``id`` and ``status`` for reference; imports ignore
+them and imported listings start out active.
+
+Imports read the file lazily and validate every row with the
+``ListingForm`` rules. Valid rows are inserted ``BULK_IMPORT_BATCH_SIZE``
+at a time with multi-row inserts and one commit per batch, and rejected
+rows are reported by line number without stopping the import. Exports are
+generators, so memory stays flat however many listings a seller has.
+
+The bulk operations (price change by percentage, status change, delete)
+act on every listing matching a list of conditions. Each one runs as a
+handful of ``UPDATE``/``DELETE`` statements over chunks of IDs, so a
+thousand listings cost a few statements rather than a thousand requests.
+The caller commits the whole operation as one transaction.
+"""
+import csv
+import json
+import os
+import re
+from collections import Counter
+from datetime import datetime
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import delete, func, insert, or_, select, update
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import selectinload
+from werkzeug.datastructures import MultiDict
+from wtforms import FieldList, FormField
+
+from app import db
+from cache import invalidate_feed, invalidate_listing
+from forms import CustomFieldForm, ListingForm
+from images import process_photos_async
+from jobs import CANCELLED, RUNNING, enqueue_listing_syncs
+from models import (Blob, CustomField, Listing, OutboundJob, Photo, PlatformPollState, PlatformSyncState,
+                    User)
+from notifications import delete_listing_notifications
+from stats import record_listings_created, record_listings_deleted, record_status_changes
+from storage import adjust_references, blob_path, delete_listing_photos
+
+bulk_cli = AppGroup('bulk', help='Bulk listing import and export.')
+
+FORMATS = ('csv', 'jsonl')
+EXTENSIONS = {'.csv': 'csv', '.jsonl': 'jsonl', '.ndjson': 'jsonl'}
+MIMETYPES = {'csv': 'text/csv', 'jsonl': 'application/x-ndjson'}
+LISTING_FIELDS = ('title', 'description', 'price', 'location', 'negotiable')
+FIELD_PREFIX = 'field:'
+FALSE_VALUES = ('', '0', 'false', 'no', 'n', 'off')
+SHA256 = re.compile(r'^[0-9a-f]{64}$')
+EXPORT_BATCH_SIZE = 500
+
+class RowError(Exception):
+    """A row that cannot be imported."""
+
+class _RowCustomFieldForm(CustomFieldForm):
+    class Meta:
+        csrf = False
+
+class _RowForm(ListingForm):
+    """``ListingForm`` for rows that did not come from a browser."""
+
+    class Meta:
+        csrf = False
+
+    custom_fields = FieldList(FormField(_RowCustomFieldForm), min_entries=1)
+
+class ImportResult:
+    def __init__(self):
+        self.created = 0
+        self.errors = []
+
+    def add_error(self, line, message):
+        self.errors.append((line, message))
+
+def detect_format(filename):
+    return EXTENSIONS.get(os.path.splitext(filename or '')[1].lower())
+
+def _csv_records(lines):
+    reader = csv.DictReader(lines)
+    if not reader.fieldnames or 'title' not in reader.fieldnames:
+        yield 1, RowError('expected a header row with at least a title column')
+        return
+    while True:
+        try:
+            row = next(reader)
+        except StopIteration:
+            return
+        except csv.Error as e:
+            yield reader.line_num, RowError(f'malformed CSV: {e}')
+            continue
+        record = {name: row.get(name) for name in LISTING_FIELDS}
+        record['custom_fields'] = [(key[len(FIELD_PREFIX):], value) for key, value in row.items()
+                                   if key and key.startswith(FIELD_PREFIX)]
+        record['photos'] = (row.get('photos') or '').split()
+        # line_num counts physical lines, so quoted newlines don't skew it
+        yield reader.line_num, record
+
+def _jsonl_records(lines):
+    for line_number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield line_number, RowError(f'invalid JSON: {e}')
+            continue
+        if not isinstance(row, dict):
+            yield line_number, RowError('expected a JSON object')
+            continue
+        custom_fields = row.get('custom_fields') or []
+        if isinstance(custom_fields, dict):
+            custom_fields = list(custom_fields.items())
+        else:
+            custom_fields = [(field.get('name'), field.get('value')) for field in custom_fields
+                             if isinstance(field, dict)]
+        photos = row.get('photos') or []
+        record = {name: row.get(name) for name in LISTING_FIELDS}
+        record['custom_fields'] = custom_fields
+        record['photos'] = photos if isinstance(photos, list) else str(photos).split()
+        yield line_number, record
+
+def _photo_sha256(reference):
+    sha256 = os.path.splitext(os.path.basename(str(reference)))[0].lower()
+    if not SHA256.match(sha256):
+        raise RowError(f'photos: {reference!r} is not a stored photo reference')
+    return sha256
+
+def _validate(record):
+    """Run ``record`` through ``ListingForm`` and return the cleaned row."""
+    formdata = MultiDict()
+    for name in ('title', 'description', 'price', 'location'):
+        if record[name] is not None:
+            formdata.add(name, str(record[name]))
+    negotiable = record['negotiable']
+    if negotiable is True or (negotiable not in (None, False) and str(negotiable).strip().lower() not in FALSE_VALUES):
+        formdata.add('negotiable', 'y')
+    for i, (name, value) in enumerate(record['custom_fields']):
+        formdata.add(f'custom_fields-{i}-name', '' if name is None else str(name))
+        formdata.add(f'custom_fields-{i}-value', '' if value is None else str(value))
+
+    form = _RowForm(formdata=formdata)
+    if not form.validate():
+        raise RowError('; '.join(f"{name}: {' '.join(map(str, messages))}"
+                                 for name, messages in form.errors.items()))
+    return {
+        'values': {
+            'title': form.title.data,
+            'description': form.description.data,
+            'price': form.price.data,
+            'location': form.location.data,
+            'negotiable': form.negotiable.data,
+        },
+        # Same rule as create_listing: blank custom fields are dropped
+        'custom_fields': [(field['name'], field['value']) for field in form.custom_fields.data
+                          if field['name'] and field['value']],
+        'photos': [_photo_sha256(reference) for reference in record['photos']],
+    }
+
+def _insert_batch(user_id, rows, post):
+    """Insert validated ``rows``; return the new listing and photo IDs. Does not commit."""
+    now = datetime.utcnow()
+    listing_ids = db.session.execute(
+        insert(Listing).returning(Listing.id, sort_by_parameter_order=True),
+        [dict(row['values'], user_id=user_id, status='active', created_at=now) for row in rows],
+    ).scalars().all()
+
+    custom_fields = [{'listing_id': listing_id, 'name': name, 'value': value}
+                     for listing_id, row in zip(listing_ids, rows)
+                     for name, value in row['custom_fields']]
+    if custom_fields:
+        db.session.execute(insert(CustomField), custom_fields)
+
+    photos = [{'listing_id': listing_id, 'blob_id': blob.id, 'filename': blob_path(blob.sha256, blob.extension)}
+              for listing_id, row in zip(listing_ids, rows)
+              for blob in row['blobs']]
+    photo_ids = []
+    if photos:
+        photo_ids = db.session.execute(
+            insert(Photo).returning(Photo.id, sort_by_parameter_order=True), photos
+        ).scalars().all()
+        primary = {}
+        for photo_id, photo in zip(photo_ids, photos):
+            primary.setdefault(photo['listing_id'], photo_id)
+        db.session.execute(update(Listing), [{'id': listing_id, 'primary_photo_id': photo_id}
+                                             for listing_id, photo_id in primary.items()])
+        adjust_references(Counter(photo['blob_id'] for photo in photos))
+
+    record_listings_created(user_id, len(listing_ids), now)
+    invalidate_feed()
+    if post:
+        enqueue_listing_syncs(listing_ids)
+    return listing_ids, photo_ids
+
+def _flush(user_id, rows, post, result):
+    wanted = {sha256 for row in rows for sha256 in row['photos']}
+    blobs = {blob.sha256: blob for blob in Blob.query.filter(Blob.sha256.in_(wanted))} if wanted else {}
+    valid = []
+    for row in rows:
+        missing = next((sha256 for sha256 in row['photos'] if sha256 not in blobs), None)
+        if missing:
+            result.add_error(row['line'], f'photos: no stored photo {missing}')
+            continue
+        row['blobs'] = [blobs[sha256] for sha256 in row['photos']]
+        valid.append(row)
+    if not valid:
+        return
+
+    try:
+        listing_ids, photo_ids = _insert_batch(user_id, valid, post)
+        db.session.commit()
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        if len(valid) == 1:
+            result.add_error(valid[0]['line'], f'could not be saved: {getattr(e, "orig", None) or e}')
+            return
+        # Retry row by row so the error lands on the rows that caused it
+        current_app.logger.warning("Bulk import batch failed, retrying row by row: %s", e)
+        for row in valid:
+            _flush(user_id, [row], post, result)
+        return
+
+    result.created += len(listing_ids)
+    if photo_ids:
+        process_photos_async(Photo.query.filter(Photo.id.in_(photo_ids)).all())
+
+def import_listings(user, lines, fmt, batch_size=None, post=None):
+    """Import listings for ``user`` from an iterable of text ``lines``.
+
+    ``post`` queues platform syncs for the new listings and defaults to the
+    user's cross-platform posting setting. Returns an ``ImportResult``.
+    """
+    user_id = user.id
+    if post is None:
+        post = user.enable_cross_platform_posting
+    batch_size = batch_size or current_app.config['BULK_IMPORT_BATCH_SIZE']
+    records = _csv_records(lines) if fmt == 'csv' else _jsonl_records(lines)
+    result = ImportResult()
+    batch = []
+    line = 0
+    try:
+        for line, record in records:
+            try:
+                if isinstance(record, RowError):
+                    raise record
+                row = _validate(record)
+            except RowError as e:
+                result.add_error(line, str(e))
+                continue
+            row['line'] = line
+            batch.append(row)
+            if len(batch) >= batch_size:
+                _flush(user_id, batch, post, result)
+                batch = []
+    except UnicodeDecodeError:
+        result.add_error(line + 1, 'the file is not UTF-8 text; stopped here')
+    if batch:
+        _flush(user_id, batch, post, result)
+    current_app.logger.info("Bulk import for user %s: %d created, %d rejected",
+                            user_id, result.created, len(result.errors))
+    return result
+
+def _export_batches(user_id):
+    last_id = 0
+    while True:
+        listings = (Listing.query
+                    .options(selectinload(Listing.custom_fields), selectinload(Listing.photos))
+                    .filter(Listing.user_id == user_id, Listing.id > last_id)
+                    .order_by(Listing.id)
+                    .limit(EXPORT_BATCH_SIZE).all())
+        if not listings:
+            return
+        yield listings
+        last_id = listings[-1].id
+
+class _Echo:
+    """File-like object that hands back what ``csv.writer`` writes."""
+
+    def write(self, value):
+        return value
+
+def _export_csv(user_id):
+    names = [name for (name,) in db.session.query(CustomField.name).join(Listing)
+             .filter(Listing.user_id == user_id).distinct().order_by(CustomField.name)]
+    writer = csv.writer(_Echo())
+    yield writer.writerow(['id', *LISTING_FIELDS, 'status', 'photos', *(FIELD_PREFIX + name for name in names)])
+    for listings in _export_batches(user_id):
+        chunk = []
+        for listing in listings:
+            fields = {field.name: field.value for field in listing.custom_fields}
+            chunk.append(writer.writerow([
+                listing.id, listing.title, listing.description, listing.price, listing.location,
+                'yes' if listing.negotiable else 'no', listing.status,
+                ' '.join(photo.filename for photo in listing.photos),
+                *(fields.get(name, '') for name in names),
+            ]))
+        yield ''.join(chunk)
+
+def _export_jsonl(user_id):
+    for listings in _export_batches(user_id):
+        yield ''.join(json.dumps({
+            'id': listing.id,
+            'title': listing.title,
+            'description': listing.description,
+            'price': listing.price,
+            'location': listing.location,
+            'negotiable': bool(listing.negotiable),
+            'status': listing.status,
+            'custom_fields': [{'name': field.name, 'value': field.value} for field in listing.custom_fields],
+            'photos': [photo.filename for photo in listing.photos],
+        }) + '\n' for listing in listings)
+
+def export_listings(user_id, fmt):
+    """Generate the user's listings as ``fmt`` text, a batch at a time."""
+    return _export_csv(user_id) if fmt == 'csv' else _export_jsonl(user_id)
+
+OPERATION_CHUNK_SIZE = 500
+STATUSES = ('active', 'sold', 'deleted')
+
+def listing_conditions(user_id=None, listing_ids=None, status=None):
+    """Where-clauses selecting the listings a bulk operation applies to."""
+    conditions = []
+    if user_id is not None:
+        conditions.append(Listing.user_id == user_id)
+    if listing_ids is not None:
+        conditions.append(Listing.id.in_(listing_ids))
+    if status:
+        conditions.append(Listing.status == status)
+    return conditions
+
+def _locked_rows(conditions, *columns):
+    """Lock and return the matching listings, in chunks of IDs."""
+    rows = db.session.execute(select(Listing.id, *columns).where(*conditions)
+                              .order_by(Listing.id).with_for_update()).all()
+    return [rows[i:i + OPERATION_CHUNK_SIZE] for i in range(0, len(rows), OPERATION_CHUNK_SIZE)]
+
+def change_prices(conditions, percent, post=False):
+    """Change matching prices by ``percent``; return how many changed.
+
+    ``post`` queues platform syncs for them. Does not commit.
+    """
+    factor = 1 + percent / 100
+    listing_ids = db.session.execute(
+        update(Listing).where(*conditions)
+        .values(price=func.round(Listing.price * factor, 2))
+        .returning(Listing.id)
+        .execution_options(synchronize_session=False)
+    ).scalars().all()
+    for listing_id in listing_ids:
+        invalidate_listing(listing_id)
+    if post:
+        enqueue_listing_syncs(listing_ids)
+    return len(listing_ids)
+
+def change_statuses(conditions, status):
+    """Move matching listings to ``status``; return how many changed. Does not commit."""
+    now = datetime.utcnow()
+    changed = 0
+    for rows in _locked_rows(conditions + [Listing.status != status], Listing.status, Listing.sold_at):
+        listing_ids = [row.id for row in rows]
+        record_status_changes(rows, status, now)
+        db.session.execute(update(Listing).where(Listing.id.in_(listing_ids))
+                           .values(status=status, sold_at=now if status == 'sold' else None)
+                           .execution_options(synchronize_session=False))
+        for listing_id in listing_ids:
+            invalidate_listing(listing_id)
+        changed += len(rows)
+    return changed
+
+def delete_listings(conditions):
+    """Delete matching listings and everything hanging off them. Does not commit.
+
+    Returns how many were deleted.
+    """
+    deleted = 0
+    for rows in _locked_rows(conditions, Listing.user_id, Listing.status, Listing.created_at, Listing.sold_at):
+        listing_ids = [row.id for row in rows]
+        delete_listing_photos(listing_ids)
+        # Rows that only make sense while the listing exists
+        for model in (CustomField, PlatformPollState, PlatformSyncState):
+            db.session.execute(delete(model).where(model.listing_id.in_(listing_ids))
+                               .execution_options(synchronize_session=False))
+        # A worker may be running some jobs right now and will write their
+        # outcome; deleting those rows under it would crash it
+        db.session.execute(update(OutboundJob)
+                           .where(OutboundJob.listing_id.in_(listing_ids), OutboundJob.status == RUNNING)
+                           .values(status=CANCELLED, listing_id=None, last_error='Listing deleted',
+                                   updated_at=datetime.utcnow())
+                           .execution_options(synchronize_session=False))
+        db.session.execute(delete(OutboundJob).where(OutboundJob.listing_id.in_(listing_ids))
+                           .execution_options(synchronize_session=False))
+        delete_listing_notifications(listing_ids)
+        record_listings_deleted(rows)
+        db.session.execute(delete(Listing).where(Listing.id.in_(listing_ids))
+                           .execution_options(synchronize_session=False))
+        for listing_id in listing_ids:
+            invalidate_listing(listing_id)
+        deleted += len(rows)
+    return deleted
+
+def apply_bulk_action(action, conditions, percent=None, post=False):
+    """Run a ``BulkListingForm`` action: ``price``, ``delete`` or a status name."""
+    if action == 'price':
+        return change_prices(conditions, percent, post)
+    if action == 'delete':
+        return delete_listings(conditions)
+    if action in STATUSES:
+        return change_statuses(conditions, action)
+    raise ValueError(f'unknown bulk action {action!r}')
+
+def bulk_form_conditions(form, listing_ids, user_id=None):
+    """Conditions for a submitted ``BulkListingForm``, or ``None`` if nothing was selected."""
+    if form.scope.data == 'selected':
+        if not listing_ids:
+            return None
+        return listing_conditions(user_id=user_id, listing_ids=listing_ids)
+    return listing_conditions(user_id=user_id, status=form.filter_status.data)
+
+def _find_user(identifier):
+    user = User.query.filter(or_(User.email == identifier, User.username == identifier)).first()
+    if user is None:
+        raise click.BadParameter(f'no user {identifier!r}', param_hint='--user')
+    return user
+
+@bulk_cli.command('import')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--user', 'identifier', required=True, help='Owner of the listings, by email or username.')
+@click.option('--format', 'fmt', type=click.Choice(FORMATS), help='Defaults to the file extension.')
+@click.option('--batch-size', type=int, help='Rows per transaction [default: BULK_IMPORT_BATCH_SIZE].')
+@click.option('--post/--no-post', default=None, help="Queue platform syncs [default: the owner's setting].")
+def import_command(path, identifier, fmt, batch_size, post):
+    """Import listings from a CSV or JSONL file."""
+    user = _find_user(identifier)
+    fmt = fmt or detect_format(path)
+    if fmt is None:
+        raise click.BadParameter('cannot tell the format from the file name', param_hint='--format')
+    with open(path, encoding='utf-8-sig', newline='') as f:
+        result = import_listings(user, f, fmt, batch_size, post)
+    for line, message in result.errors:
+        click.echo(f"line {line}: {message}", err=True)
+    click.echo(f"Imported {result.created} listing(s), rejected {len(result.errors)} row(s).")
+
+@bulk_cli.command('export')
+@click.option('--user', 'identifier', required=True, help='Owner of the listings, by email or username.')
+@click.option('--format', 'fmt', type=click.Choice(FORMATS), default='csv', show_default=True)
+@click.option('--output', '-o', type=click.File('w', encoding='utf-8'), default='-', help='Defaults to stdout.')
+def export_command(identifier, fmt, output):
+    """Export a user's listings as CSV or JSONL."""
+    user = _find_user(identifier)
+    for chunk in export_listings(user.id, fmt):
+        output.write(chunk)
@@ -0,0 +1,181 @@
+"""Response cache for public pages.
+
+Anonymous GETs of cached views are served from a pluggable backend: an
+in-process LRU by default, or Redis (or anything speaking its protocol)
+when ``CACHE_BACKEND`` is ``redis``. Keys embed version counters, one per
+listing plus one for the listing feed, so invalidating is a counter bump
+and stale entries simply age out. Bumps are deferred until the surrounding
+transaction commits; bumping earlier would let a concurrent request cache
+the old data under the new version.
+
+Cached responses carry a strong ``ETag`` and ``Last-Modified`` so browsers
+and CDNs can revalidate with a 304.
+
+The LRU backend is per process. With several workers use Redis, or keep
+``CACHE_TTL`` short to bound how long other workers serve an old page.
+"""
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from functools import wraps
+
+from flask import current_app, has_app_context, make_response, request, session
+from flask_login import current_user
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app import db
+
+FEED_VERSION = 'listings'
+
+class LRUBackend:
+    """Thread-safe in-process cache with per-entry expiry."""
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        # Kept apart from the entries so LRU eviction never resets a version
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            value, expires = item
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def version(self, name):
+        with self._lock:
+            return self._versions.get(name, 0)
+
+    def bump(self, name):
+        with self._lock:
+            self._versions[name] = self._versions.get(name, 0) + 1
+
+class RedisBackend:
+    """Cache shared by every worker through Redis."""
+
+    def __init__(self, url, prefix='resell:cache:'):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("CACHE_BACKEND is 'redis' but the redis package is not installed")
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def get(self, key):
+        raw = self.client.get(self.prefix + key)
+        return json.loads(raw) if raw is not None else None
+
+    def set(self, key, value, ttl):
+        self.client.setex(self.prefix + key, ttl, json.dumps(value))
+
+    def version(self, name):
+        return int(self.client.get(f'{self.prefix}version:{name}') or 0)
+
+    def bump(self, name):
+        self.client.incr(f'{self.prefix}version:{name}')
+
+def init_cache(app):
+    if app.config['CACHE_BACKEND'] == 'redis':
+        backend = RedisBackend(app.config['CACHE_REDIS_URL'])
+    else:
+        backend = LRUBackend(app.config['CACHE_MAX_ENTRIES'])
+    app.extensions['response_cache'] = backend
+
+def get_cache():
+    return current_app.extensions['response_cache']
+
+def listing_version(listing_id):
+    return f'listing:{listing_id}'
+
+def invalidate_listing(listing_id):
+    """Expire cached pages showing ``listing_id`` once the session commits."""
+    db.session.info.setdefault('changed_listings', set()).add(listing_id)
+
+def invalidate_feed():
+    """Expire cached feed pages once the session commits.
+
+    For new listings, which no cached page can show yet.
+    """
+    db.session.info.setdefault('changed_listings', set())
+
+@event.listens_for(Session, 'after_commit')
+def _bump_versions(session):
+    changed = session.info.pop('changed_listings', None)
+    if changed is None or not has_app_context() or 'response_cache' not in current_app.extensions:
+        return
+    cache = get_cache()
+    for listing_id in changed:
+        cache.bump(listing_version(listing_id))
+    cache.bump(FEED_VERSION)
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_versions(session):
+    session.info.pop('changed_listings', None)
+
+def _cacheable():
+    # Flashed messages and logged-in chrome are per visitor
+    return (current_app.config['CACHE_TTL'] > 0 and request.method == 'GET'
+            and not current_user.is_authenticated and '_flashes' not in session)
+
+def _to_response(entry):
+    response = make_response(entry['body'], entry['status'])
+    response.mimetype = entry['mimetype']
+    response.set_etag(entry['etag'])
+    response.last_modified = datetime.fromisoformat(entry['last_modified'])
+    response.cache_control.public = True
+    response.cache_control.no_cache = True
+    response.vary.add('Cookie')
+    return response.make_conditional(request)
+
+def cached_page(versions):
+    """Cache a view for anonymous visitors.
+
+    ``versions`` maps the view's keyword arguments to the names of the
+    version counters the page depends on.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if not _cacheable():
+                return view(*args, **kwargs)
+            cache = get_cache()
+            stamp = ','.join(f'{name}={cache.version(name)}' for name in versions(**kwargs))
+            key = f'page:{request.full_path}:{stamp}'
+            entry = cache.get(key)
+            if entry is not None:
+                return _to_response(entry)
+
+            response = make_response(view(*args, **kwargs))
+            # A response that sets a cookie (e.g. a fresh session) is personal
+            if response.status_code != 200 or response.headers.get('Set-Cookie') or session.modified:
+                return response
+            body = response.get_data(as_text=True)
+            entry = {
+                'body': body,
+                'status': response.status_code,
+                'mimetype': response.mimetype,
+                'etag': hashlib.sha256(body.encode()).hexdigest(),
+                'last_modified': datetime.now(timezone.utc).replace(microsecond=0).isoformat(),
+            }
+            cache.set(key, entry, current_app.config['CACHE_TTL'])
+            return _to_response(entry)
+        return wrapper
+    return decorator
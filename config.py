@@ -7,6 +7,124 @@ class Config:
     UPLOADED_PHOTOS_DEST = os.path.join(os.path.dirname(__file__), 'static/uploads')
     GOOGLE_CLIENT_ID = os.environ.get("GOOGLE_CLIENT_ID", None)
     GOOGLE_CLIENT_SECRET = os.environ.get("GOOGLE_CLIENT_SECRET", None)
-    GOOGLE_DISCOVERY_URL = (
-        "https://accounts.google.com/.well-known/openid-configuration"
+    GOOGLE_DISCOVERY_URL = os.environ.get(
+        "GOOGLE_DISCOVERY_URL", "https://accounts.google.com/.well-known/openid-configuration"
     )
+    # Google sign-in (see oidc.py): timeout for calls to the provider, and how
+    # long to cache discovery and keys when its responses carry no cache headers
+    OIDC_TIMEOUT = float(os.environ.get('OIDC_TIMEOUT', 5))
+    OIDC_CACHE_TTL = int(os.environ.get('OIDC_CACHE_TTL', 3600))
+
+    # Startup. Deployments use ProductionConfig (APP_CONFIG=config.ProductionConfig),
+    # where the schema is left to 'flask db upgrade'.
+    AUTO_CREATE_TABLES = os.environ.get('AUTO_CREATE_TABLES', 'true').lower() in ('1', 'true', 'yes')
+
+    # Logging (see logs.py). LOG_LEVELS overrides LOG_LEVEL per logger and
+    # LOG_DEBUG_SAMPLING keeps a fraction of DEBUG records, both as
+    # "name=value,name=value". LOG_FORMAT applies when LOG_JSON is off.
+    LOG_LEVEL = os.environ.get('LOG_LEVEL', 'DEBUG')
+    LOG_LEVELS = os.environ.get('LOG_LEVELS', '')
+    LOG_DEBUG_SAMPLING = os.environ.get('LOG_DEBUG_SAMPLING', '')
+    LOG_FORMAT = os.environ.get('LOG_FORMAT', '%(levelname)s:%(name)s:%(message)s')
+    LOG_JSON = os.environ.get('LOG_JSON', '').lower() in ('1', 'true', 'yes')
+    LOG_FILE = os.environ.get('LOG_FILE') or None
+    LOG_QUEUE = os.environ.get('LOG_QUEUE', 'true').lower() in ('1', 'true', 'yes')
+
+    # Outbound job queue (see jobs.py)
+    JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', 5))
+    JOB_RETRY_BASE_DELAY = int(os.environ.get('JOB_RETRY_BASE_DELAY', 30))
+    JOB_RETRY_MAX_DELAY = int(os.environ.get('JOB_RETRY_MAX_DELAY', 3600))
+    JOB_LEASE_SECONDS = int(os.environ.get('JOB_LEASE_SECONDS', 300))
+
+    # Comment poller (see poller.py)
+    POLL_BATCH_SIZE = int(os.environ.get('POLL_BATCH_SIZE', 100))
+    POLL_MIN_INTERVAL = int(os.environ.get('POLL_MIN_INTERVAL', 60))
+    POLL_MAX_INTERVAL = int(os.environ.get('POLL_MAX_INTERVAL', 6 * 3600))
+    POLL_SOLD_INTERVAL = int(os.environ.get('POLL_SOLD_INTERVAL', 24 * 3600))
+
+    # External platform clients (see external_platforms.py). Without an API
+    # URL a platform falls back to its simulated behaviour.
+    OFFERUP_API_URL = os.environ.get('OFFERUP_API_URL')
+    FACEBOOK_MARKETPLACE_API_URL = os.environ.get('FACEBOOK_MARKETPLACE_API_URL')
+    PLATFORM_TIMEOUT = float(os.environ.get('PLATFORM_TIMEOUT', 10))
+    PLATFORM_MAX_WORKERS = int(os.environ.get('PLATFORM_MAX_WORKERS', 8))
+    PLATFORM_BREAKER_THRESHOLD = int(os.environ.get('PLATFORM_BREAKER_THRESHOLD', 5))
+    PLATFORM_BREAKER_RESET = int(os.environ.get('PLATFORM_BREAKER_RESET', 30))
+
+    # Photo derivatives (see images.py)
+    IMAGE_VARIANT_WIDTHS = (320, 640, 1280)
+    IMAGE_QUALITY = int(os.environ.get('IMAGE_QUALITY', 80))
+    IMAGE_WORKERS = int(os.environ.get('IMAGE_WORKERS', 2))
+
+    # Photo uploads (see uploads.py). MAX_CONTENT_LENGTH bounds any request
+    # body; resumable uploads send each photo in chunks of UPLOAD_CHUNK_SIZE.
+    MAX_CONTENT_LENGTH = int(os.environ.get('MAX_CONTENT_LENGTH', 64 * 1024 * 1024))
+    UPLOAD_MAX_FILE_SIZE = int(os.environ.get('UPLOAD_MAX_FILE_SIZE', 20 * 1024 * 1024))
+    UPLOAD_MAX_FILES = int(os.environ.get('UPLOAD_MAX_FILES', 20))
+    UPLOAD_CHUNK_SIZE = int(os.environ.get('UPLOAD_CHUNK_SIZE', 4 * 1024 * 1024))
+    UPLOAD_MAX_SESSIONS = int(os.environ.get('UPLOAD_MAX_SESSIONS', 100))
+    UPLOAD_SESSION_TTL = int(os.environ.get('UPLOAD_SESSION_TTL', 24 * 3600))
+    # A chunk write that has not finished by then is presumed dead
+    UPLOAD_CHUNK_LEASE = int(os.environ.get('UPLOAD_CHUNK_LEASE', 300))
+
+    # Feed page sizes (see pagination.py)
+    LISTINGS_PER_PAGE = int(os.environ.get('LISTINGS_PER_PAGE', 12))
+    NOTIFICATIONS_PER_PAGE = int(os.environ.get('NOTIFICATIONS_PER_PAGE', 20))
+
+    # Listings per transaction in bulk imports (see bulk.py)
+    BULK_IMPORT_BATCH_SIZE = int(os.environ.get('BULK_IMPORT_BATCH_SIZE', 500))
+
+    # Anonymous page cache (see cache.py): 'lru' or 'redis'
+    CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'lru')
+    CACHE_REDIS_URL = os.environ.get('CACHE_REDIS_URL', 'redis://localhost:6379/0')
+    CACHE_MAX_ENTRIES = int(os.environ.get('CACHE_MAX_ENTRIES', 1024))
+    CACHE_TTL = int(os.environ.get('CACHE_TTL', 300))
+
+    # Password hashing (see passwords.py): a Werkzeug method string; hashes made
+    # with another one are upgraded at the next login. With PASSWORD_VERIFY_WORKERS
+    # > 0, checks run on that many threads per process and logins beyond
+    # PASSWORD_VERIFY_MAX_PENDING waiting are refused with a 503.
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+    PASSWORD_VERIFY_WORKERS = int(os.environ.get('PASSWORD_VERIFY_WORKERS', 0))
+    PASSWORD_VERIFY_MAX_PENDING = int(os.environ.get('PASSWORD_VERIFY_MAX_PENDING', 8))
+    PASSWORD_VERIFY_TIMEOUT = float(os.environ.get('PASSWORD_VERIFY_TIMEOUT', 5))
+
+    # Signed-in user cache (see user_cache.py): 'memory' or 'redis' for the
+    # version counters. USER_CACHE_TTL = 0 turns it off.
+    USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL', 60))
+    USER_CACHE_MAX_ENTRIES = int(os.environ.get('USER_CACHE_MAX_ENTRIES', 10000))
+    USER_CACHE_BACKEND = os.environ.get('USER_CACHE_BACKEND', 'memory')
+    USER_CACHE_REDIS_URL = os.environ.get('USER_CACHE_REDIS_URL', CACHE_REDIS_URL)
+
+    # Static assets (see assets.py). ASSETS_SENDFILE hands file bodies to a
+    # front proxy: None, 'x-sendfile' or 'x-accel-redirect'.
+    ASSETS_BUILD_ON_STARTUP = os.environ.get('ASSETS_BUILD_ON_STARTUP', '').lower() in ('1', 'true', 'yes')
+    ASSETS_SENDFILE = os.environ.get('ASSETS_SENDFILE') or None
+    ASSETS_ACCEL_PREFIX = os.environ.get('ASSETS_ACCEL_PREFIX', '/_static/')
+
+    # Request metrics on /admin/metrics (see metrics.py). METRICS_TOKEN lets a
+    # scraper authenticate with "Authorization: Bearer <token>" instead.
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN') or None
+    SLOW_REQUEST_SECONDS = float(os.environ.get('SLOW_REQUEST_SECONDS', 1.0))
+    SLOW_REQUEST_MAX_STATEMENTS = int(os.environ.get('SLOW_REQUEST_MAX_STATEMENTS', 20))
+    # Add Server-Timing and X-Query-Count headers to responses, for
+    # 'flask bench run --url'. Leave off in production.
+    METRICS_SERVER_TIMING = os.environ.get('METRICS_SERVER_TIMING', '').lower() in ('1', 'true', 'yes')
+
+    # Live notifications (see events.py): broker 'memory' or 'redis'. Each
+    # open stream holds a worker thread, so cap them per worker.
+    EVENTS_BROKER = os.environ.get('EVENTS_BROKER', 'memory')
+    EVENTS_REDIS_URL = os.environ.get('EVENTS_REDIS_URL', 'redis://localhost:6379/0')
+    SSE_MAX_CONNECTIONS = int(os.environ.get('SSE_MAX_CONNECTIONS', 50))
+    SSE_HEARTBEAT = int(os.environ.get('SSE_HEARTBEAT', 15))
+    SSE_MAX_SECONDS = int(os.environ.get('SSE_MAX_SECONDS', 300))
+    SSE_RETRY_MS = int(os.environ.get('SSE_RETRY_MS', 5000))
+    SSE_REPLAY_LIMIT = int(os.environ.get('SSE_REPLAY_LIMIT', 50))
+
+class ProductionConfig(Config):
+    AUTO_CREATE_TABLES = os.environ.get('AUTO_CREATE_TABLES', '').lower() in ('1', 'true', 'yes')
+    LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+    LOG_FORMAT = os.environ.get('LOG_FORMAT', '%(asctime)s %(levelname)s [%(process)d] %(name)s: %(message)s')
+    LOG_JSON = os.environ.get('LOG_JSON', 'true').lower() in ('1', 'true', 'yes')
+    PASSWORD_VERIFY_WORKERS = int(os.environ.get('PASSWORD_VERIFY_WORKERS', 2))
@@ -1,10 +1,10 @@
 from app import create_app, db
 from models import User
-from werkzeug.security import generate_password_hash
+from passwords import hash_password
 import logging
 
 def create_admin_user():
-    app = create_app()
+    app = create_app(web=False, cli=False)
     with app.app_context():
         logging.basicConfig(level=logging.INFO)
         logger = logging.getLogger(__name__)
@@ -14,7 +14,7 @@ def create_admin_user():
             new_admin = User(
                 username='admin',
                 email='admin@example.com',
-                password_hash=generate_password_hash('adminpassword'),
+                password_hash=hash_password('adminpassword'),
                 is_admin=True
             )
             db.session.add(new_admin)
@@ -28,7 +28,7 @@ def create_admin_user():
         # Verify admin user
         admin_user = User.query.filter_by(is_admin=True).first()
         if admin_user:
-            logger.info(f"Admin user verified: {admin_user.username} (ID: {admin_user.id})")
+            logger.info("Admin user verified: %s (ID: %s)", admin_user.username, admin_user.id)
         else:
             logger.error("Failed to verify admin user in the database")
 
@@ -0,0 +1,216 @@
+"""Live notifications over Server-Sent Events.
+
+``/notifications/stream`` pushes each new ``Notification`` to its user's
+open pages. Notifications are published through a broker once the
+transaction that created them commits. The default broker is in-process
+and only reaches streams in the same process; ``EVENTS_BROKER = 'redis'``
+shares events between workers and with the poller. With the in-process
+broker each heartbeat also checks the database, so notifications from
+other processes still arrive within ``SSE_HEARTBEAT`` seconds.
+
+Event IDs are notification IDs, so a reconnecting ``EventSource`` sends
+``Last-Event-ID`` and gets whatever it missed from the database. Each
+stream holds a worker thread, hence the per-worker cap
+(``SSE_MAX_CONNECTIONS``) and the lifetime limit after which the browser
+reconnects by itself.
+"""
+import json
+import queue
+import threading
+import time
+
+from flask import Blueprint, Response, current_app, has_app_context, request, stream_with_context
+from flask_login import current_user, login_required
+from sqlalchemy import event, func
+from sqlalchemy.orm import Session
+
+from app import db
+from models import Notification
+
+events = Blueprint('events', __name__)
+
+class InProcessBroker:
+    shared = False
+
+    def __init__(self):
+        self._queues = {}
+        self._lock = threading.Lock()
+
+    def publish(self, user_id, message):
+        with self._lock:
+            targets = list(self._queues.get(user_id, ()))
+        for target in targets:
+            target.put(message)
+
+    def subscribe(self, user_id):
+        target = queue.Queue(maxsize=100)
+        with self._lock:
+            self._queues.setdefault(user_id, set()).add(target)
+        return InProcessSubscription(self, user_id, target)
+
+    def _unsubscribe(self, user_id, target):
+        with self._lock:
+            targets = self._queues.get(user_id)
+            if targets is not None:
+                targets.discard(target)
+                if not targets:
+                    del self._queues[user_id]
+
+class InProcessSubscription:
+    def __init__(self, broker, user_id, target):
+        self.broker = broker
+        self.user_id = user_id
+        self.target = target
+
+    def get(self, timeout):
+        try:
+            return self.target.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.broker._unsubscribe(self.user_id, self.target)
+
+class RedisBroker:
+    shared = True
+
+    def __init__(self, url, prefix='resell:notifications:'):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("EVENTS_BROKER is 'redis' but the redis package is not installed")
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def publish(self, user_id, message):
+        self.client.publish(f'{self.prefix}{user_id}', json.dumps(message))
+
+    def subscribe(self, user_id):
+        pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(f'{self.prefix}{user_id}')
+        return RedisSubscription(pubsub)
+
+class RedisSubscription:
+    def __init__(self, pubsub):
+        self.pubsub = pubsub
+
+    def get(self, timeout):
+        message = self.pubsub.get_message(timeout=timeout)
+        return json.loads(message['data']) if message else None
+
+    def close(self):
+        self.pubsub.close()
+
+def init_events(app):
+    if app.config['EVENTS_BROKER'] == 'redis':
+        broker = RedisBroker(app.config['EVENTS_REDIS_URL'])
+    else:
+        broker = InProcessBroker()
+    app.extensions['events_broker'] = broker
+    app.extensions['sse_slots'] = threading.BoundedSemaphore(app.config['SSE_MAX_CONNECTIONS'])
+
+def notification_message(notification):
+    return {
+        'id': notification.id,
+        'user_id': notification.user_id,
+        'listing_id': notification.listing_id,
+        'content': notification.content,
+        'platform': notification.platform,
+        'timestamp': notification.timestamp.isoformat() if notification.timestamp else None,
+    }
+
+def queue_notification_events(notifications):
+    """Publish ``notifications`` (already flushed) once the session commits."""
+    db.session.info.setdefault('notification_events', []).extend(
+        notification_message(notification) for notification in notifications)
+
+@event.listens_for(Session, 'after_commit')
+def _publish_events(session):
+    messages = session.info.pop('notification_events', None)
+    if not messages or not has_app_context() or 'events_broker' not in current_app.extensions:
+        return
+    broker = current_app.extensions['events_broker']
+    for message in messages:
+        try:
+            broker.publish(message['user_id'], message)
+        except Exception as e:
+            # The rows are committed; live delivery is best effort
+            current_app.logger.error("Error publishing notification %s: %s", message['id'], e)
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_events(session):
+    session.info.pop('notification_events', None)
+
+def _missed(user_id, last_id, limit):
+    try:
+        rows = (Notification.query
+                .filter(Notification.user_id == user_id, Notification.id > last_id)
+                .order_by(Notification.id)
+                .limit(limit).all())
+        return [notification_message(row) for row in rows]
+    finally:
+        # Give the connection back; a stream can stay open for minutes
+        db.session.remove()
+
+def _format(message):
+    return f"id: {message['id']}\nevent: notification\ndata: {json.dumps(message)}\n\n"
+
+@events.route('/notifications/stream')
+@login_required
+def notification_stream():
+    slots = current_app.extensions['sse_slots']
+    if not slots.acquire(blocking=False):
+        response = Response('Too many live connections', status=503, mimetype='text/plain')
+        response.headers['Retry-After'] = '30'
+        return response
+
+    config = current_app.config
+    user_id = current_user.id
+    broker = current_app.extensions['events_broker']
+    try:
+        last_id = request.headers.get('Last-Event-ID', type=int)
+        if last_id is None:
+            # A fresh stream starts from the newest notification, so anything
+            # after it is caught up on (see the heartbeat below)
+            last_id = (db.session.query(func.coalesce(func.max(Notification.id), 0))
+                       .filter(Notification.user_id == user_id).scalar())
+        # Don't hold a connection for the life of the stream
+        db.session.remove()
+        subscription = broker.subscribe(user_id)
+    except Exception:
+        slots.release()
+        raise
+
+    def close():
+        subscription.close()
+        slots.release()
+
+    def generate(last_id):
+        deadline = time.monotonic() + config['SSE_MAX_SECONDS']
+        # Tell the browser how soon to come back after we hang up
+        yield f"retry: {config['SSE_RETRY_MS']}\n\n"
+        # Also covers anything committed between the query above and subscribing
+        for message in _missed(user_id, last_id, config['SSE_REPLAY_LIMIT']):
+            last_id = message['id']
+            yield _format(message)
+        while time.monotonic() < deadline:
+            message = subscription.get(timeout=config['SSE_HEARTBEAT'])
+            if message is not None:
+                if message['id'] > last_id:
+                    last_id = message['id']
+                    yield _format(message)
+                continue
+            if not broker.shared:
+                for message in _missed(user_id, last_id, config['SSE_REPLAY_LIMIT']):
+                    last_id = message['id']
+                    yield _format(message)
+            yield ': heartbeat\n\n'
+
+    response = Response(stream_with_context(generate(last_id)), mimetype='text/event-stream')
+    # The server closes the response even if the body is never read, e.g.
+    # when the client goes away first; a generator's finally would not run
+    response.call_on_close(close)
+    response.headers['Cache-Control'] = 'no-cache'
+    # Stop nginx from buffering the stream
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
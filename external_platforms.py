@@ -1,79 +1,331 @@
+import click
+import hashlib
+import json
 import requests
+import threading
+import time
 from abc import ABC, abstractmethod
-from models import Notification, db
+from concurrent.futures import ThreadPoolExecutor, wait
+from requests.adapters import HTTPAdapter
 from flask import current_app
+from flask.cli import AppGroup
+from metrics import add_platform_wait, observe_platform_call
+
+platforms_cli = AppGroup('platforms', help='External platform commands.')
+
+class CircuitOpenError(Exception):
+    pass
+
+class CircuitBreaker:
+    """Skip calls to a platform after ``failure_threshold`` consecutive failures.
+
+    Once open, calls are refused for ``reset_timeout`` seconds; after that a
+    single trial call is let through and its outcome closes or re-opens the
+    breaker.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    def allow(self):
+        with self._lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half-open' and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial_in_flight or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self._trial_in_flight = False
 
 class ExternalPlatform(ABC):
+    name = None
+    config_prefix = None
+    # Listing fields the platform displays; changes elsewhere are not pushed
+    synced_fields = ('title', 'description', 'price', 'location', 'negotiable', 'photos')
+
+    def __init__(self, base_url=None, timeout=10, pool_size=10, failure_threshold=5, reset_timeout=30):
+        self.base_url = base_url.rstrip('/') if base_url else None
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+
+    def call(self, method, *args):
+        """Invoke ``method`` through the circuit breaker."""
+        if not self.breaker.allow():
+            observe_platform_call(self.name, method, 0.0, 'circuit_open')
+            raise CircuitOpenError(f"{self.name} is unavailable, skipping until its circuit closes")
+        start = time.perf_counter()
+        try:
+            result = getattr(self, method)(*args)
+        except Exception:
+            observe_platform_call(self.name, method, time.perf_counter() - start, 'error')
+            self.breaker.record_failure()
+            raise
+        observe_platform_call(self.name, method, time.perf_counter() - start, 'ok')
+        self.breaker.record_success()
+        return result
+
+    def _request(self, method, path, **kwargs):
+        response = self.session.request(method, self.base_url + path, timeout=self.timeout, **kwargs)
+        response.raise_for_status()
+        return response.json()
+
+    def _create(self, payload):
+        # A create that timed out on our side may still have gone through, and
+        # the job retrying it sends the same key, so it cannot post a duplicate
+        return self._request('POST', '/listings', json=payload,
+                             headers={'Idempotency-Key': f"listing-{payload['id']}"})
+
+    def content_hash(self, payload):
+        """Hash of the fields this platform cares about, used for delta sync."""
+        fields = {field: payload.get(field) for field in self.synced_fields}
+        return hashlib.sha256(json.dumps(fields, sort_keys=True).encode()).hexdigest()
+
+    @abstractmethod
+    def post_listing(self, payload):
+        """Publish a listing given as a ``listing_payload`` dict.
+
+        Returns the platform's response; its ``id`` is kept as the remote ID.
+        """
+        pass
+
     @abstractmethod
-    def post_listing(self, listing):
+    def update_listing(self, remote_id, payload):
+        """Replace the remote copy of a previously posted listing."""
         pass
 
     @abstractmethod
-    def check_comments(self, listing):
+    def check_comments(self, listing_id, cursor=None):
+        """Return ``(comments, cursor)`` for comments newer than ``cursor``.
+
+        Each comment is a dict with ``id``, ``content`` and ``platform``. The
+        returned cursor is stored by the poller and passed back next time.
+        """
         pass
 
 class OfferUpPlatform(ExternalPlatform):
-    def post_listing(self, listing):
+    name = 'OfferUp'
+    config_prefix = 'OFFERUP'
+
+    def post_listing(self, payload):
+        if self.base_url:
+            return self._create(payload)
+        # TODO: Implement OfferUp API integration
+        pass
+
+    def update_listing(self, remote_id, payload):
+        if self.base_url:
+            return self._request('PUT', f'/listings/{remote_id}', json=payload)
         # TODO: Implement OfferUp API integration
         pass
 
-    def check_comments(self, listing):
+    def check_comments(self, listing_id, cursor=None):
+        if self.base_url:
+            data = self._request('GET', f'/listings/{listing_id}/comments', params={'since': cursor or ''})
+            return [dict(comment, platform=self.name) for comment in data['comments']], data['cursor']
         # TODO: Implement OfferUp API integration to check for new comments
-        # For now, we'll simulate a new comment
+        # For now, we'll simulate a single comment per listing
+        comment_id = f'offerup-{listing_id}-1'
+        if cursor == comment_id:
+            return [], cursor
         new_comment = {
+            'id': comment_id,
             'content': 'Is this item still available?',
-            'platform': 'OfferUp'
+            'platform': self.name
         }
-        self._create_notification(listing, new_comment)
+        return [new_comment], comment_id
 
 class FacebookMarketplacePlatform(ExternalPlatform):
-    def post_listing(self, listing):
+    name = 'Facebook Marketplace'
+    config_prefix = 'FACEBOOK_MARKETPLACE'
+
+    def post_listing(self, payload):
+        if self.base_url:
+            return self._create(payload)
+        # TODO: Implement Facebook Marketplace API integration
+        pass
+
+    def update_listing(self, remote_id, payload):
+        if self.base_url:
+            return self._request('PUT', f'/listings/{remote_id}', json=payload)
         # TODO: Implement Facebook Marketplace API integration
         pass
 
-    def check_comments(self, listing):
+    def check_comments(self, listing_id, cursor=None):
+        if self.base_url:
+            data = self._request('GET', f'/listings/{listing_id}/comments', params={'since': cursor or ''})
+            return [dict(comment, platform=self.name) for comment in data['comments']], data['cursor']
         # TODO: Implement Facebook Marketplace API integration to check for new comments
-        # For now, we'll simulate a new comment
+        # For now, we'll simulate a single comment per listing
+        comment_id = f'facebook-{listing_id}-1'
+        if cursor == comment_id:
+            return [], cursor
         new_comment = {
+            'id': comment_id,
             'content': 'Can you provide more details about the condition?',
-            'platform': 'Facebook Marketplace'
+            'platform': self.name
         }
-        self._create_notification(listing, new_comment)
-
-    def _create_notification(self, listing, comment):
-        notification = Notification(
-            user_id=listing.user_id,
-            listing_id=listing.id,
-            content=comment['content'],
-            platform=comment['platform']
-        )
-        db.session.add(notification)
-        db.session.commit()
-
-def post_to_external_platforms(listing):
-    platforms = [
-        OfferUpPlatform(),
-        FacebookMarketplacePlatform(),
-    ]
-    
-    results = []
-    for platform in platforms:
-        try:
-            result = platform.post_listing(listing)
-            results.append({"platform": platform.__class__.__name__, "success": True, "result": result})
-        except Exception as e:
-            results.append({"platform": platform.__class__.__name__, "success": False, "error": str(e)})
-    
+        return [new_comment], comment_id
+
+PLATFORMS = {
+    OfferUpPlatform.name: OfferUpPlatform,
+    FacebookMarketplacePlatform.name: FacebookMarketplacePlatform,
+}
+
+class PlatformRegistry:
+    """Long-lived platform instances plus a bounded pool to call them on."""
+
+    def __init__(self, platforms, max_workers=8, wait_timeout=None):
+        self.platforms = {platform.name: platform for platform in platforms}
+        self.max_workers = max_workers
+        self.wait_timeout = wait_timeout
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        platforms = [
+            platform_class(
+                base_url=config.get(f'{platform_class.config_prefix}_API_URL'),
+                timeout=config['PLATFORM_TIMEOUT'],
+                pool_size=config['PLATFORM_MAX_WORKERS'],
+                failure_threshold=config['PLATFORM_BREAKER_THRESHOLD'],
+                reset_timeout=config['PLATFORM_BREAKER_RESET'],
+            )
+            for platform_class in PLATFORMS.values()
+        ]
+        return cls(platforms, max_workers=config['PLATFORM_MAX_WORKERS'],
+                   wait_timeout=config['PLATFORM_TIMEOUT'] * 2)
+
+    def get(self, name):
+        return self.platforms[name]
+
+    def names(self):
+        return list(self.platforms)
+
+    @property
+    def executor(self):
+        # Created on first use so forked workers each get their own threads
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                        thread_name_prefix='platform')
+        return self._executor
+
+    def fan_out(self, calls):
+        """Run ``(platform name, method, args)`` calls concurrently.
+
+        Returns one ``(success, result_or_exception)`` tuple per call, in
+        order. Calls not finished after ``wait_timeout`` are reported as
+        timed out. Those still queued are cancelled and never run; those
+        already running are bounded by the per-request timeout, and creates
+        carry an idempotency key so that retrying one cannot duplicate it.
+        """
+        start = time.perf_counter()
+        futures = [self.executor.submit(self.get(name).call, method, *args) for name, method, args in calls]
+        wait(futures, timeout=self.wait_timeout)
+        add_platform_wait(time.perf_counter() - start)
+        outcomes = []
+        for future in futures:
+            if not future.done():
+                future.cancel()
+                outcomes.append((False, TimeoutError('Platform call timed out')))
+            elif future.exception() is not None:
+                outcomes.append((False, future.exception()))
+            else:
+                outcomes.append((True, future.result()))
+        return outcomes
+
+def init_platforms(app):
+    app.extensions['platforms'] = PlatformRegistry.from_config(app.config)
+
+def get_registry():
+    return current_app.extensions['platforms']
+
+def get_platform(name):
+    return get_registry().get(name)
+
+def listing_payload(listing):
+    """Serialize a listing for the platforms.
+
+    Built on the calling thread so that pool threads never touch the
+    database session.
+    """
+    return {
+        'id': listing.id,
+        'title': listing.title,
+        'description': listing.description,
+        'price': listing.price,
+        'location': listing.location,
+        'negotiable': listing.negotiable,
+        'photos': [photo.filename for photo in listing.photos],
+        'custom_fields': {field.name: field.value for field in listing.custom_fields},
+    }
+
+def check_external_platforms_comments(listing, cursors):
+    """Fetch new comments for ``listing`` from the platforms in ``cursors``.
+
+    ``cursors`` maps platform name to the cursor stored for it. Returns a
+    dict of platform name to ``(comments, cursor)``; platforms that fail are
+    logged and left out so their cursor stays where it was.
+    """
+    names = list(cursors)
+    outcomes = get_registry().fan_out([(name, 'check_comments', (listing.id, cursors[name])) for name in names])
+
+    results = {}
+    for name, (success, value) in zip(names, outcomes):
+        if success:
+            results[name] = value
+        else:
+            current_app.logger.error("Error checking comments on %s: %s", name, value)
     return results
 
-def check_external_platforms_comments(listing):
-    platforms = [
-        OfferUpPlatform(),
-        FacebookMarketplacePlatform(),
-    ]
-    
-    for platform in platforms:
-        try:
-            platform.check_comments(listing)
-        except Exception as e:
-            current_app.logger.error(f"Error checking comments on {platform.__class__.__name__}: {str(e)}")
+@platforms_cli.command('probe')
+@click.option('--rounds', default=3, show_default=True, help='Fan-out rounds to run.')
+def probe_command(rounds):
+    """Post a dummy listing to every platform and report timings.
+
+    Point the ``*_API_URL`` settings at ``platform_stub.py`` to watch the
+    fan-out and circuit breakers without touching the real services.
+    """
+    registry = get_registry()
+    payload = {'id': 0, 'title': 'Probe', 'description': '', 'price': 0, 'location': '',
+               'negotiable': False, 'photos': [], 'custom_fields': {}}
+    for round_number in range(1, rounds + 1):
+        started = time.perf_counter()
+        outcomes = registry.fan_out([(name, 'post_listing', (payload,)) for name in registry.names()])
+        elapsed = time.perf_counter() - started
+        click.echo(f"Round {round_number}: {elapsed:.3f}s")
+        for name, (success, value) in zip(registry.names(), outcomes):
+            status = 'ok' if success else f'failed ({value})'
+            click.echo(f"  {name}: {status}, breaker {registry.get(name).breaker.state}")
@@ -1,6 +1,7 @@
 from flask_wtf import FlaskForm
+from flask_wtf.file import FileField, FileRequired
 from wtforms import StringField, TextAreaField, FloatField, BooleanField, PasswordField, SubmitField, FieldList, FormField, SelectField
-from wtforms.validators import DataRequired, Email, EqualTo, ValidationError
+from wtforms.validators import DataRequired, Email, EqualTo, NumberRange, Optional, ValidationError
 from models import User
 
 class LoginForm(FlaskForm):
@@ -39,6 +40,33 @@ class ListingForm(FlaskForm):
     custom_fields = FieldList(FormField(CustomFieldForm), min_entries=1)
     submit = SubmitField('Create Listing')
 
+class ImportListingsForm(FlaskForm):
+    file = FileField('CSV or JSONL file', validators=[FileRequired()])
+    submit = SubmitField('Import')
+
+class BulkListingForm(FlaskForm):
+    action = SelectField('Action', choices=[('price', 'Change price by %'), ('sold', 'Mark sold'),
+                                            ('active', 'Mark active'), ('deleted', 'Delete')])
+    percent = FloatField('Percent', validators=[Optional(), NumberRange(min=-99, max=1000)])
+    scope = SelectField('Apply to', choices=[('selected', 'Selected listings'), ('matching', 'All listings with status')])
+    filter_status = SelectField('Status', choices=[('', 'Any'), ('active', 'Active'), ('sold', 'Sold'),
+                                                   ('deleted', 'Deleted')], default='')
+    submit = SubmitField('Apply')
+
+    def validate(self, extra_validators=None):
+        if not super().validate(extra_validators):
+            return False
+        # Optional() ends the field's own validator chain, so check here
+        if self.action.data == 'price' and self.percent.data is None:
+            self.percent.errors.append('Enter the percentage to change prices by.')
+            return False
+        return True
+
+class AdminBulkListingForm(BulkListingForm):
+    action = SelectField('Action', choices=[('price', 'Change price by %'), ('sold', 'Mark sold'),
+                                            ('active', 'Mark active'), ('deleted', 'Mark deleted'),
+                                            ('delete', 'Delete permanently')])
+
 class AdminUserForm(FlaskForm):
     username = StringField('Username', validators=[DataRequired()])
     email = StringField('Email', validators=[DataRequired(), Email()])
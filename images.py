@@ -0,0 +1,171 @@
+"""Responsive image derivatives for listing photos.
+
+Originals stay as uploaded; each photo gets resized WebP and JPEG copies at
+``IMAGE_VARIANT_WIDTHS`` next to its blob, recorded as ``PhotoVariant`` rows
+so templates can build ``srcset`` lists. Encoding runs on a process pool
+after the request has committed, photos of an already processed blob reuse
+its variants, and ``flask images backfill`` covers photos uploaded before
+the pipeline existed or whose processing was lost.
+"""
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+from app import db
+from cache import invalidate_listing
+from models import Photo, PhotoVariant
+
+images_cli = AppGroup('images', help='Photo derivative commands.')
+
+VARIANT_DIR = 'variants'
+FORMATS = {'webp': 'WEBP', 'jpeg': 'JPEG'}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def generate_variants(source_path, output_dir, relative_dir, stem, widths, quality):
+    """Write resized copies of ``source_path`` and describe them.
+
+    Runs in a worker process, so it only takes and returns plain data.
+    Orientation is baked in from EXIF and no metadata is written out.
+    """
+    # Imported here so web processes, which only queue the work, never load Pillow
+    from PIL import Image, ImageOps
+
+    os.makedirs(output_dir, exist_ok=True)
+    with Image.open(source_path) as original:
+        image = ImageOps.exif_transpose(original)
+        image = image.convert('RGB')
+
+    # Never upscale; a small original still gets one variant at its own width
+    targets = sorted({min(width, image.width) for width in widths})
+    variants = []
+    for width in targets:
+        height = max(1, round(image.height * width / image.width))
+        resized = image if width == image.width else image.resize((width, height), Image.LANCZOS)
+        for extension, pil_format in FORMATS.items():
+            filename = f'{stem}-{width}.{extension}'
+            resized.save(os.path.join(output_dir, filename), pil_format,
+                         quality=quality, optimize=True)
+            variants.append({
+                'width': width,
+                'height': height,
+                'format': extension,
+                'filename': f'{relative_dir}/{filename}',
+            })
+    return variants
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ProcessPoolExecutor(max_workers=current_app.config['IMAGE_WORKERS'])
+    return _executor
+
+def _job_args(photo):
+    config = current_app.config
+    if photo.blob is not None:
+        # Stored next to the blob and named after its hash, so every photo
+        # sharing the blob shares the variants and GC removes them together
+        relative_dir = os.path.dirname(photo.filename)
+        stem = photo.blob.sha256
+    else:
+        relative_dir = VARIANT_DIR
+        stem = str(photo.id)
+    return (
+        os.path.join(config['UPLOAD_FOLDER'], photo.filename),
+        os.path.join(config['UPLOAD_FOLDER'], relative_dir),
+        relative_dir,
+        stem,
+        config['IMAGE_VARIANT_WIDTHS'],
+        config['IMAGE_QUALITY'],
+    )
+
+def _existing_variants(photo):
+    """Variants already generated for another photo of the same blob."""
+    if photo.blob_id is None:
+        return []
+    return (PhotoVariant.query.join(Photo)
+            .filter(Photo.blob_id == photo.blob_id, Photo.id != photo.id)
+            .order_by(PhotoVariant.photo_id, PhotoVariant.id)
+            .all())
+
+def _copy_variants(photo, variants):
+    source_photo_id = variants[0].photo_id
+    record_variants(photo, [
+        {'width': v.width, 'height': v.height, 'format': v.format, 'filename': v.filename}
+        for v in variants if v.photo_id == source_photo_id
+    ])
+
+def record_variants(photo, variants):
+    PhotoVariant.query.filter_by(photo_id=photo.id).delete()
+    for variant in variants:
+        db.session.add(PhotoVariant(photo_id=photo.id, **variant))
+    # Cached pages still point at the original upload
+    invalidate_listing(photo.listing_id)
+
+def _on_done(app, photo_id, future):
+    with app.app_context():
+        try:
+            variants = future.result()
+        except Exception as e:
+            app.logger.error("Error generating variants for photo %s: %s", photo_id, e)
+            return
+        photo = db.session.get(Photo, photo_id)
+        if photo is None:
+            return
+        record_variants(photo, variants)
+        db.session.commit()
+
+def process_photos_async(photos):
+    """Queue derivative generation for committed ``photos``."""
+    app = current_app._get_current_object()
+    copied = False
+    for photo in photos:
+        existing = _existing_variants(photo)
+        if existing:
+            _copy_variants(photo, existing)
+            copied = True
+            continue
+        future = _get_executor().submit(generate_variants, *_job_args(photo))
+        future.add_done_callback(partial(_on_done, app, photo.id))
+    if copied:
+        db.session.commit()
+
+@images_cli.command('backfill')
+@click.option('--batch-size', default=50, show_default=True, help='Photos processed per transaction.')
+def backfill_command(batch_size):
+    """Generate variants for photos that have none."""
+    processed = 0
+    last_id = 0
+    executor = _get_executor()
+    while True:
+        photos = (Photo.query
+                  .filter(Photo.id > last_id, ~Photo.variants.any())
+                  .order_by(Photo.id)
+                  .limit(batch_size).all())
+        if not photos:
+            break
+        futures = []
+        for photo in photos:
+            existing = _existing_variants(photo)
+            if existing:
+                _copy_variants(photo, existing)
+                processed += 1
+            else:
+                futures.append((photo, executor.submit(generate_variants, *_job_args(photo))))
+        for photo, future in futures:
+            try:
+                record_variants(photo, future.result())
+                processed += 1
+            except Exception as e:
+                current_app.logger.error("Error generating variants for photo %s: %s", photo.id, e)
+        db.session.commit()
+        last_id = photos[-1].id
+    click.echo(f"Generated variants for {processed} photo(s).")
@@ -0,0 +1,281 @@
+"""Durable outbound job queue for cross-platform posting.
+
+Routes only enqueue rows in ``outbound_job`` inside their own transaction;
+``flask jobs work`` claims due jobs in batches, syncs each batch to the
+external platforms concurrently and records the outcome, retrying failures
+with exponential backoff. ``platform_sync_state`` remembers the remote ID
+and content hash per platform so unchanged listings are never re-sent.
+"""
+import json
+import os
+import random
+import socket
+import time
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import and_, insert, or_, select, update
+from sqlalchemy.orm import contains_eager
+
+from app import db
+from models import Listing, OutboundJob, PlatformSyncState
+from external_platforms import get_registry, listing_payload
+
+jobs_cli = AppGroup('jobs', help='Outbound job queue commands.')
+
+PENDING = 'pending'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+SKIPPED = 'skipped'
+
+class EnqueueResult:
+    """What ``enqueue_listing_post`` did, per platform."""
+
+    def __init__(self):
+        self.jobs = []
+        # Platforms skipped because a job is already waiting to run...
+        self.pending = []
+        # ...or because they already have this version of the listing
+        self.synced = []
+
+def enqueue_listing_post(listing):
+    """Queue a sync of ``listing`` to every platform whose copy is stale.
+
+    Does not commit; the jobs become visible together with the listing
+    change that caused them. Platforms whose stored content hash already
+    matches the listing, or that already have a pending job for it, are
+    skipped; the worker always syncs the listing as it is when the job runs.
+    Returns an ``EnqueueResult``.
+    """
+    registry = get_registry()
+    payload = listing_payload(listing)
+    synced = {
+        state.platform: state.content_hash
+        for state in PlatformSyncState.query.filter_by(listing_id=listing.id)
+    }
+    pending = {
+        platform for (platform,) in db.session.query(OutboundJob.platform).filter_by(
+            listing_id=listing.id, status=PENDING
+        )
+    }
+    result = EnqueueResult()
+    for name in registry.names():
+        if name in pending:
+            result.pending.append(name)
+            continue
+        if synced.get(name) == registry.get(name).content_hash(payload):
+            result.synced.append(name)
+            continue
+        job = OutboundJob(
+            listing_id=listing.id,
+            platform=name,
+            action='sync',
+            status=PENDING,
+            attempts=0,
+            max_attempts=current_app.config['JOB_MAX_ATTEMPTS'],
+            run_at=datetime.utcnow(),
+        )
+        db.session.add(job)
+        result.jobs.append(job)
+    return result
+
+def enqueue_listing_syncs(listing_ids):
+    """Queue a sync to every platform for many listings at once.
+
+    The set-based counterpart of ``enqueue_listing_post`` for bulk writes:
+    one query finds the pending jobs to skip and the rest go in as one
+    multi-row insert. Content hashes are not compared, so only call it for
+    listings whose platform payload changed. Does not commit.
+    """
+    if not listing_ids:
+        return 0
+    pending = set(db.session.query(OutboundJob.listing_id, OutboundJob.platform).filter(
+        OutboundJob.listing_id.in_(listing_ids), OutboundJob.status == PENDING))
+    now = datetime.utcnow()
+    rows = [
+        {'listing_id': listing_id, 'platform': name, 'action': 'sync', 'status': PENDING, 'attempts': 0,
+         'max_attempts': current_app.config['JOB_MAX_ATTEMPTS'], 'run_at': now}
+        for listing_id in listing_ids
+        for name in get_registry().names()
+        if (listing_id, name) not in pending
+    ]
+    if rows:
+        db.session.execute(insert(OutboundJob), rows)
+    return len(rows)
+
+def latest_jobs_for_listing(listing_id):
+    """Return the most recent job per platform for a listing."""
+    latest = {}
+    jobs = OutboundJob.query.filter_by(listing_id=listing_id).order_by(OutboundJob.id.desc()).limit(len(get_registry().names()) * 5)
+    for job in jobs:
+        latest.setdefault(job.platform, job)
+    return list(latest.values())
+
+def recent_jobs_for_user(user_id, limit=10):
+    return (OutboundJob.query.join(OutboundJob.listing)
+            .options(contains_eager(OutboundJob.listing))
+            .filter(Listing.user_id == user_id)
+            .order_by(OutboundJob.id.desc())
+            .limit(limit).all())
+
+def retry_delay(attempts):
+    base = current_app.config['JOB_RETRY_BASE_DELAY']
+    cap = current_app.config['JOB_RETRY_MAX_DELAY']
+    delay = min(cap, base * 2 ** max(attempts - 1, 0))
+    # Full jitter keeps retries from a platform outage from arriving in lockstep
+    return random.uniform(delay / 2, delay)
+
+def _claimable(now):
+    stale = now - timedelta(seconds=current_app.config['JOB_LEASE_SECONDS'])
+    return or_(
+        and_(OutboundJob.status == PENDING, OutboundJob.run_at <= now),
+        # A worker that died mid-job leaves it running; reclaim after the lease
+        and_(OutboundJob.status == RUNNING, OutboundJob.locked_at < stale),
+    )
+
+def claim_jobs(worker_id, batch_size=10):
+    """Atomically claim up to ``batch_size`` due jobs for ``worker_id``.
+
+    Each claim is a conditional UPDATE, so concurrent workers never run the
+    same job even on databases without ``SKIP LOCKED``.
+    """
+    now = datetime.utcnow()
+    candidates = db.session.execute(
+        select(OutboundJob.id)
+        .where(_claimable(now))
+        .order_by(OutboundJob.run_at, OutboundJob.id)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+    ).scalars().all()
+
+    claimed = []
+    for job_id in candidates:
+        result = db.session.execute(
+            update(OutboundJob)
+            .where(OutboundJob.id == job_id, _claimable(now))
+            .values(status=RUNNING, locked_by=worker_id, locked_at=now,
+                    attempts=OutboundJob.attempts + 1, updated_at=now)
+        )
+        if result.rowcount == 1:
+            claimed.append(job_id)
+    db.session.commit()
+
+    if not claimed:
+        return []
+    return OutboundJob.query.filter(OutboundJob.id.in_(claimed)).order_by(OutboundJob.id).all()
+
+def _finish(job, status, result=None, error=None):
+    job.status = status
+    job.result = json.dumps(result) if result is not None else None
+    job.last_error = error
+    job.locked_by = None
+    job.locked_at = None
+
+def _sync_states(jobs):
+    keys = {(job.listing_id, job.platform) for job in jobs}
+    if not keys:
+        return {}
+    states = PlatformSyncState.query.filter(
+        PlatformSyncState.listing_id.in_({listing_id for listing_id, _ in keys})
+    )
+    return {(state.listing_id, state.platform): state for state in states
+            if (state.listing_id, state.platform) in keys}
+
+def run_jobs(jobs):
+    """Run claimed jobs, syncing to the platforms concurrently.
+
+    A listing a platform has never seen is created there; one it already
+    has is updated in place, and only if its content hash changed.
+    """
+    registry = get_registry()
+    states = _sync_states(jobs)
+    runnable = []
+    calls = []
+    for job in jobs:
+        listing = job.listing
+        if listing is None or listing.status == 'deleted':
+            _finish(job, CANCELLED, error='Listing no longer exists')
+            continue
+        if job.attempts > job.max_attempts:
+            _finish(job, FAILED, error=job.last_error or 'Exceeded maximum attempts')
+            continue
+        payload = listing_payload(listing)
+        content_hash = registry.get(job.platform).content_hash(payload)
+        state = states.get((job.listing_id, job.platform))
+        if state is not None and state.content_hash == content_hash:
+            _finish(job, SKIPPED)
+            continue
+        if state is not None and state.remote_id:
+            job.action = 'update'
+            calls.append((job.platform, 'update_listing', (state.remote_id, payload)))
+        else:
+            job.action = 'create'
+            calls.append((job.platform, 'post_listing', (payload,)))
+        runnable.append((job, content_hash))
+
+    outcomes = registry.fan_out(calls)
+    # A job whose listing was deleted meanwhile has been cancelled (see
+    # bulk.delete_listings); leave it that way
+    still_running = set(db.session.scalars(select(OutboundJob.id).where(
+        OutboundJob.id.in_([job.id for job, _ in runnable]), OutboundJob.status == RUNNING)))
+    for (job, content_hash), (success, value) in zip(runnable, outcomes):
+        if job.id not in still_running:
+            continue
+        if success:
+            _finish(job, SUCCEEDED, result=value)
+            _record_sync(states, job, content_hash, value)
+            current_app.logger.info("Job %s synced listing %s to %s (%s)", job.id, job.listing_id, job.platform,
+                                    job.action)
+            continue
+        current_app.logger.warning("Job %s (%s, listing %s) failed: %s", job.id, job.platform, job.listing_id, value)
+        if job.attempts >= job.max_attempts:
+            _finish(job, FAILED, error=str(value))
+        else:
+            _finish(job, PENDING, error=str(value))
+            job.run_at = datetime.utcnow() + timedelta(seconds=retry_delay(job.attempts))
+    db.session.commit()
+    return jobs
+
+def _record_sync(states, job, content_hash, result):
+    state = states.get((job.listing_id, job.platform))
+    if state is None:
+        state = PlatformSyncState(listing_id=job.listing_id, platform=job.platform)
+        db.session.add(state)
+        states[(job.listing_id, job.platform)] = state
+    if isinstance(result, dict) and result.get('id') is not None:
+        state.remote_id = str(result['id'])
+    state.content_hash = content_hash
+    state.synced_at = datetime.utcnow()
+
+def run_worker(worker_id=None, batch_size=10, poll_interval=5.0, once=False):
+    """Process jobs until interrupted, or until the queue is empty if ``once``."""
+    worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+    processed = 0
+    while True:
+        try:
+            jobs = claim_jobs(worker_id, batch_size)
+            run_jobs(jobs)
+        except Exception:
+            # Claimed jobs stay running until their lease expires, then are retried
+            db.session.rollback()
+            current_app.logger.exception("Job batch failed")
+            time.sleep(poll_interval)
+            continue
+        processed += len(jobs)
+        if not jobs:
+            if once:
+                return processed
+            time.sleep(poll_interval)
+
+@jobs_cli.command('work')
+@click.option('--once', is_flag=True, help='Exit once no jobs are due.')
+@click.option('--batch-size', default=10, show_default=True, help='Jobs claimed per round trip.')
+@click.option('--poll-interval', default=5.0, show_default=True, help='Seconds to sleep when the queue is empty.')
+def work_command(once, batch_size, poll_interval):
+    """Run the outbound job worker."""
+    processed = run_worker(batch_size=batch_size, poll_interval=poll_interval, once=once)
+    click.echo(f"Processed {processed} job(s).")
@@ -0,0 +1,177 @@
+"""Logging setup.
+
+Records are put on an in-memory queue by a ``QueueHandler`` and written
+by a ``QueueListener`` thread, so a slow disk or pipe never holds up a
+request. Only the message itself is rendered on the calling thread.
+Levels and formatting come from config:
+
+- ``LOG_LEVEL`` is the root level. ``LOG_LEVELS`` overrides it per logger,
+  e.g. ``"app=DEBUG,werkzeug=WARNING,sqlalchemy.engine=INFO"``.
+- ``LOG_DEBUG_SAMPLING`` keeps only a fraction of DEBUG records per
+  logger, e.g. ``"app=0.05"``, for chatty debug lines in busy
+  processes.
+- ``LOG_JSON`` writes one JSON object per line. Every record made during
+  a request carries its request ID, which is taken from an incoming
+  ``X-Request-ID`` header or generated, and echoed on the response.
+- ``LOG_FILE`` writes to a file instead of stderr. ``LOG_QUEUE = False``
+  writes synchronously, which is mainly for comparing the two.
+
+When the server has already configured the root logger (e.g. gunicorn
+``--log-config``) its handlers are left alone and only levels are set.
+The listener is restarted in processes forked after startup, since
+threads do not survive a fork.
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import uuid
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+from flask import g, has_request_context, request
+
+# Marks the handler we install, so reconfiguring replaces it
+_OURS = '_resell_handler'
+_listener = None
+_queue_handler = None
+_target = None
+
+def parse_spec(spec, convert):
+    """``"a=x,b.c=y"`` -> ``{'a': convert('x'), 'b.c': convert('y')}``."""
+    result = {}
+    for item in (spec or '').split(','):
+        name, _, value = item.partition('=')
+        if name.strip() and value.strip():
+            result[name.strip()] = convert(value.strip())
+    return result
+
+def _rate_for(name, rates):
+    # The most specific configured ancestor wins: "app.jobs" before "app"
+    while name:
+        if name in rates:
+            return rates[name]
+        name = name.rpartition('.')[0]
+    return rates.get('root', 1.0)
+
+class ContextFilter(logging.Filter):
+    """Adds ``request_id`` and drops unsampled DEBUG records."""
+
+    def __init__(self, debug_sampling=None):
+        super().__init__()
+        self.debug_sampling = debug_sampling or {}
+
+    def filter(self, record):
+        if record.levelno <= logging.DEBUG and self.debug_sampling:
+            if random.random() >= _rate_for(record.name, self.debug_sampling):
+                return False
+        record.request_id = g.get('request_id') if has_request_context() else None
+        return True
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'process': record.process,
+            'thread': record.threadName,
+        }
+        if getattr(record, 'request_id', None):
+            entry['request_id'] = record.request_id
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        if not hasattr(record, 'request_id'):
+            record.request_id = None
+        return super().format(record)
+
+def _make_target(config):
+    handler = logging.FileHandler(config['LOG_FILE']) if config['LOG_FILE'] else logging.StreamHandler(sys.stderr)
+    handler.setFormatter(JSONFormatter() if config['LOG_JSON'] else TextFormatter(config['LOG_FORMAT']))
+    return handler
+
+def _start_listener():
+    global _listener
+    _queue_handler.queue = queue.SimpleQueue()
+    _listener = QueueListener(_queue_handler.queue, _target, respect_handler_level=True)
+    _listener.start()
+
+def _after_fork():
+    # The listener thread stayed behind in the parent; records queued in
+    # this process need one of their own
+    if _listener is not None:
+        _start_listener()
+
+def stop_logging():
+    """Flush queued records and stop the listener thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+def _remove_ours(root):
+    global _queue_handler, _target
+    stop_logging()
+    for handler in list(root.handlers):
+        if getattr(handler, _OURS, False):
+            root.removeHandler(handler)
+            handler.close()
+    if _target is not None:
+        _target.close()
+    _queue_handler = _target = None
+
+def configure_logging(app):
+    global _queue_handler, _target
+    config = app.config
+    root = logging.getLogger()
+    _remove_ours(root)
+
+    context = ContextFilter(parse_spec(config['LOG_DEBUG_SAMPLING'], float))
+    if not root.handlers:
+        _target = _make_target(config)
+        if config['LOG_QUEUE']:
+            _queue_handler = QueueHandler(queue.SimpleQueue())
+            handler = _queue_handler
+            _start_listener()
+        else:
+            handler = _target
+        setattr(handler, _OURS, True)
+        handler.addFilter(context)
+        root.addHandler(handler)
+    else:
+        for handler in root.handlers:
+            if not any(isinstance(f, ContextFilter) for f in handler.filters):
+                handler.addFilter(context)
+
+    level = config['LOG_LEVEL'].upper()
+    root.setLevel(level)
+    app.logger.setLevel(level)
+    for name, module_level in parse_spec(config['LOG_LEVELS'], str.upper).items():
+        logging.getLogger(name).setLevel(module_level)
+
+    app.before_request(_assign_request_id)
+    app.after_request(_echo_request_id)
+
+def _assign_request_id():
+    incoming = request.headers.get('X-Request-ID', '')
+    # Trust a caller's ID only if it looks like one
+    if 0 < len(incoming) <= 64 and incoming.replace('-', '').isalnum():
+        g.request_id = incoming
+    else:
+        g.request_id = uuid.uuid4().hex[:16]
+
+def _echo_request_id(response):
+    if g.get('request_id'):
+        response.headers['X-Request-ID'] = g.request_id
+    return response
+
+os.register_at_fork(after_in_child=_after_fork)
+atexit.register(stop_logging)
@@ -0,0 +1,234 @@
+"""Per-request instrumentation and Prometheus metrics.
+
+Every request records its latency, the number and total time of its SQL
+statements (from engine events), the time spent rendering templates and
+the time spent waiting on external platforms. They are aggregated into
+histograms per endpoint and served in the Prometheus text format on
+``/admin/metrics``. Requests slower than ``SLOW_REQUEST_SECONDS`` are
+logged together with their slowest statements.
+
+Metrics live in process memory: each worker reports its own numbers, so
+scrape every worker (or run one) to see the whole picture.
+"""
+import bisect
+import threading
+import time
+
+from flask import current_app, g, has_request_context, request, template_rendered, before_render_template
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs.extend(f'{name}="{value}"' for name, value in extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def _format_number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * len(self.buckets), 0, 0]
+            if index < len(self.buckets):
+                series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            snapshot = [(labels, list(counts), total, count) for labels, (counts, total, count) in self._series.items()]
+        for label_values, counts, total, count in sorted(snapshot):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = (('le', _format_number(float(bound))),)
+                lines.append(f'{self.name}_bucket{_format_labels(self.labels, label_values, le)} {cumulative}')
+            lines.append(f'{self.name}_bucket{_format_labels(self.labels, label_values, (("le", "+Inf"),))} {count}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labels, label_values)} {_format_number(total)}')
+            lines.append(f'{self.name}_count{_format_labels(self.labels, label_values)} {count}')
+        return lines
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self._lock:
+            snapshot = sorted(self._values.items())
+        for label_values, value in snapshot:
+            lines.append(f'{self.name}{_format_labels(self.labels, label_values)} {_format_number(value)}')
+        return lines
+
+REQUEST_SECONDS = Histogram('resell_request_duration_seconds', 'Time to produce a response.',
+                            ('endpoint', 'method', 'status'))
+REQUEST_QUERIES = Histogram('resell_request_sql_queries', 'SQL statements executed per request.',
+                            ('endpoint',), QUERY_BUCKETS)
+REQUEST_SQL_SECONDS = Histogram('resell_request_sql_duration_seconds', 'Time spent in SQL per request.',
+                                ('endpoint',))
+REQUEST_TEMPLATE_SECONDS = Histogram('resell_request_template_duration_seconds',
+                                     'Time spent rendering templates per request.', ('endpoint',))
+REQUEST_PLATFORM_SECONDS = Histogram('resell_request_platform_duration_seconds',
+                                     'Time spent waiting on external platforms per request.', ('endpoint',))
+TEMPLATE_SECONDS = Histogram('resell_template_render_duration_seconds', 'Time to render a template.',
+                             ('template',))
+PLATFORM_CALL_SECONDS = Histogram('resell_platform_call_duration_seconds', 'Duration of external platform calls.',
+                                  ('platform', 'method', 'outcome'))
+SLOW_REQUESTS = Counter('resell_slow_requests_total', 'Requests slower than SLOW_REQUEST_SECONDS.', ('endpoint',))
+
+METRICS = (REQUEST_SECONDS, REQUEST_QUERIES, REQUEST_SQL_SECONDS, REQUEST_TEMPLATE_SECONDS,
+           REQUEST_PLATFORM_SECONDS, TEMPLATE_SECONDS, PLATFORM_CALL_SECONDS, SLOW_REQUESTS)
+
+class RequestMetrics:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.statements = []
+        self.sql_seconds = 0.0
+        self.template_seconds = 0.0
+        self.platform_seconds = 0.0
+        self.template_starts = []
+        self.recorded = False
+
+def _current():
+    if has_request_context():
+        return g.get('request_metrics')
+    return None
+
+def observe_platform_call(platform, method, seconds, outcome):
+    """Record one platform call; safe to call from pool threads."""
+    PLATFORM_CALL_SECONDS.observe(seconds, platform, method, outcome)
+
+def add_platform_wait(seconds):
+    """Charge time spent waiting on platforms to the current request, if any."""
+    metrics = _current()
+    if metrics is not None:
+        metrics.platform_seconds += seconds
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None and _current() is not None:
+        context._metrics_start = time.perf_counter()
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = getattr(context, '_metrics_start', None)
+    metrics = _current()
+    if start is None or metrics is None:
+        return
+    elapsed = time.perf_counter() - start
+    metrics.sql_seconds += elapsed
+    metrics.statements.append((elapsed, statement))
+
+def _before_render(sender, template, context, **extra):
+    metrics = _current()
+    if metrics is not None:
+        metrics.template_starts.append(time.perf_counter())
+
+def _rendered(sender, template, context, **extra):
+    metrics = _current()
+    if metrics is None or not metrics.template_starts:
+        return
+    elapsed = time.perf_counter() - metrics.template_starts.pop()
+    # Time in nested render_template calls is counted by the outer one too
+    if not metrics.template_starts:
+        metrics.template_seconds += elapsed
+    TEMPLATE_SECONDS.observe(elapsed, template.name or 'string')
+
+def _start_request():
+    g.request_metrics = RequestMetrics()
+
+def _record(metrics, status):
+    metrics.recorded = True
+    elapsed = time.perf_counter() - metrics.start
+    endpoint = request.endpoint or 'unmatched'
+    REQUEST_SECONDS.observe(elapsed, endpoint, request.method, str(status))
+    REQUEST_QUERIES.observe(len(metrics.statements), endpoint)
+    REQUEST_SQL_SECONDS.observe(metrics.sql_seconds, endpoint)
+    REQUEST_TEMPLATE_SECONDS.observe(metrics.template_seconds, endpoint)
+    if metrics.platform_seconds:
+        REQUEST_PLATFORM_SECONDS.observe(metrics.platform_seconds, endpoint)
+
+    config = current_app.config
+    if elapsed < config['SLOW_REQUEST_SECONDS']:
+        return
+    SLOW_REQUESTS.inc(endpoint)
+    limit = config['SLOW_REQUEST_MAX_STATEMENTS']
+    current_app.logger.warning(
+        "Slow request %s %s (%s) took %.3fs: %d queries in %.3fs, templates %.3fs, platforms %.3fs%s",
+        request.method, request.full_path.rstrip('?'), endpoint, elapsed,
+        len(metrics.statements), metrics.sql_seconds, metrics.template_seconds,
+        metrics.platform_seconds, _SlowestStatements(metrics.statements, limit),
+    )
+
+class _SlowestStatements:
+    """Render the slowest statements only when the log record is formatted."""
+
+    def __init__(self, statements, limit):
+        self.statements = statements
+        self.limit = limit
+
+    def __str__(self):
+        slowest = sorted(self.statements, key=lambda item: item[0], reverse=True)
+        return ''.join(f"\n  {seconds * 1000:.1f}ms {' '.join(statement.split())[:500]}"
+                       for seconds, statement in slowest[:self.limit])
+
+def _finish_request(response):
+    metrics = _current()
+    if metrics is not None and not metrics.recorded:
+        _record(metrics, response.status_code)
+        if current_app.config['METRICS_SERVER_TIMING']:
+            response.headers['X-Query-Count'] = str(len(metrics.statements))
+            response.headers['Server-Timing'] = (f'db;dur={metrics.sql_seconds * 1000:.1f}, '
+                                                 f'tpl;dur={metrics.template_seconds * 1000:.1f}')
+    return response
+
+def _teardown_request(exc):
+    # after_request is skipped when an exception escapes every handler
+    metrics = _current()
+    if metrics is not None and not metrics.recorded:
+        _record(metrics, 500)
+
+def render_metrics():
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+def init_metrics(app):
+    if not app.config['METRICS_ENABLED']:
+        return
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    app.teardown_request(_teardown_request)
+    before_render_template.connect(_before_render, app)
+    template_rendered.connect(_rendered, app)
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
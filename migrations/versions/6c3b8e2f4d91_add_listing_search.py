@@ -0,0 +1,60 @@
+"""Add listing full-text search
+
+Revision ID: 6c3b8e2f4d91
+Revises: d82c3f5a6b07
+Create Date: 2026-10-18 15:41:07.552913
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6c3b8e2f4d91'
+down_revision = 'd82c3f5a6b07'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        op.execute(
+            "CREATE VIRTUAL TABLE listing_fts USING fts5("
+            "title, description, content='listing', content_rowid='id', tokenize='porter unicode61')"
+        )
+        op.execute(
+            "CREATE TRIGGER listing_fts_insert AFTER INSERT ON listing BEGIN "
+            "INSERT INTO listing_fts(rowid, title, description) VALUES (new.id, new.title, new.description); END"
+        )
+        op.execute(
+            "CREATE TRIGGER listing_fts_delete AFTER DELETE ON listing BEGIN "
+            "INSERT INTO listing_fts(listing_fts, rowid, title, description) "
+            "VALUES ('delete', old.id, old.title, old.description); END"
+        )
+        op.execute(
+            "CREATE TRIGGER listing_fts_update AFTER UPDATE OF title, description ON listing BEGIN "
+            "INSERT INTO listing_fts(listing_fts, rowid, title, description) "
+            "VALUES ('delete', old.id, old.title, old.description); "
+            "INSERT INTO listing_fts(rowid, title, description) VALUES (new.id, new.title, new.description); END"
+        )
+        op.execute("INSERT INTO listing_fts(listing_fts) VALUES ('rebuild')")
+    elif dialect == 'postgresql':
+        op.execute(
+            "ALTER TABLE listing ADD COLUMN search_vector tsvector GENERATED ALWAYS AS ("
+            "setweight(to_tsvector('english', coalesce(title, '')), 'A') || "
+            "setweight(to_tsvector('english', coalesce(description, '')), 'B')) STORED"
+        )
+        op.execute("CREATE INDEX ix_listing_search_vector ON listing USING GIN (search_vector)")
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        op.execute("DROP TRIGGER IF EXISTS listing_fts_update")
+        op.execute("DROP TRIGGER IF EXISTS listing_fts_delete")
+        op.execute("DROP TRIGGER IF EXISTS listing_fts_insert")
+        op.execute("DROP TABLE IF EXISTS listing_fts")
+    elif dialect == 'postgresql':
+        op.execute("DROP INDEX IF EXISTS ix_listing_search_vector")
+        op.execute("ALTER TABLE listing DROP COLUMN IF EXISTS search_vector")
@@ -1,7 +1,7 @@
 """Initial migration
 
 Revision ID: 74865f81e7d1
-Revises: 
+Revises: 0c9e2d7a4b18
 Create Date: 2024-10-09 01:23:14.492808
 
 """
@@ -11,7 +11,7 @@ import sqlalchemy as sa
 
 # revision identifiers, used by Alembic.
 revision = '74865f81e7d1'
-down_revision = None
+down_revision = '0c9e2d7a4b18'
 branch_labels = None
 depends_on = None
 
@@ -1,6 +1,6 @@
 from app import db
 from flask_login import UserMixin
-from werkzeug.security import generate_password_hash, check_password_hash
+from passwords import hash_password, verify_password
 from datetime import datetime
 
 class User(UserMixin, db.Model):
@@ -11,14 +11,18 @@ class User(UserMixin, db.Model):
     google_id = db.Column(db.String(120), unique=True, nullable=True)
     enable_cross_platform_posting = db.Column(db.Boolean, default=True)
     is_admin = db.Column(db.Boolean, default=False)
+    # Kept in step by notifications.py so the badge never needs a COUNT
+    unread_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # Kept in step by the stats.py record_* helpers, for the "My Listings" links
+    listing_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     listings = db.relationship('Listing', backref='owner', lazy='dynamic')
     notifications = db.relationship('Notification', backref='user', lazy='dynamic')
 
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = hash_password(password)
 
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return verify_password(self.password_hash, password)
 
 class Listing(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -28,14 +32,76 @@ class Listing(db.Model):
     location = db.Column(db.String(120))
     negotiable = db.Column(db.Boolean, default=False)
     status = db.Column(db.String(20), default='active')
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sold_at = db.Column(db.DateTime)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    photos = db.relationship('Photo', backref='listing', lazy='dynamic')
-    custom_fields = db.relationship('CustomField', backref='listing', lazy='dynamic')
+    # Denormalized so listing cards need one photo, not the whole collection
+    primary_photo_id = db.Column(db.Integer, db.ForeignKey('photo.id', use_alter=True,
+                                                           name='fk_listing_primary_photo_id_photo'))
+    photos = db.relationship('Photo', backref='listing', foreign_keys='Photo.listing_id', order_by='Photo.id')
+    custom_fields = db.relationship('CustomField', backref='listing', order_by='CustomField.id')
+    primary_photo = db.relationship('Photo', foreign_keys=[primary_photo_id], post_update=True)
+
+    __table_args__ = (
+        # Active-listing feed and a seller's listings, both newest first
+        db.Index('ix_listing_status_id', 'status', 'id'),
+        db.Index('ix_listing_user_id_id', 'user_id', 'id'),
+    )
 
 class Photo(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     filename = db.Column(db.String(120), nullable=False)
     listing_id = db.Column(db.Integer, db.ForeignKey('listing.id'), nullable=False)
+    blob_id = db.Column(db.Integer, db.ForeignKey('blob.id'))
+    blob = db.relationship('Blob')
+    variants = db.relationship('PhotoVariant', backref='photo', order_by='PhotoVariant.width',
+                               cascade='all, delete-orphan')
+
+    __table_args__ = (
+        db.Index('ix_photo_listing_id', 'listing_id'),
+        db.Index('ix_photo_blob_id', 'blob_id'),
+    )
+
+class PhotoVariant(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    photo_id = db.Column(db.Integer, db.ForeignKey('photo.id'), nullable=False)
+    width = db.Column(db.Integer, nullable=False)
+    height = db.Column(db.Integer, nullable=False)
+    format = db.Column(db.String(10), nullable=False)
+    filename = db.Column(db.String(120), nullable=False)
+
+    __table_args__ = (db.Index('ix_photo_variant_photo_id', 'photo_id'),)
+
+class Blob(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    sha256 = db.Column(db.String(64), unique=True, nullable=False)
+    extension = db.Column(db.String(10), nullable=False)
+    size = db.Column(db.Integer, nullable=False)
+    ref_count = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class UploadSession(db.Model):
+    """A photo being uploaded in chunks; see uploads.py."""
+    id = db.Column(db.Integer, primary_key=True)
+    token = db.Column(db.String(32), unique=True, nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    filename = db.Column(db.String(255))
+    size = db.Column(db.Integer, nullable=False)
+    received = db.Column(db.Integer, nullable=False, default=0)
+    # Sniffed from the first chunk
+    extension = db.Column(db.String(10))
+    # Set once every byte has arrived
+    sha256 = db.Column(db.String(64))
+    # Set while a request is writing a chunk; see uploads.upload_chunk
+    locked_at = db.Column(db.DateTime)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_upload_session_user_id', 'user_id'),
+        db.Index('ix_upload_session_updated_at', 'updated_at'),
+    )
 
 class CustomField(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -43,6 +109,8 @@ class CustomField(db.Model):
     value = db.Column(db.String(256))
     listing_id = db.Column(db.Integer, db.ForeignKey('listing.id'), nullable=False)
 
+    __table_args__ = (db.Index('ix_custom_field_listing_id', 'listing_id'),)
+
 class Notification(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -53,3 +121,75 @@ class Notification(db.Model):
     is_read = db.Column(db.Boolean, default=False)
 
     listing = db.relationship('Listing', backref='notifications')
+
+    __table_args__ = (
+        db.Index('ix_notification_user_id_timestamp_id', 'user_id', 'timestamp', 'id'),
+        # Partial: unread notifications per user stay a small index
+        db.Index('ix_notification_unread', 'user_id',
+                 sqlite_where=db.text('is_read = 0'), postgresql_where=db.text('is_read = false')),
+    )
+
+class OutboundJob(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    # Cleared on jobs cancelled mid-run because their listing was deleted
+    listing_id = db.Column(db.Integer, db.ForeignKey('listing.id'))
+    platform = db.Column(db.String(64), nullable=False)
+    action = db.Column(db.String(20), nullable=False, default='post')
+    status = db.Column(db.String(20), nullable=False, default='pending')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=5)
+    run_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    locked_by = db.Column(db.String(120))
+    locked_at = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+    result = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    listing = db.relationship('Listing', backref=db.backref('outbound_jobs', lazy='dynamic'))
+
+    __table_args__ = (
+        db.Index('ix_outbound_job_status_run_at', 'status', 'run_at'),
+        db.Index('ix_outbound_job_listing_id_id', 'listing_id', 'id'),
+    )
+
+class PlatformPollState(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    listing_id = db.Column(db.Integer, db.ForeignKey('listing.id'), nullable=False)
+    platform = db.Column(db.String(64), nullable=False)
+    cursor = db.Column(db.String(255))
+    interval_seconds = db.Column(db.Integer, nullable=False)
+    last_checked_at = db.Column(db.DateTime)
+    next_check_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    listing = db.relationship('Listing', backref=db.backref('poll_states', lazy='dynamic'))
+
+    __table_args__ = (
+        db.UniqueConstraint('listing_id', 'platform'),
+        db.Index('ix_platform_poll_state_next_check_at', 'next_check_at'),
+    )
+
+class PlatformSyncState(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    listing_id = db.Column(db.Integer, db.ForeignKey('listing.id'), nullable=False)
+    platform = db.Column(db.String(64), nullable=False)
+    remote_id = db.Column(db.String(120))
+    content_hash = db.Column(db.String(64))
+    synced_at = db.Column(db.DateTime)
+
+    listing = db.relationship('Listing', backref=db.backref('sync_states', lazy='dynamic'))
+
+    __table_args__ = (db.UniqueConstraint('listing_id', 'platform'),)
+
+class SiteStats(db.Model):
+    """Running totals for the admin stats page; a single row with id 1."""
+    id = db.Column(db.Integer, primary_key=True)
+    users = db.Column(db.Integer, nullable=False, default=0)
+    listings = db.Column(db.Integer, nullable=False, default=0)
+    active_listings = db.Column(db.Integer, nullable=False, default=0)
+    sold_listings = db.Column(db.Integer, nullable=False, default=0)
+
+class DailyStats(db.Model):
+    day = db.Column(db.Date, primary_key=True)
+    listings_created = db.Column(db.Integer, nullable=False, default=0)
+    listings_sold = db.Column(db.Integer, nullable=False, default=0)
@@ -0,0 +1,118 @@
+"""Notification bookkeeping.
+
+``User.unread_count`` mirrors the number of unread notifications so the
+badge on every page is a column read instead of a ``COUNT(*)``. Anything
+that creates, reads or deletes notifications goes through these helpers,
+which adjust the counter with relative ``UPDATE``s in the same transaction.
+``flask notifications recount`` repairs the counters if they ever drift.
+"""
+from collections import Counter
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import func, select, update
+
+from app import db
+from events import queue_notification_events
+from models import Notification, User
+from user_cache import invalidate_all_users, invalidate_user
+
+notifications_cli = AppGroup('notifications', help='Notification commands.')
+
+def _adjust_unread(deltas):
+    for user_id, delta in deltas.items():
+        if delta:
+            db.session.execute(update(User).where(User.id == user_id)
+                               .values(unread_count=User.unread_count + delta))
+            invalidate_user(user_id)
+
+def add_notifications(notifications):
+    """Add unread ``Notification`` objects and count them against their users.
+
+    They are flushed here so their IDs are known, and pushed to live
+    streams when the transaction commits.
+    """
+    db.session.add_all(notifications)
+    _adjust_unread(Counter(notification.user_id for notification in notifications))
+    db.session.flush(notifications)
+    queue_notification_events(notifications)
+
+def add_notification(user_id, listing_id, content, platform):
+    notification = Notification(user_id=user_id, listing_id=listing_id, content=content, platform=platform)
+    add_notifications([notification])
+    return notification
+
+def mark_read(user_id, notification_ids=None):
+    """Mark the user's unread notifications read, all or just ``notification_ids``.
+
+    One ``UPDATE`` does the marking; its row count tells how far the
+    counter drops, so concurrent calls never double count. Returns that
+    number.
+    """
+    statement = (update(Notification)
+                 .where(Notification.user_id == user_id, Notification.is_read == False)
+                 .values(is_read=True)
+                 .execution_options(synchronize_session=False))
+    if notification_ids is not None:
+        if not notification_ids:
+            return 0
+        statement = statement.where(Notification.id.in_(notification_ids))
+    marked = db.session.execute(statement).rowcount
+    _adjust_unread({user_id: -marked})
+    return marked
+
+def delete_listing_notifications(listing_ids):
+    """Delete every notification about ``listing_ids``, keeping counters right."""
+    unread = (db.session.query(Notification.user_id, func.count())
+              .filter(Notification.listing_id.in_(listing_ids), Notification.is_read == False)
+              .group_by(Notification.user_id))
+    _adjust_unread({user_id: -count for user_id, count in unread})
+    Notification.query.filter(Notification.listing_id.in_(listing_ids)).delete(synchronize_session=False)
+
+def prune_notifications(days, batch_size=1000):
+    """Delete read notifications older than ``days``, one batch per transaction.
+
+    Unread notifications are kept whatever their age. Returns the number
+    deleted.
+    """
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    deleted = 0
+    while True:
+        ids = db.session.execute(
+            select(Notification.id)
+            .where(Notification.is_read == True, Notification.timestamp < cutoff)
+            .order_by(Notification.id)
+            .limit(batch_size)
+        ).scalars().all()
+        if not ids:
+            break
+        Notification.query.filter(Notification.id.in_(ids)).delete(synchronize_session=False)
+        db.session.commit()
+        deleted += len(ids)
+    return deleted
+
+def recount_unread():
+    unread = (select(func.count(Notification.id))
+              .where(Notification.user_id == User.id, Notification.is_read == False)
+              .scalar_subquery())
+    updated = db.session.execute(update(User).values(unread_count=unread)).rowcount
+    invalidate_all_users()
+    db.session.commit()
+    return updated
+
+@notifications_cli.command('prune')
+@click.option('--days', default=90, show_default=True, help='Delete read notifications older than this.')
+@click.option('--batch-size', default=1000, show_default=True, help='Rows deleted per transaction.')
+def prune_command(days, batch_size):
+    """Delete old read notifications in batches."""
+    deleted = prune_notifications(days, batch_size)
+    current_app.logger.info("Pruned %d read notifications older than %d days", deleted, days)
+    click.echo(f"Deleted {deleted} read notification(s).")
+
+@notifications_cli.command('recount')
+def recount_command():
+    """Recompute every user's unread notification count."""
+    updated = recount_unread()
+    click.echo(f"Recounted unread notifications for {updated} user(s).")
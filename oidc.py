@@ -0,0 +1,235 @@
+"""OpenID Connect client for "Sign in with Google".
+
+The discovery document and the signing keys (JWKS) are cached in memory
+for as long as the provider's ``Cache-Control``/``Expires`` headers allow
+(``OIDC_CACHE_TTL`` when it sends none) and revalidated with ``ETag``, so
+a login costs one outbound call: the code exchange. The ID token in
+that response is checked locally instead of calling the userinfo
+endpoint:
+
+- HS256 tokens are verified with the client secret.
+- RS256/ES256 tokens are verified against the JWKS when PyJWT (with
+  ``cryptography``) is installed.
+- Otherwise only the claims are checked, which OpenID Connect Core
+  3.1.3.7 allows for a token received straight from the token endpoint
+  over TLS.
+
+All calls share one keep-alive session with ``OIDC_TIMEOUT``. ``oidc_stub.py``
+is a local provider for trying the flow without Google.
+"""
+import base64
+import hashlib
+import hmac
+import json
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlencode
+
+import requests
+from flask import current_app
+from requests.adapters import HTTPAdapter
+
+try:
+    import jwt
+    from jwt.algorithms import has_crypto
+except ImportError:
+    jwt = None
+    has_crypto = False
+
+# Accepted clock difference when checking exp and iat
+LEEWAY = 60
+# Refetch the JWKS for an unknown key ID at most this often
+JWKS_REFRESH_INTERVAL = 30
+
+class OIDCError(Exception):
+    pass
+
+def cache_lifetime(headers, default):
+    """Seconds a response may be reused for, from its HTTP caching headers."""
+    directives = {}
+    for part in headers.get('Cache-Control', '').split(','):
+        name, _, value = part.strip().partition('=')
+        if name:
+            directives[name.lower()] = value.strip('"')
+    if 'no-store' in directives or 'no-cache' in directives:
+        return 0
+    if 'max-age' in directives:
+        try:
+            return max(0, int(directives['max-age']) - int(headers.get('Age', 0)))
+        except ValueError:
+            return 0
+    if 'Expires' in headers:
+        try:
+            expires = parsedate_to_datetime(headers['Expires'])
+            date = parsedate_to_datetime(headers['Date']) if 'Date' in headers else None
+        except (TypeError, ValueError):
+            return 0
+        if date is None or expires.tzinfo is None or date.tzinfo is None:
+            return 0
+        return max(0, int((expires - date).total_seconds()))
+    return default
+
+def _b64decode(segment):
+    return base64.urlsafe_b64decode(segment + '=' * (-len(segment) % 4))
+
+class OIDCProvider:
+    def __init__(self, discovery_url, client_id, client_secret, timeout=5, default_ttl=3600, pool_size=4):
+        self.discovery_url = discovery_url
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.timeout = timeout
+        self.default_ttl = default_ttl
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._documents = {}
+        self._lock = threading.Lock()
+        self._jwks_refreshed_at = 0.0
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(config['GOOGLE_DISCOVERY_URL'], config['GOOGLE_CLIENT_ID'], config['GOOGLE_CLIENT_SECRET'],
+                   timeout=config['OIDC_TIMEOUT'], default_ttl=config['OIDC_CACHE_TTL'])
+
+    def _get_json(self, url, refresh=False):
+        """GET a JSON document through the cache; ``refresh`` skips a fresh entry."""
+        with self._lock:
+            entry = self._documents.get(url)
+        if entry is not None and not refresh and entry['expires_at'] > time.monotonic():
+            return entry['document']
+        headers = {'If-None-Match': entry['etag']} if entry is not None and entry['etag'] else {}
+        try:
+            response = self.session.get(url, headers=headers, timeout=self.timeout)
+            if response.status_code == 304 and entry is not None:
+                document = entry['document']
+            else:
+                response.raise_for_status()
+                document = response.json()
+        except (requests.RequestException, ValueError) as e:
+            raise OIDCError(f"Could not fetch {url}: {e}")
+        with self._lock:
+            self._documents[url] = {
+                'document': document,
+                'etag': response.headers.get('ETag') or (entry or {}).get('etag'),
+                'expires_at': time.monotonic() + cache_lifetime(response.headers, self.default_ttl),
+            }
+        return document
+
+    def metadata(self):
+        return self._get_json(self.discovery_url)
+
+    def authorization_url(self, redirect_uri, state, nonce, scope=('openid', 'email', 'profile')):
+        params = {
+            'response_type': 'code',
+            'client_id': self.client_id,
+            'redirect_uri': redirect_uri,
+            'scope': ' '.join(scope),
+            'state': state,
+            'nonce': nonce,
+        }
+        return f"{self.metadata()['authorization_endpoint']}?{urlencode(params)}"
+
+    def exchange_code(self, code, redirect_uri):
+        data = {'grant_type': 'authorization_code', 'code': code, 'redirect_uri': redirect_uri}
+        try:
+            response = self.session.post(self.metadata()['token_endpoint'], data=data, timeout=self.timeout,
+                                         auth=(self.client_id, self.client_secret),
+                                         headers={'Accept': 'application/json'})
+            tokens = response.json()
+        except (requests.RequestException, ValueError) as e:
+            raise OIDCError(f"Token request failed: {e}")
+        if response.status_code != 200 or 'error' in tokens:
+            raise OIDCError(f"Token request refused ({response.status_code}): {tokens.get('error')}")
+        return tokens
+
+    def userinfo(self, access_token):
+        try:
+            response = self.session.get(self.metadata()['userinfo_endpoint'], timeout=self.timeout,
+                                        headers={'Authorization': f'Bearer {access_token}'})
+            response.raise_for_status()
+            return response.json()
+        except (requests.RequestException, ValueError) as e:
+            raise OIDCError(f"Userinfo request failed: {e}")
+
+    def _signing_key(self, kid):
+        jwks_uri = self.metadata()['jwks_uri']
+        for refresh in (False, True):
+            if refresh:
+                # Keys rotate: an unknown kid may be new, but don't let bogus
+                # tokens make us hammer the provider
+                if time.monotonic() - self._jwks_refreshed_at < JWKS_REFRESH_INTERVAL:
+                    break
+                self._jwks_refreshed_at = time.monotonic()
+            for key in self._get_json(jwks_uri, refresh=refresh).get('keys', []):
+                if key.get('kid') == kid:
+                    return key
+        raise OIDCError(f"No signing key {kid!r} in {jwks_uri}")
+
+    def _check_signature(self, token, header):
+        algorithm = header.get('alg')
+        if algorithm == 'HS256':
+            signing_input, _, signature = token.rpartition('.')
+            expected = hmac.new(self.client_secret.encode(), signing_input.encode(), hashlib.sha256).digest()
+            if not hmac.compare_digest(expected, _b64decode(signature)):
+                raise OIDCError("ID token signature mismatch")
+        elif algorithm in ('RS256', 'ES256') and jwt is not None and has_crypto:
+            key = jwt.PyJWK(self._signing_key(header.get('kid'))).key
+            try:
+                jwt.decode(token, key, algorithms=[algorithm],
+                           options={'verify_aud': False, 'verify_iss': False, 'verify_exp': False,
+                                    'verify_iat': False, 'verify_nbf': False})
+            except jwt.InvalidTokenError as e:
+                raise OIDCError(f"ID token signature invalid: {e}")
+        elif algorithm in (None, 'none'):
+            raise OIDCError("Unsigned ID token")
+
+    def verify_id_token(self, token, nonce=None):
+        """Return the claims of an ID token from the token endpoint, or raise ``OIDCError``."""
+        try:
+            header_segment, payload_segment, _ = token.split('.')
+            header = json.loads(_b64decode(header_segment))
+            claims = json.loads(_b64decode(payload_segment))
+        except ValueError:
+            raise OIDCError("Malformed ID token")
+        self._check_signature(token, header)
+
+        issuer = self.metadata()['issuer']
+        # Google issues both forms
+        if claims.get('iss') not in (issuer, issuer.removeprefix('https://')):
+            raise OIDCError(f"Unexpected issuer {claims.get('iss')!r}")
+        audience = claims.get('aud')
+        if self.client_id not in (audience if isinstance(audience, list) else [audience]):
+            raise OIDCError("ID token is for another client")
+        if isinstance(audience, list) and len(audience) > 1 and claims.get('azp') != self.client_id:
+            raise OIDCError("ID token is for another client")
+        now = time.time()
+        if not isinstance(claims.get('exp'), (int, float)) or claims['exp'] < now - LEEWAY:
+            raise OIDCError("ID token expired")
+        if isinstance(claims.get('iat'), (int, float)) and claims['iat'] > now + LEEWAY:
+            raise OIDCError("ID token issued in the future")
+        if nonce is not None and not hmac.compare_digest(str(claims.get('nonce', '')), nonce):
+            raise OIDCError("ID token nonce mismatch")
+        return claims
+
+    def authenticate(self, code, redirect_uri, nonce):
+        """Exchange ``code`` and return the user's claims.
+
+        Calls the userinfo endpoint only when the ID token is missing or
+        lacks the email.
+        """
+        tokens = self.exchange_code(code, redirect_uri)
+        claims = self.verify_id_token(tokens['id_token'], nonce) if 'id_token' in tokens else {}
+        if 'email' not in claims:
+            userinfo = self.userinfo(tokens['access_token'])
+            if claims and userinfo.get('sub') != claims.get('sub'):
+                raise OIDCError("Userinfo is for another subject")
+            claims = dict(claims, **userinfo)
+        return claims
+
+def init_oidc(app):
+    app.extensions['oidc'] = OIDCProvider.from_config(app.config)
+
+def get_provider():
+    return current_app.extensions['oidc']
@@ -0,0 +1,205 @@
+"""Local stand-in for an OpenID Connect provider such as Google.
+
+Serves discovery, an authorization endpoint that approves at once, a
+token endpoint issuing HS256 ID tokens signed with the client secret,
+userinfo and an empty JWKS, so the sign-in flow and ``oidc.py``'s caching
+can be exercised without Google::
+
+    python oidc_stub.py --port 8082 --email alice@example.com
+    GOOGLE_DISCOVERY_URL=http://127.0.0.1:8082/.well-known/openid-configuration \\
+    GOOGLE_CLIENT_ID=stub-client GOOGLE_CLIENT_SECRET=stub-secret flask run
+
+Discovery and JWKS responses carry ``Cache-Control: max-age`` and an
+``ETag``. ``POST /_control`` (JSON with ``latency``, ``email`` or
+``max_age``) changes behaviour while running; ``GET /_stats`` counts
+requests per endpoint.
+"""
+import argparse
+import base64
+import hashlib
+import hmac
+import json
+import secrets
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlparse
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode()
+
+def sign_hs256(claims, secret):
+    header = _b64encode(json.dumps({'alg': 'HS256', 'typ': 'JWT'}).encode())
+    payload = _b64encode(json.dumps(claims).encode())
+    signature = hmac.new(secret.encode(), f'{header}.{payload}'.encode(), hashlib.sha256).digest()
+    return f'{header}.{payload}.{_b64encode(signature)}'
+
+class StubState:
+    def __init__(self, client_id='stub-client', client_secret='stub-secret', email='stub@example.com',
+                 latency=0.0, max_age=3600):
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.email = email
+        self.latency = latency
+        self.max_age = max_age
+        self.codes = {}
+        self.access_tokens = {}
+        self.requests = Counter()
+        self.lock = threading.Lock()
+
+    def userinfo(self, email):
+        return {
+            'sub': hashlib.sha256(email.encode()).hexdigest()[:21],
+            'email': email,
+            'email_verified': True,
+            'given_name': email.split('@')[0].capitalize(),
+        }
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def state(self):
+        return self.server.state
+
+    @property
+    def issuer(self):
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def _send(self, status, body, headers=None):
+        data = json.dumps(body).encode() if body is not None else b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_cacheable(self, body):
+        etag = '"' + hashlib.sha256(json.dumps(body, sort_keys=True).encode()).hexdigest()[:16] + '"'
+        headers = {'Cache-Control': f'public, max-age={int(self.state.max_age)}', 'ETag': etag}
+        if self.headers.get('If-None-Match') == etag:
+            return self._send(304, None, headers)
+        return self._send(200, body, headers)
+
+    def _count(self, path):
+        with self.state.lock:
+            self.state.requests[path] += 1
+        time.sleep(self.state.latency)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        if url.path == '/_stats':
+            with self.state.lock:
+                return self._send(200, dict(self.state.requests))
+        self._count(url.path)
+        if url.path == '/.well-known/openid-configuration':
+            return self._send_cacheable({
+                'issuer': self.issuer,
+                'authorization_endpoint': f'{self.issuer}/authorize',
+                'token_endpoint': f'{self.issuer}/token',
+                'userinfo_endpoint': f'{self.issuer}/userinfo',
+                'jwks_uri': f'{self.issuer}/jwks',
+                'id_token_signing_alg_values_supported': ['HS256'],
+            })
+        if url.path == '/jwks':
+            return self._send_cacheable({'keys': []})
+        if url.path == '/authorize':
+            if query.get('client_id') != self.state.client_id:
+                return self._send(400, {'error': 'unauthorized_client'})
+            code = secrets.token_urlsafe(16)
+            with self.state.lock:
+                self.state.codes[code] = {'nonce': query.get('nonce'), 'redirect_uri': query.get('redirect_uri'),
+                                          'email': query.get('login_hint') or self.state.email}
+            location = f"{query.get('redirect_uri')}?{urlencode({'code': code, 'state': query.get('state', '')})}"
+            self.send_response(302)
+            self.send_header('Location', location)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if url.path == '/userinfo':
+            token = self.headers.get('Authorization', '').removeprefix('Bearer ')
+            with self.state.lock:
+                email = self.state.access_tokens.get(token)
+            if email is None:
+                return self._send(401, {'error': 'invalid_token'})
+            return self._send(200, self.state.userinfo(email))
+        return self._send(404, {'error': 'Not found'})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length).decode()
+        if url.path == '/_control':
+            for key, value in json.loads(body or '{}').items():
+                if key in ('latency', 'max_age'):
+                    setattr(self.state, key, float(value))
+                elif key == 'email':
+                    self.state.email = value
+            return self._send(200, {'ok': True})
+        self._count(url.path)
+        if url.path != '/token':
+            return self._send(404, {'error': 'Not found'})
+        credentials = f'{self.state.client_id}:{self.state.client_secret}'.encode()
+        if self.headers.get('Authorization') != 'Basic ' + base64.b64encode(credentials).decode():
+            return self._send(401, {'error': 'invalid_client'})
+        form = {key: values[0] for key, values in parse_qs(body).items()}
+        with self.state.lock:
+            grant = self.state.codes.pop(form.get('code'), None)
+        if grant is None or grant['redirect_uri'] != form.get('redirect_uri'):
+            return self._send(400, {'error': 'invalid_grant'})
+        access_token = secrets.token_urlsafe(24)
+        with self.state.lock:
+            self.state.access_tokens[access_token] = grant['email']
+        now = int(time.time())
+        claims = dict(self.state.userinfo(grant['email']), iss=self.issuer, aud=self.state.client_id,
+                      iat=now, exp=now + 3600)
+        if grant['nonce']:
+            claims['nonce'] = grant['nonce']
+        return self._send(200, {
+            'access_token': access_token,
+            'token_type': 'Bearer',
+            'expires_in': 3600,
+            'id_token': sign_hs256(claims, self.state.client_secret),
+        })
+
+def make_server(host='127.0.0.1', port=0, **options):
+    server = ThreadingHTTPServer((host, port), StubHandler)
+    server.daemon_threads = True
+    server.state = StubState(**options)
+    return server
+
+def serve_in_thread(**options):
+    """Start a stub provider on a free port; returns ``(server, base_url)``."""
+    server = make_server(**options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address[:2]
+    return server, f'http://{host}:{port}'
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8082)
+    parser.add_argument('--client-id', default='stub-client')
+    parser.add_argument('--client-secret', default='stub-secret')
+    parser.add_argument('--email', default='stub@example.com', help='Who every sign-in succeeds as.')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds to wait before answering.')
+    parser.add_argument('--max-age', type=int, default=3600, help='Cache lifetime of discovery and JWKS.')
+    args = parser.parse_args()
+    server = make_server(args.host, args.port, client_id=args.client_id, client_secret=args.client_secret,
+                         email=args.email, latency=args.latency, max_age=args.max_age)
+    print(f"OIDC stub listening on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""Keyset pagination for feeds.
+
+Pages are addressed by an opaque cursor holding the sort key of the last
+row shown, and the next page is fetched with ``WHERE (key) < (cursor)``
+against an index on the key. Unlike ``OFFSET`` the cost does not grow with
+the page number, and since one extra row is fetched to tell whether another
+page exists there is no ``COUNT(*)``.
+"""
+import base64
+import binascii
+import json
+from datetime import datetime
+
+from sqlalchemy import DateTime, tuple_
+
+class KeysetPage:
+    """One page of a feed plus the cursor of the page after it."""
+
+    def __init__(self, items, next_cursor, cursor=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.cursor = cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def is_first(self):
+        return self.cursor is None
+
+def _encode_value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+def _decode_value(column, value):
+    """``value`` as ``column``'s Python type; raises ``ValueError`` if it is not one."""
+    if isinstance(column.type, DateTime):
+        if not isinstance(value, str):
+            raise ValueError(f"{column.key} must be a timestamp")
+        return datetime.fromisoformat(value)
+    python_type = column.type.python_type
+    if python_type is float and isinstance(value, int) and not isinstance(value, bool):
+        return float(value)
+    # bool is an int, but never a valid sort key
+    if isinstance(value, bool) or not isinstance(value, python_type):
+        raise ValueError(f"{column.key} must be {python_type.__name__}")
+    return value
+
+def encode_cursor(values):
+    raw = json.dumps([_encode_value(value) for value in values], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def decode_cursor(cursor, columns):
+    """Sort key values from ``cursor``, or ``None`` if it is missing or garbled."""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json.loads(raw)
+        if not isinstance(values, list) or len(values) != len(columns):
+            return None
+        return [_decode_value(column, value) for column, value in zip(columns, values)]
+    except (binascii.Error, ValueError, TypeError):
+        return None
+
+def keyset_page(query, columns, cursor=None, per_page=20):
+    """Return the page of ``query`` after ``cursor``, newest first.
+
+    ``columns`` is the sort key, most significant first; it must end in a
+    unique column such as the primary key so rows never tie. An invalid
+    cursor yields the first page.
+    """
+    values = decode_cursor(cursor, columns)
+    if values is None:
+        cursor = None
+    elif len(columns) == 1:
+        query = query.filter(columns[0] < values[0])
+    else:
+        query = query.filter(tuple_(*columns) < tuple_(*values))
+    rows = query.order_by(*[column.desc() for column in columns]).limit(per_page + 1).all()
+
+    items = rows[:per_page]
+    next_cursor = None
+    if len(rows) > per_page:
+        last = items[-1]
+        next_cursor = encode_cursor([getattr(last, column.key) for column in columns])
+    return KeysetPage(items, next_cursor, cursor)
@@ -0,0 +1,103 @@
+"""Password hashing policy.
+
+Hashes use ``PASSWORD_HASH_METHOD``, a Werkzeug method string such as
+``scrypt:32768:8:1`` or ``pbkdf2:sha256:600000``, so the cost can differ
+per environment (the perf and bench scratch apps use a cheap one). A
+stored hash made with any other method still verifies, and
+``auth.login`` replaces it with a fresh one once the password is known.
+
+Verifying is deliberately slow. With ``PASSWORD_VERIFY_WORKERS`` set,
+verifications run on that many threads per process instead of on the
+request thread, and at most ``PASSWORD_VERIFY_MAX_PENDING`` may wait for
+one. Beyond that, or after ``PASSWORD_VERIFY_TIMEOUT`` seconds, logins
+fail fast with ``PasswordVerifierBusy``, so a burst of login attempts
+cannot tie up every worker and starve page rendering. hashlib releases
+the GIL while hashing, so the cap bounds CPU use as well as threads.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from functools import lru_cache
+
+from flask import current_app, has_app_context
+from werkzeug.security import check_password_hash, generate_password_hash
+
+DEFAULT_METHOD = 'scrypt:32768:8:1'
+
+class PasswordVerifierBusy(Exception):
+    pass
+
+class PasswordVerifier:
+    """Runs ``check_password_hash`` on a bounded pool."""
+
+    def __init__(self, max_workers, max_pending, timeout):
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_workers + max_pending)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @property
+    def executor(self):
+        # Created on first use so forked workers each get their own threads
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                        thread_name_prefix='password')
+        return self._executor
+
+    def verify(self, stored_hash, password):
+        if not self._slots.acquire(blocking=False):
+            raise PasswordVerifierBusy("Too many password checks in progress")
+        try:
+            future = self.executor.submit(check_password_hash, stored_hash, password)
+        except BaseException:
+            self._slots.release()
+            raise
+        # A timed-out check keeps running (cancel() cannot stop it), so its
+        # slot is only given back once the worker thread has finished with it
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            future.cancel()
+            raise PasswordVerifierBusy("Password check timed out")
+
+def init_passwords(app):
+    if app.config['PASSWORD_VERIFY_WORKERS'] > 0:
+        app.extensions['password_verifier'] = PasswordVerifier(app.config['PASSWORD_VERIFY_WORKERS'],
+                                                               app.config['PASSWORD_VERIFY_MAX_PENDING'],
+                                                               app.config['PASSWORD_VERIFY_TIMEOUT'])
+
+def hash_method():
+    if has_app_context():
+        return current_app.config['PASSWORD_HASH_METHOD']
+    return DEFAULT_METHOD
+
+@lru_cache(maxsize=8)
+def _dummy_hash(method):
+    return generate_password_hash('dummy password', method)
+
+def hash_password(password):
+    return generate_password_hash(password, hash_method())
+
+def needs_rehash(stored_hash):
+    """Whether ``stored_hash`` was made with something other than the configured method."""
+    # Compare against a real hash: Werkzeug fills in defaults ('pbkdf2' is
+    # stored as 'pbkdf2:sha256:1000000')
+    expected = _dummy_hash(hash_method()).split('$', 1)[0]
+    return bool(stored_hash) and stored_hash.split('$', 1)[0] != expected
+
+def verify_password(stored_hash, password):
+    """Check ``password``; may raise ``PasswordVerifierBusy`` when offloading is on."""
+    if not stored_hash:
+        # Accounts created through Google sign-in have no password
+        return False
+    verifier = current_app.extensions.get('password_verifier') if has_app_context() else None
+    if verifier is None:
+        return check_password_hash(stored_hash, password)
+    return verifier.verify(stored_hash, password)
+
+def dummy_verify(password):
+    """Spend as long as a real check would, so unknown emails don't answer faster."""
+    verify_password(_dummy_hash(hash_method()), password)
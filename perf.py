@@ -0,0 +1,459 @@
+"""Performance guards that can run in CI.
+
+``flask perf check-queries`` builds a throwaway in-memory database, renders
+the listing grids at two data sizes and fails if the number of SQL queries
+grows with the number of listings, which is how N+1 regressions show up.
+``flask perf explain`` renders the main routes, prints the query plan of
+every SELECT they ran and fails if any of them scans a whole table.
+``flask perf startup`` times cold starts of the app in fresh interpreters,
+``flask perf passwords`` logins per second at several hashing costs and
+``flask perf logging`` the per-request cost of each logging setup.
+"""
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+
+import click
+from flask import request
+from flask.cli import AppGroup
+from sqlalchemy import event
+
+perf_cli = AppGroup('perf', help='Performance checks.')
+
+GRID_ROUTES = ('/', '/my_listings', '/profile', '/search?q=listing')
+
+# SQLite reports a full table scan as "SCAN <table>" with no "USING ..." index
+FULL_SCAN = re.compile(r'^SCAN (\w+)$')
+
+class QueryCounter:
+    """Collects the SQL statements an engine executes while active."""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.statements = []
+        self.parameters = []
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+        self.parameters.append(parameters)
+
+    def __enter__(self):
+        event.listen(self.engine, 'before_cursor_execute', self._record)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, 'before_cursor_execute', self._record)
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+@contextmanager
+def scratch_app(**config):
+    """An app on a private in-memory SQLite database with CSRF disabled."""
+    from app import create_app, db
+
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': 'sqlite://',
+        'WTF_CSRF_ENABLED': False,
+        'TESTING': True,
+        # Hashing cost is not what these checks measure
+        'PASSWORD_HASH_METHOD': 'pbkdf2:sha256:1000',
+        **config,
+    })
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+def seed_listings(user, count, photos_per_listing=2, fields_per_listing=2):
+    """Add ``count`` listings with photos, variants and custom fields."""
+    from app import db
+    from models import CustomField, Listing, Photo, PhotoVariant
+    from stats import rebuild_stats
+
+    for i in range(count):
+        listing = Listing(title=f'Listing {i}', description='Seeded', price=10 + i,
+                          location='Nowhere', user_id=user.id)
+        db.session.add(listing)
+        db.session.flush()
+        for j in range(photos_per_listing):
+            photo = Photo(filename=f'seed-{listing.id}-{j}.jpg', listing_id=listing.id)
+            db.session.add(photo)
+            db.session.flush()
+            photo.variants.append(PhotoVariant(width=320, height=240, format='jpeg',
+                                               filename=f'variants/{photo.id}-320.jpeg'))
+            if listing.primary_photo is None:
+                listing.primary_photo = photo
+        for j in range(fields_per_listing):
+            db.session.add(CustomField(name=f'Field {j}', value='Value', listing_id=listing.id))
+    # As in 'flask bench seed', the counters are rebuilt once rather than
+    # bumped per row; this also commits
+    rebuild_stats()
+
+def measure_routes(app, client, routes):
+    from app import db
+
+    counts = {}
+    for route in routes:
+        with QueryCounter(db.engine) as counter:
+            response = client.get(route)
+        if response.status_code != 200:
+            raise click.ClickException(f"GET {route} returned {response.status_code}")
+        counts[route] = counter.count
+    return counts
+
+@perf_cli.command('check-queries')
+@click.option('--small', default=3, show_default=True, help='Listings in the first measurement.')
+@click.option('--large', default=30, show_default=True, help='Listings in the second measurement.')
+def check_queries_command(small, large):
+    """Fail if listing grids issue more queries as listings grow."""
+    from app import db
+    from models import User
+
+    with scratch_app() as app:
+        user = User(username='perf', email='perf@example.com')
+        user.set_password('perf')
+        db.session.add(user)
+        db.session.commit()
+
+        client = app.test_client()
+        client.post('/login', data={'email': 'perf@example.com', 'password': 'perf'})
+
+        seed_listings(user, small)
+        before = measure_routes(app, client, GRID_ROUTES)
+        seed_listings(user, large - small)
+        after = measure_routes(app, client, GRID_ROUTES)
+
+    failed = False
+    for route in GRID_ROUTES:
+        ok = before[route] == after[route]
+        failed = failed or not ok
+        click.echo(f"{route}: {before[route]} queries with {small} listings, "
+                   f"{after[route]} with {large} {'ok' if ok else 'FAIL'}")
+    if failed:
+        sys.exit(1)
+
+def seed_notifications(user, listing, count):
+    from app import db
+    from models import Notification
+
+    for i in range(count):
+        db.session.add(Notification(user_id=user.id, listing_id=listing.id, content=f'Comment {i}',
+                                    platform='OfferUp', is_read=i % 3 == 0))
+    db.session.commit()
+
+def seed_jobs(listings, per_listing=2):
+    from app import db
+    from models import OutboundJob
+
+    for listing in listings:
+        for i in range(per_listing):
+            db.session.add(OutboundJob(listing_id=listing.id, platform='OfferUp', action='sync',
+                                       status='succeeded'))
+    db.session.commit()
+
+def full_scans(conn, statement, parameters, tables):
+    """Query plan lines of ``statement`` plus the tables it scans in full."""
+    plan = [row[3] for row in conn.exec_driver_sql(f'EXPLAIN QUERY PLAN {statement}', parameters)]
+    scanned = []
+    for line in plan:
+        match = FULL_SCAN.match(line)
+        if match and match.group(1) in tables:
+            scanned.append(match.group(1))
+    return plan, scanned
+
+@perf_cli.command('explain')
+@click.option('--sellers', default=20, show_default=True, help='Users to spread the seeded data over.')
+@click.option('--listings', default=10, show_default=True, help='Listings seeded per seller.')
+def explain_command(sellers, listings):
+    """Print query plans for the main routes and fail on full table scans.
+
+    Runs on a scratch SQLite database, so it checks the indexes declared on
+    the models, which the migrations mirror. Data is spread over several
+    sellers so the planner sees realistic selectivity after ``ANALYZE``.
+    """
+    from app import db
+    from models import Listing, Notification, User
+    from pagination import encode_cursor
+
+    with scratch_app() as app:
+        users = []
+        for i in range(sellers):
+            user = User(username=f'perf{i}', email=f'perf{i}@example.com')
+            user.set_password('perf')
+            db.session.add(user)
+            users.append(user)
+        db.session.commit()
+        for user in users:
+            seed_listings(user, listings)
+            first = Listing.query.filter_by(user_id=user.id).order_by(Listing.id).first()
+            seed_notifications(user, first, listings * 2)
+        seed_jobs(Listing.query.all())
+        Listing.query.filter(Listing.id % 4 == 0).update({'status': 'sold'}, synchronize_session=False)
+        db.session.commit()
+        db.session.execute(db.text('ANALYZE'))
+
+        listing = Listing.query.filter_by(user_id=users[0].id).order_by(Listing.id).first()
+        middle = Notification.query.filter_by(user_id=users[0].id).order_by(Notification.id).offset(listings).first()
+        routes = GRID_ROUTES + (
+            '/notifications',
+            f'/listing/{listing.id}',
+            f'/?cursor={encode_cursor([sellers * listings // 2])}',
+            f'/notifications?cursor={encode_cursor([middle.timestamp, middle.id])}',
+        )
+
+        client = app.test_client()
+        client.post('/login', data={'email': 'perf0@example.com', 'password': 'perf'})
+        tables = set(db.metadata.tables)
+        failed = False
+        with db.engine.connect() as conn:
+            for route in routes:
+                with QueryCounter(db.engine) as counter:
+                    response = client.get(route)
+                if response.status_code != 200:
+                    raise click.ClickException(f"GET {route} returned {response.status_code}")
+                click.echo(f"GET {route}")
+                for statement, parameters in zip(counter.statements, counter.parameters):
+                    if not statement.lstrip().upper().startswith('SELECT'):
+                        continue
+                    plan, scanned = full_scans(conn, statement, parameters, tables)
+                    failed = failed or bool(scanned)
+                    click.echo('  ' + ' '.join(statement.split())[:120])
+                    for line in plan:
+                        click.echo(f"    {line}")
+                    for table in scanned:
+                        click.echo(f"    FAIL: full scan of {table}")
+    if failed:
+        sys.exit(1)
+
+# Profiles for 'flask perf startup': (APP_CONFIG, create_app keyword arguments)
+STARTUP_PROFILES = {
+    'development': ('config.Config', {}),
+    'wsgi': ('config.ProductionConfig', {'cli': False}),
+    'worker': ('config.ProductionConfig', {'web': False, 'cli': False}),
+}
+
+STARTUP_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+app.create_app(**json.loads(sys.argv[1]))
+built = time.perf_counter()
+print(json.dumps({'import': imported - start, 'create_app': built - imported, 'modules': len(sys.modules)}))
+"""
+
+def _start_once(profile, importtime=False):
+    config_object, kwargs = STARTUP_PROFILES[profile]
+    env = dict(os.environ, APP_CONFIG=config_object, LOG_LEVEL='WARNING')
+    command = [sys.executable] + (['-X', 'importtime'] if importtime else []) + ['-c', STARTUP_SCRIPT,
+                                                                                json.dumps(kwargs)]
+    started = time.perf_counter()
+    result = subprocess.run(command, capture_output=True, text=True, env=env,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+    wall = time.perf_counter() - started
+    if result.returncode != 0:
+        raise click.ClickException(f"{profile} startup failed:\n{result.stderr[-2000:]}")
+    timings = json.loads(result.stdout.strip().splitlines()[-1])
+    timings['process'] = wall
+    return timings, result.stderr
+
+def _slowest_imports(stderr, limit):
+    """Top-level modules by cumulative import time from ``-X importtime`` output."""
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or line.endswith('| imported package'):
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if cumulative.strip().isdigit() and not name.startswith('  '):
+            modules.append((int(cumulative) / 1e6, name.strip()))
+    return sorted(modules, reverse=True)[:limit]
+
+@perf_cli.command('startup')
+@click.option('--runs', default=5, show_default=True, help='Fresh interpreters per profile.')
+@click.option('--profile', 'profiles', multiple=True, type=click.Choice(list(STARTUP_PROFILES)),
+              help='Only these profiles (repeatable) [default: all].')
+@click.option('--imports', default=10, show_default=True, help='Show this many slowest top-level imports.')
+@click.option('--output', '-o', help='Also write the results as JSON.')
+def startup_command(runs, profiles, imports, output):
+    """Time cold starts: importing the app and building it.
+
+    Each run is a new Python process, as for a fresh worker. The
+    development profile creates missing tables in the configured
+    database, as startup there always has.
+    """
+    results = {}
+    for profile in profiles or STARTUP_PROFILES:
+        samples = [_start_once(profile)[0] for _ in range(runs)]
+        summary = {key: {'median_ms': round(statistics.median(sample[key] for sample in samples) * 1000, 1),
+                         'max_ms': round(max(sample[key] for sample in samples) * 1000, 1)}
+                   for key in ('import', 'create_app', 'process')}
+        summary['modules'] = samples[-1]['modules']
+        _, stderr = _start_once(profile, importtime=True)
+        summary['slowest_imports'] = [{'module': name, 'ms': round(seconds * 1000, 1)}
+                                      for seconds, name in _slowest_imports(stderr, imports)]
+        results[profile] = summary
+        click.echo(f"{profile}: import {summary['import']['median_ms']}ms, "
+                   f"create_app {summary['create_app']['median_ms']}ms, "
+                   f"process {summary['process']['median_ms']}ms (median of {runs}), "
+                   f"{summary['modules']} modules")
+        for entry in summary['slowest_imports']:
+            click.echo(f"  {entry['ms']:8.1f}ms  {entry['module']}")
+    if output:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2)
+        click.echo(f"Wrote {output}")
+
+PASSWORD_METHODS = ('pbkdf2:sha256:600000', 'pbkdf2:sha256:1000000', 'scrypt:16384:8:1', 'scrypt:32768:8:1')
+
+@perf_cli.command('passwords')
+@click.option('--method', 'methods', multiple=True, help=f"Werkzeug hash methods [default: {', '.join(PASSWORD_METHODS)}].")
+@click.option('--seconds', default=3.0, show_default=True, help='How long to measure each method.')
+@click.option('--threads', default=os.cpu_count() or 1, show_default=True,
+              help='Parallel verifications, for the per-process capacity figure.')
+@click.option('--output', '-o', help='Also write the results as JSON.')
+def passwords_command(methods, seconds, threads, output):
+    """Measure logins per second at each password hashing cost.
+
+    Logs in through the test client, one login at a time, then runs bare
+    verifications on ``--threads`` threads to show how many logins one
+    process can absorb when every core is hashing.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    from app import db
+    from models import User
+    from werkzeug.security import check_password_hash, generate_password_hash
+
+    results = {}
+    for method in methods or PASSWORD_METHODS:
+        with scratch_app(PASSWORD_HASH_METHOD=method) as app:
+            user = User(username='perf', email='perf@example.com')
+            user.set_password('perf')
+            db.session.add(user)
+            db.session.commit()
+
+            def log_in():
+                # A fresh context each time, or the first login's user sticks in ``g``
+                with app.app_context():
+                    response = app.test_client().post('/login', data={'email': 'perf@example.com',
+                                                                      'password': 'perf'})
+                if response.status_code != 302:
+                    raise click.ClickException(f"Login failed with HTTP {response.status_code}")
+
+            # The first login also pays for needs_rehash's one-off reference hash
+            log_in()
+            logins = 0
+            started = time.perf_counter()
+            while time.perf_counter() - started < seconds:
+                log_in()
+                logins += 1
+            login_seconds = (time.perf_counter() - started) / logins
+
+        stored = generate_password_hash('perf', method)
+        checks = max(threads, round(threads * seconds / login_seconds))
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            list(pool.map(lambda _: check_password_hash(stored, 'perf'), range(checks)))
+        parallel_rate = checks / (time.perf_counter() - started)
+
+        results[method] = {
+            'login_ms': round(login_seconds * 1000, 1),
+            'logins_per_second': round(1 / login_seconds, 1),
+            'threads': threads,
+            'parallel_verifications_per_second': round(parallel_rate, 1),
+        }
+        click.echo(f"{method}: {results[method]['login_ms']}ms per login, "
+                   f"{results[method]['logins_per_second']} logins/s on one thread, "
+                   f"{results[method]['parallel_verifications_per_second']} verifications/s on {threads} threads")
+    if output:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2)
+        click.echo(f"Wrote {output}")
+
+# Profiles for 'flask perf logging': config for the scratch app
+LOGGING_PROFILES = {
+    'off': {'LOG_LEVEL': 'CRITICAL'},
+    'sync-text': {'LOG_QUEUE': False, 'LOG_JSON': False},
+    'queued-text': {'LOG_QUEUE': True, 'LOG_JSON': False},
+    'sync-json': {'LOG_QUEUE': False, 'LOG_JSON': True},
+    'queued-json': {'LOG_QUEUE': True, 'LOG_JSON': True},
+    'queued-json-debug-sampled': {'LOG_QUEUE': True, 'LOG_JSON': True, 'LOG_LEVEL': 'DEBUG',
+                                  'LOG_DEBUG_SAMPLING': 'perf=0.1'},
+}
+
+@perf_cli.command('logging')
+@click.option('--requests', 'count', default=2000, show_default=True, help='Requests per profile.')
+@click.option('--records', default=5, show_default=True,
+              help='INFO records per request; as many DEBUG records are made too.')
+@click.option('--profile', 'profiles', multiple=True, type=click.Choice(list(LOGGING_PROFILES)),
+              help='Only these profiles (repeatable) [default: all].')
+@click.option('--output', '-o', help='Also write the results as JSON.')
+def logging_command(count, records, profiles, output):
+    """Measure what logging adds to a request.
+
+    Each profile serves a route that logs ``--records`` INFO and DEBUG
+    lines to a temporary file. ``drain_ms`` is how long the listener then
+    took to write what was still queued, which the requests did not wait
+    for.
+    """
+    import logging
+    import tempfile
+
+    import logs
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for profile in profiles or LOGGING_PROFILES:
+            path = os.path.join(directory, f'{profile}.log')
+            config = {'LOG_LEVEL': 'INFO', 'LOG_LEVELS': '', 'LOG_DEBUG_SAMPLING': '', 'LOG_FILE': path,
+                      **LOGGING_PROFILES[profile]}
+            with scratch_app(**config) as app:
+                logger = logging.getLogger('perf')
+
+                def noisy():
+                    for i in range(records):
+                        logger.info("Record %s of %s for %s", i, records, request.path)
+                        logger.debug("Detail %s: %r", i, request.args)
+                    return ''
+
+                app.add_url_rule('/_perf/logging', 'perf_logging', noisy)
+
+                def get():
+                    with app.app_context():
+                        response = app.test_client().get('/_perf/logging')
+                    if response.status_code != 200:
+                        raise click.ClickException(f"Logging route returned {response.status_code}")
+
+                get()
+                started = time.perf_counter()
+                for _ in range(count):
+                    get()
+                elapsed = time.perf_counter() - started
+                started = time.perf_counter()
+                logs.stop_logging()
+                drain = time.perf_counter() - started
+            with open(path) as f:
+                lines = sum(1 for _ in f)
+            results[profile] = {
+                'request_us': round(elapsed / count * 1e6, 1),
+                'drain_ms': round(drain * 1000, 1),
+                'lines_written': lines,
+            }
+            click.echo(f"{profile}: {results[profile]['request_us']}us per request, "
+                       f"drain {results[profile]['drain_ms']}ms, {lines} lines")
+    if 'off' in results:
+        baseline = results['off']['request_us']
+        for profile, result in results.items():
+            result['overhead_us'] = round(result['request_us'] - baseline, 1)
+    if output:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2)
+        click.echo(f"Wrote {output}")
@@ -0,0 +1,172 @@
+"""Local stand-in for the external platform APIs.
+
+Serves the endpoints ``ExternalPlatform`` calls when ``*_API_URL`` is set,
+with configurable latency and failure rate, so fan-out concurrency and the
+circuit breakers can be exercised without the real services::
+
+    python platform_stub.py --port 8081 --latency 1.0
+    OFFERUP_API_URL=http://127.0.0.1:8081 \\
+    FACEBOOK_MARKETPLACE_API_URL=http://127.0.0.1:8081 flask platforms probe
+
+Behaviour can be changed while running with ``POST /_control`` (JSON with
+``latency``, ``fail_rate`` or ``comment_rate``); ``GET /_stats`` reports
+request counts and the peak number of requests in flight.
+"""
+import argparse
+import itertools
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+class StubState:
+    def __init__(self, latency=0.0, fail_rate=0.0, comment_rate=0.5):
+        self.latency = latency
+        self.fail_rate = fail_rate
+        self.comment_rate = comment_rate
+        self.requests = 0
+        self.failures = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.comments = {}
+        self.created = {}
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'requests': self.requests,
+                'failures': self.failures,
+                'in_flight': self.in_flight,
+                'max_in_flight': self.max_in_flight,
+            }
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def state(self):
+        return self.server.state
+
+    def _send(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _read_json(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length) or b'{}')
+
+    def _handle(self, handler):
+        state = self.state
+        with state.lock:
+            state.requests += 1
+            state.in_flight += 1
+            state.max_in_flight = max(state.max_in_flight, state.in_flight)
+        try:
+            time.sleep(state.latency)
+            if random.random() < state.fail_rate:
+                with state.lock:
+                    state.failures += 1
+                return self._send(503, {'error': 'Simulated platform failure'})
+            return handler()
+        finally:
+            with state.lock:
+                state.in_flight -= 1
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/_stats':
+            return self._send(200, self.state.stats())
+        match = re.fullmatch(r'/listings/([^/]+)/comments', url.path)
+        if not match:
+            return self._send(404, {'error': 'Not found'})
+        since = parse_qs(url.query).get('since', [''])[0]
+        return self._handle(lambda: self._comments(match.group(1), since))
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path == '/_control':
+            body = self._read_json()
+            for key in ('latency', 'fail_rate', 'comment_rate'):
+                if key in body:
+                    setattr(self.state, key, float(body[key]))
+            return self._send(200, {'ok': True})
+        if url.path != '/listings':
+            return self._send(404, {'error': 'Not found'})
+        self._read_json()
+        return self._handle(lambda: self._create(self.headers.get('Idempotency-Key')))
+
+    def do_PUT(self):
+        match = re.fullmatch(r'/listings/([^/]+)', urlparse(self.path).path)
+        if not match:
+            return self._send(404, {'error': 'Not found'})
+        self._read_json()
+        return self._handle(lambda: self._send(200, {'id': match.group(1)}))
+
+    def _create(self, key):
+        state = self.state
+        with state.lock:
+            # Repeating a create with the same key returns the listing it made
+            remote_id = state.created.get(key)
+            repeated = remote_id is not None
+            if not repeated:
+                remote_id = f'stub-{next(state.ids)}'
+                if key:
+                    state.created[key] = remote_id
+        return self._send(200 if repeated else 201, {'id': remote_id})
+
+    def _comments(self, listing_id, since):
+        state = self.state
+        with state.lock:
+            comments = state.comments.setdefault(listing_id, [])
+            if random.random() < state.comment_rate:
+                comment_id = f'stub-{listing_id}-{len(comments) + 1}'
+                comments.append({'id': comment_id, 'content': f'Stub comment {len(comments) + 1}'})
+            ids = [comment['id'] for comment in comments]
+            start = ids.index(since) + 1 if since in ids else 0
+            new = comments[start:]
+        cursor = new[-1]['id'] if new else since or None
+        return self._send(200, {'comments': new, 'cursor': cursor})
+
+def make_server(host='127.0.0.1', port=0, **options):
+    server = ThreadingHTTPServer((host, port), StubHandler)
+    server.daemon_threads = True
+    server.state = StubState(**options)
+    return server
+
+def serve_in_thread(**options):
+    """Start a stub server on a free port; returns ``(server, base_url)``."""
+    server = make_server(**options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address[:2]
+    return server, f'http://{host}:{port}'
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds to wait before answering.')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='Fraction of requests answered with 503.')
+    parser.add_argument('--comment-rate', type=float, default=0.5, help='Chance a comment poll finds a new comment.')
+    args = parser.parse_args()
+    server = make_server(args.host, args.port, latency=args.latency,
+                         fail_rate=args.fail_rate, comment_rate=args.comment_rate)
+    print(f"Platform stub listening on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
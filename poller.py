@@ -0,0 +1,123 @@
+"""Incremental comment poller for external platforms.
+
+Each (listing, platform) pair has a ``PlatformPollState`` row holding the
+platform's comment cursor and when it is next due. ``flask poller run``
+walks due rows in batches, checks a batch concurrently, turns new comments
+into notifications and reschedules each pair: activity halves its interval,
+quiet polls double it, and sold listings fall back to a slow fixed interval.
+"""
+import time
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import and_, select
+from sqlalchemy.orm import contains_eager
+
+from app import db
+from models import Listing, Notification, PlatformPollState
+from external_platforms import PLATFORMS, get_registry
+from notifications import add_notifications
+
+poller_cli = AppGroup('poller', help='External comment poller commands.')
+
+def seed_poll_states(batch_size):
+    """Create poll state for active listings that do not have any yet."""
+    now = datetime.utcnow()
+    created = 0
+    for name in PLATFORMS:
+        missing = db.session.execute(
+            select(Listing.id)
+            .outerjoin(PlatformPollState, and_(PlatformPollState.listing_id == Listing.id,
+                                               PlatformPollState.platform == name))
+            .where(Listing.status == 'active', PlatformPollState.id.is_(None))
+            .order_by(Listing.id)
+            .limit(batch_size)
+        ).scalars().all()
+        for listing_id in missing:
+            db.session.add(PlatformPollState(
+                listing_id=listing_id,
+                platform=name,
+                interval_seconds=current_app.config['POLL_MIN_INTERVAL'],
+                next_check_at=now,
+            ))
+        created += len(missing)
+    db.session.commit()
+    return created
+
+def next_interval(state, listing, found_comments):
+    config = current_app.config
+    if listing.status == 'sold':
+        return config['POLL_SOLD_INTERVAL']
+    if found_comments:
+        return max(config['POLL_MIN_INTERVAL'], state.interval_seconds // 2)
+    return min(config['POLL_MAX_INTERVAL'], state.interval_seconds * 2)
+
+def poll_once(batch_size=None):
+    """Poll one batch of due (listing, platform) pairs.
+
+    Returns the number of pairs polled. Notifications and rescheduled state
+    for the whole batch are written in a single transaction.
+    """
+    batch_size = batch_size or current_app.config['POLL_BATCH_SIZE']
+    now = datetime.utcnow()
+    states = (PlatformPollState.query
+              .join(PlatformPollState.listing)
+              .options(contains_eager(PlatformPollState.listing))
+              .filter(PlatformPollState.next_check_at <= now,
+                      PlatformPollState.platform.in_(list(PLATFORMS)),
+                      Listing.status != 'deleted')
+              .order_by(PlatformPollState.next_check_at)
+              .limit(batch_size)
+              .all())
+
+    outcomes = get_registry().fan_out(
+        [(state.platform, 'check_comments', (state.listing_id, state.cursor)) for state in states]
+    )
+    for state, (success, value) in zip(states, outcomes):
+        listing = state.listing
+        if success:
+            comments, cursor = value
+        else:
+            current_app.logger.error("Error checking comments on %s: %s", state.platform, value)
+            comments, cursor = [], state.cursor
+        add_notifications([
+            Notification(
+                user_id=listing.user_id,
+                listing_id=listing.id,
+                content=comment['content'],
+                platform=comment['platform']
+            )
+            for comment in comments
+        ])
+        state.cursor = cursor
+        state.interval_seconds = next_interval(state, listing, bool(comments))
+        state.last_checked_at = now
+        state.next_check_at = now + timedelta(seconds=state.interval_seconds)
+
+    db.session.commit()
+    return len(states)
+
+def run_poller(batch_size=None, idle_sleep=10.0, once=False):
+    """Poll until interrupted, or until nothing is due if ``once``."""
+    batch_size = batch_size or current_app.config['POLL_BATCH_SIZE']
+    polled = 0
+    while True:
+        seeded = seed_poll_states(batch_size)
+        count = poll_once(batch_size)
+        polled += count
+        # A full batch means more pairs are probably due; keep going
+        if not seeded and count < batch_size:
+            if once:
+                return polled
+            time.sleep(idle_sleep)
+
+@poller_cli.command('run')
+@click.option('--once', is_flag=True, help='Exit once nothing is due.')
+@click.option('--batch-size', type=int, default=None, help='Pairs polled per transaction (default POLL_BATCH_SIZE).')
+@click.option('--idle-sleep', default=10.0, show_default=True, help='Seconds to sleep when nothing is due.')
+def run_command(once, batch_size, idle_sleep):
+    """Run the external comment poller."""
+    polled = run_poller(batch_size=batch_size, idle_sleep=idle_sleep, once=once)
+    click.echo(f"Polled {polled} listing/platform pair(s).")
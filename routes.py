@@ -1,30 +1,93 @@
-import os
-from flask import Blueprint, render_template, redirect, url_for, flash, request, current_app
+import io
+
+from flask import Blueprint, render_template, redirect, url_for, flash, request, current_app, abort, Response, stream_with_context
 from flask_login import login_required, current_user
-from werkzeug.utils import secure_filename
+from sqlalchemy.orm import selectinload
 from app import db
 from models import Listing, Photo, CustomField, User, Notification
-from forms import ListingForm, CustomFieldForm
-from external_platforms import post_to_external_platforms, check_external_platforms_comments
+from forms import ListingForm, CustomFieldForm, ImportListingsForm, BulkListingForm
+from bulk import (FORMATS, MIMETYPES, apply_bulk_action, bulk_form_conditions, detect_format, export_listings,
+                  import_listings)
+from cache import FEED_VERSION, cached_page, invalidate_listing, listing_version
+from images import process_photos_async
+from storage import add_photo
+from uploads import claim_uploads, store_photo, streamed_uploads
+from notifications import mark_read
+from pagination import keyset_page
+from search import search_listings
+from stats import change_status, record_listing_created
+from jobs import enqueue_listing_post, latest_jobs_for_listing, recent_jobs_for_user
+from user_cache import invalidate_user
 
 main = Blueprint('main', __name__)
 
-def allowed_file(filename):
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in {'png', 'jpg', 'jpeg', 'gif', 'bmp', 'webp'}
+def save_uploaded_photos(listing):
+    """Add the photos sent with the listing form, as files or as finished resumable uploads."""
+    photos = []
+    blobs = []
+    for upload in request.files.getlist('photos'):
+        if not upload:
+            continue
+        blob = store_photo(upload)
+        if blob is None:
+            current_app.logger.warning("Invalid file: %s", upload.filename)
+        else:
+            blobs.append(blob)
+    blobs.extend(claim_uploads(request.form.getlist('uploads')))
+    for blob in blobs:
+        photo_db = add_photo(listing, blob)
+        photos.append(photo_db)
+        current_app.logger.info("Photo saved: %s", photo_db.filename)
+    return photos
+
+def save_custom_fields(listing, fields):
+    """Bring the listing's custom fields in line with ``(name, value)`` pairs.
+
+    Fields are matched by name, so unchanged ones are left alone and only
+    edits, additions and removals reach the database.
+    """
+    existing = {}
+    for field in listing.custom_fields:
+        existing.setdefault(field.name, []).append(field)
+    for name, value in fields:
+        matches = existing.get(name)
+        if matches:
+            matches.pop(0).value = value
+        else:
+            db.session.add(CustomField(name=name, value=value, listing_id=listing.id))
+    for stale in existing.values():
+        for field in stale:
+            db.session.delete(field)
+
+def listing_cards():
+    """Listing query that loads everything a listing card renders up front."""
+    return Listing.query.options(selectinload(Listing.primary_photo).selectinload(Photo.variants))
 
 @main.route('/')
 @main.route('/home')
+@cached_page(lambda: [FEED_VERSION])
 def index():
-    listings = Listing.query.filter_by(status='active').order_by(Listing.id.desc()).limit(10).all()
-    return render_template('index.html', listings=listings)
+    page = keyset_page(listing_cards().filter_by(status='active'), [Listing.id],
+                       request.args.get('cursor'), current_app.config['LISTINGS_PER_PAGE'])
+    return render_template('index.html', listings=page.items, page=page)
+
+@main.route('/search')
+def search():
+    q = request.args.get('q', '').strip()
+    page = request.args.get('page', 1, type=int)
+    results = search_listings(q, page=max(page, 1), per_page=current_app.config['LISTINGS_PER_PAGE'],
+                              query=listing_cards())
+    return render_template('search.html', q=q, results=results)
 
 @main.route('/my_listings')
 @login_required
 def my_listings():
-    listings = current_user.listings.order_by(Listing.id.desc()).all()
-    return render_template('my_listings.html', listings=listings)
+    page = keyset_page(listing_cards().filter_by(user_id=current_user.id), [Listing.id],
+                       request.args.get('cursor'), current_app.config['LISTINGS_PER_PAGE'])
+    return render_template('my_listings.html', listings=page.items, page=page, bulk_form=BulkListingForm())
 
 @main.route('/create_listing', methods=['GET', 'POST'])
+@streamed_uploads
 @login_required
 def create_listing():
     form = ListingForm()
@@ -40,32 +103,24 @@ def create_listing():
             )
             db.session.add(listing)
             db.session.flush()
+            record_listing_created(listing)
+            invalidate_listing(listing.id)
 
-            for photo in request.files.getlist('photos'):
-                if photo and allowed_file(photo.filename):
-                    filename = secure_filename(photo.filename)
-                    photo_path = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
-                    photo.save(photo_path)
-                    photo_db = Photo(filename=filename, listing_id=listing.id)
-                    db.session.add(photo_db)
-                    current_app.logger.info(f"Photo saved: {photo_path}")
-                else:
-                    current_app.logger.warning(f"Invalid file: {photo.filename}")
+            photos = save_uploaded_photos(listing)
 
             for field in form.custom_fields.data:
                 if field['name'] and field['value']:
                     custom_field = CustomField(name=field['name'], value=field['value'], listing_id=listing.id)
                     db.session.add(custom_field)
 
+            if current_user.enable_cross_platform_posting:
+                enqueue_listing_post(listing)
+
             db.session.commit()
+            process_photos_async(photos)
 
             if current_user.enable_cross_platform_posting:
-                external_results = post_to_external_platforms(listing)
-                for result in external_results:
-                    if result['success']:
-                        flash(f"Successfully posted to {result['platform']}!")
-                    else:
-                        flash(f"Failed to post to {result['platform']}: {result['error']}", 'error')
+                flash('Your listing has been queued for posting to external platforms.')
             else:
                 flash('Cross-platform posting is disabled. Your listing was only created on this platform.')
 
@@ -73,18 +128,77 @@ def create_listing():
             return redirect(url_for('main.view_listing', listing_id=listing.id))
         except Exception as e:
             db.session.rollback()
-            current_app.logger.error(f"Error creating listing: {str(e)}")
+            current_app.logger.error("Error creating listing: %s", e)
             flash('An error occurred while creating your listing. Please try again.', 'error')
 
     return render_template('create_listing.html', form=form)
 
+@main.route('/my_listings/bulk', methods=['POST'])
+@login_required
+def bulk_update():
+    form = BulkListingForm()
+    if not form.validate_on_submit():
+        for errors in form.errors.values():
+            for error in errors:
+                flash(error, 'error')
+        return redirect(url_for('main.my_listings'))
+
+    conditions = bulk_form_conditions(form, request.form.getlist('listing_ids', type=int), user_id=current_user.id)
+    if conditions is None:
+        flash('Select at least one listing.', 'error')
+        return redirect(url_for('main.my_listings'))
+    try:
+        count = apply_bulk_action(form.action.data, conditions, form.percent.data,
+                                  post=current_user.enable_cross_platform_posting)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error("Error applying bulk %s for user %s: %s", form.action.data, current_user.id, e)
+        flash('An error occurred while updating your listings. Please try again.', 'error')
+        return redirect(url_for('main.my_listings'))
+    flash(f'Updated {count} listing(s).', 'success')
+    return redirect(url_for('main.my_listings'))
+
+@main.route('/listings/import', methods=['GET', 'POST'])
+@login_required
+def bulk_import():
+    form = ImportListingsForm()
+    result = None
+    if form.validate_on_submit():
+        upload = form.file.data
+        fmt = detect_format(upload.filename)
+        if fmt is None:
+            flash('Please upload a .csv or .jsonl file.', 'error')
+        else:
+            lines = io.TextIOWrapper(upload.stream, encoding='utf-8-sig', newline='')
+            result = import_listings(current_user, lines, fmt)
+            flash(f'Imported {result.created} listing(s).', 'success')
+    return render_template('import_listings.html', form=form, result=result)
+
+@main.route('/listings/export')
+@login_required
+def bulk_export():
+    fmt = request.args.get('format', 'csv')
+    if fmt not in FORMATS:
+        abort(400)
+    response = Response(stream_with_context(export_listings(current_user.id, fmt)), mimetype=MIMETYPES[fmt])
+    response.headers['Content-Disposition'] = f'attachment; filename=listings.{fmt}'
+    return response
+
 @main.route('/listing/<int:listing_id>')
+@cached_page(lambda listing_id: [listing_version(listing_id)])
 def view_listing(listing_id):
-    listing = Listing.query.get_or_404(listing_id)
-    check_external_platforms_comments(listing)
-    return render_template('view_listing.html', listing=listing)
+    listing = Listing.query.options(
+        selectinload(Listing.photos).selectinload(Photo.variants),
+        selectinload(Listing.custom_fields),
+    ).filter_by(id=listing_id).first_or_404()
+    jobs = []
+    if current_user.is_authenticated and listing.user_id == current_user.id:
+        jobs = latest_jobs_for_listing(listing.id)
+    return render_template('view_listing.html', listing=listing, jobs=jobs)
 
 @main.route('/listing/<int:listing_id>/edit', methods=['GET', 'POST'])
+@streamed_uploads
 @login_required
 def edit_listing(listing_id):
     listing = Listing.query.get_or_404(listing_id)
@@ -106,35 +220,24 @@ def edit_listing(listing_id):
             listing.location = form.location.data
             listing.negotiable = form.negotiable.data
 
-            for photo in request.files.getlist('photos'):
-                if photo and allowed_file(photo.filename):
-                    filename = secure_filename(photo.filename)
-                    photo_path = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
-                    photo.save(photo_path)
-                    photo_db = Photo(filename=filename, listing_id=listing.id)
-                    db.session.add(photo_db)
-                    current_app.logger.info(f"Photo saved: {photo_path}")
-                else:
-                    current_app.logger.warning(f"Invalid file: {photo.filename}")
-
-            # Clear existing custom fields
-            CustomField.query.filter_by(listing_id=listing.id).delete()
-
-            # Add updated custom fields
-            for field in form.custom_fields.data:
-                if field['name'] and field['value']:
-                    custom_field = CustomField(name=field['name'], value=field['value'], listing_id=listing.id)
-                    db.session.add(custom_field)
+            photos = save_uploaded_photos(listing)
+            invalidate_listing(listing.id)
 
-            db.session.commit()
+            save_custom_fields(listing, [(field['name'], field['value']) for field in form.custom_fields.data
+                                         if field['name'] and field['value']])
 
+            queued = None
             if current_user.enable_cross_platform_posting:
-                external_results = post_to_external_platforms(listing)
-                for result in external_results:
-                    if result['success']:
-                        flash(f"Successfully updated listing on {result['platform']}!", 'success')
-                    else:
-                        flash(f"Failed to update listing on {result['platform']}: {result['error']}", 'error')
+                queued = enqueue_listing_post(listing)
+
+            db.session.commit()
+            process_photos_async(photos)
+
+            if queued is not None and (queued.jobs or queued.pending):
+                # A pending job syncs the listing as it is when it runs, so it picks this update up too
+                flash('Your listing update has been queued for external platforms.', 'info')
+            elif queued is not None:
+                flash('External platforms already have the latest version of your listing.', 'info')
             else:
                 flash('Cross-platform posting is disabled. Your listing was only updated on this platform.', 'info')
 
@@ -142,7 +245,7 @@ def edit_listing(listing_id):
             return redirect(url_for('main.view_listing', listing_id=listing.id))
         except Exception as e:
             db.session.rollback()
-            current_app.logger.error(f"Error updating listing {listing_id}: {str(e)}")
+            current_app.logger.error("Error updating listing %s: %s", listing_id, e)
             flash('An error occurred while updating your listing. Please try again.', 'error')
 
     return render_template('edit_listing.html', form=form, listing=listing)
@@ -155,7 +258,8 @@ def mark_sold(listing_id):
         flash('You can only mark your own listings as sold.')
         return redirect(url_for('main.view_listing', listing_id=listing_id))
 
-    listing.status = 'sold'
+    change_status(listing, 'sold')
+    invalidate_listing(listing.id)
     db.session.commit()
     flash('Your listing has been marked as sold!')
     return redirect(url_for('main.view_listing', listing_id=listing_id))
@@ -165,19 +269,27 @@ def mark_sold(listing_id):
 def profile():
     if request.method == 'POST':
         current_user.enable_cross_platform_posting = 'enable_cross_platform' in request.form
+        invalidate_user(current_user.id)
         db.session.commit()
         flash('Your settings have been updated.')
         return redirect(url_for('main.profile'))
 
-    listings = current_user.listings.order_by(Listing.id.desc()).all()
-    notifications = current_user.notifications.order_by(Notification.timestamp.desc()).limit(10).all()
-    return render_template('profile.html', user=current_user, listings=listings, notifications=notifications)
+    # The profile shows the first page of each feed and links to the full ones
+    listings = keyset_page(listing_cards().filter_by(user_id=current_user.id), [Listing.id],
+                           per_page=current_app.config['LISTINGS_PER_PAGE'])
+    notifications = keyset_page(Notification.query.filter_by(user_id=current_user.id),
+                                [Notification.timestamp, Notification.id], per_page=10)
+    jobs = recent_jobs_for_user(current_user.id)
+    return render_template('profile.html', user=current_user, listings=listings.items, more_listings=listings.has_next,
+                           notifications=notifications.items, jobs=jobs)
 
 @main.route('/notifications')
 @login_required
 def notifications():
-    notifications = current_user.notifications.order_by(Notification.timestamp.desc()).all()
-    return render_template('notifications.html', notifications=notifications)
+    page = keyset_page(Notification.query.filter_by(user_id=current_user.id),
+                       [Notification.timestamp, Notification.id],
+                       request.args.get('cursor'), current_app.config['NOTIFICATIONS_PER_PAGE'])
+    return render_template('notifications.html', notifications=page.items, page=page)
 
 @main.route('/notification/<int:notification_id>/mark_read')
 @login_required
@@ -187,7 +299,18 @@ def mark_notification_read(notification_id):
         flash('You can only mark your own notifications as read.')
         return redirect(url_for('main.notifications'))
 
-    notification.is_read = True
+    mark_read(current_user.id, [notification.id])
     db.session.commit()
     flash('Notification marked as read.')
     return redirect(url_for('main.notifications'))
+
+@main.route('/notifications/mark_read', methods=['POST'])
+@login_required
+def mark_notifications_read():
+    if 'all' in request.form:
+        marked = mark_read(current_user.id)
+    else:
+        marked = mark_read(current_user.id, request.form.getlist('notification_ids', type=int))
+    db.session.commit()
+    flash(f'Marked {marked} notification(s) as read.')
+    return redirect(url_for('main.notifications'))
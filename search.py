@@ -0,0 +1,135 @@
+"""Ranked full-text search over listings.
+
+SQLite uses an FTS5 external-content table kept in step with ``listing`` by
+triggers; Postgres uses a generated ``tsvector`` column with a GIN index.
+Either way the index is maintained by the database on every insert, update
+and delete, including bulk statements that bypass the ORM. Other databases
+fall back to substring matching.
+"""
+import re
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import DDL, column, event, or_, table, text
+
+from app import db
+from models import Listing, User
+
+search_cli = AppGroup('search', help='Listing search commands.')
+
+SQLITE_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS listing_fts USING fts5("
+    "title, description, content='listing', content_rowid='id', tokenize='porter unicode61')",
+    "CREATE TRIGGER IF NOT EXISTS listing_fts_insert AFTER INSERT ON listing BEGIN "
+    "INSERT INTO listing_fts(rowid, title, description) VALUES (new.id, new.title, new.description); END",
+    "CREATE TRIGGER IF NOT EXISTS listing_fts_delete AFTER DELETE ON listing BEGIN "
+    "INSERT INTO listing_fts(listing_fts, rowid, title, description) "
+    "VALUES ('delete', old.id, old.title, old.description); END",
+    "CREATE TRIGGER IF NOT EXISTS listing_fts_update AFTER UPDATE OF title, description ON listing BEGIN "
+    "INSERT INTO listing_fts(listing_fts, rowid, title, description) "
+    "VALUES ('delete', old.id, old.title, old.description); "
+    "INSERT INTO listing_fts(rowid, title, description) VALUES (new.id, new.title, new.description); END",
+]
+
+POSTGRES_DDL = [
+    "ALTER TABLE listing ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS ("
+    "setweight(to_tsvector('english', coalesce(title, '')), 'A') || "
+    "setweight(to_tsvector('english', coalesce(description, '')), 'B')) STORED",
+    "CREATE INDEX IF NOT EXISTS ix_listing_search_vector ON listing USING GIN (search_vector)",
+]
+
+listing_fts = table('listing_fts', column('rowid'))
+
+for statement in SQLITE_DDL:
+    event.listen(Listing.__table__, 'after_create', DDL(statement).execute_if(dialect='sqlite'))
+for statement in POSTGRES_DDL:
+    event.listen(Listing.__table__, 'after_create', DDL(statement).execute_if(dialect='postgresql'))
+
+class Page:
+    """One page of results, fetched without counting the total."""
+
+    def __init__(self, items, page, per_page, has_next):
+        self.items = items
+        self.page = page
+        self.per_page = per_page
+        self.has_next = has_next
+        self.has_prev = page > 1
+        self.next_num = page + 1 if has_next else None
+        self.prev_num = page - 1 if page > 1 else None
+
+def _fetch_page(query, page, per_page):
+    rows = query.limit(per_page + 1).offset((page - 1) * per_page).all()
+    return Page(rows[:per_page], page, per_page, len(rows) > per_page)
+
+def _fts5_query(terms):
+    # Quote every term so user input can't inject FTS5 syntax; the trailing
+    # star makes the last word a prefix match for search-as-you-type
+    quoted = [f'"{term}"' for term in terms]
+    quoted[-1] += '*'
+    return ' '.join(quoted)
+
+def search_listings(q, page=1, per_page=10, status='active', query=None):
+    """Return a ``Page`` of listings matching ``q``, best matches first.
+
+    ``query`` is the base ``Listing`` query, for callers adding loader options.
+    """
+    terms = re.findall(r'\w+', q or '')
+    query = Listing.query if query is None else query
+    if status is not None:
+        query = query.filter(Listing.status == status)
+    if not terms:
+        return Page([], page, per_page, False)
+
+    dialect = db.engine.dialect.name
+    if dialect == 'sqlite':
+        query = (query
+                 .join(listing_fts, listing_fts.c.rowid == Listing.id)
+                 .filter(text('listing_fts MATCH :match'))
+                 # bm25 is lower for better matches; title hits weigh 10x
+                 .order_by(text('bm25(listing_fts, 10.0, 1.0)'), Listing.id.desc())
+                 .params(match=_fts5_query(terms)))
+    elif dialect == 'postgresql':
+        query = (query
+                 .filter(text("search_vector @@ websearch_to_tsquery('english', :q)"))
+                 .order_by(text("ts_rank_cd(search_vector, websearch_to_tsquery('english', :q)) DESC"),
+                           Listing.id.desc())
+                 .params(q=' '.join(terms)))
+    else:
+        for term in terms:
+            query = query.filter(or_(Listing.title.ilike(f'%{term}%'), Listing.description.ilike(f'%{term}%')))
+        query = query.order_by(Listing.id.desc())
+    return _fetch_page(query, page, per_page)
+
+def search_users(q, page=1, per_page=10):
+    """Return a ``Page`` of users whose username or email contains ``q``.
+
+    This scans the user table: a substring match cannot use the btree
+    indexes on username and email.
+    """
+    q = (q or '').strip()
+    if not q:
+        return Page([], page, per_page, False)
+    pattern = '%' + q.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+    query = (User.query
+             .filter(or_(User.username.ilike(pattern, escape='\\'), User.email.ilike(pattern, escape='\\')))
+             .order_by(User.id))
+    return _fetch_page(query, page, per_page)
+
+@search_cli.command('rebuild')
+def rebuild_command():
+    """Create the search index if missing and rebuild it from ``listing``."""
+    dialect = db.engine.dialect.name
+    if dialect == 'sqlite':
+        for statement in SQLITE_DDL:
+            db.session.execute(text(statement))
+        db.session.execute(text("INSERT INTO listing_fts(listing_fts) VALUES ('rebuild')"))
+    elif dialect == 'postgresql':
+        # The generated column is always current; only make sure it exists
+        for statement in POSTGRES_DDL:
+            db.session.execute(text(statement))
+    else:
+        raise click.ClickException(f"Full-text search is not supported on {dialect}")
+    db.session.commit()
+    current_app.logger.info("Search index rebuilt")
+    click.echo("Search index rebuilt.")
@@ -72,3 +72,100 @@ function dataURLtoBlob(dataURL) {
     }
     return new Blob([u8arr], { type: mime });
 }
+
+// Resumable photo uploads: each photo goes up in chunks before the form is
+// submitted, so a dropped connection only costs the current chunk. The form
+// then carries the upload tokens instead of the files (see uploads.py).
+const UPLOAD_RETRIES = 5;
+
+document.addEventListener('DOMContentLoaded', function() {
+    const photoInput = document.getElementById('photo-input');
+    if (!photoInput || !photoInput.dataset.uploadUrl || !window.fetch) {
+        return;
+    }
+    const form = photoInput.form;
+    const status = document.getElementById('upload-status');
+    let uploading = false;
+
+    form.addEventListener('submit', async function(event) {
+        if (photoInput.files.length === 0) {
+            return;
+        }
+        event.preventDefault();
+        if (uploading) {
+            return;
+        }
+        uploading = true;
+        const csrfToken = form.querySelector('input[name="csrf_token"]').value;
+        const files = Array.from(photoInput.files);
+        try {
+            for (let i = 0; i < files.length; i++) {
+                const token = await uploadFile(photoInput.dataset.uploadUrl, files[i], csrfToken, function(sent) {
+                    status.textContent = `Uploading photo ${i + 1} of ${files.length} (${Math.round(100 * sent / files[i].size)}%)`;
+                });
+                const input = document.createElement('input');
+                input.type = 'hidden';
+                input.name = 'uploads';
+                input.value = token;
+                form.appendChild(input);
+            }
+        } catch (error) {
+            status.textContent = `Upload failed: ${error.message}`;
+            uploading = false;
+            return;
+        }
+        status.textContent = 'Saving listing...';
+        photoInput.value = '';
+        form.submit();
+    });
+});
+
+async function uploadFile(url, file, csrfToken, onProgress) {
+    const headers = {'X-CSRFToken': csrfToken};
+    const created = await fetch(url, {
+        method: 'POST',
+        headers: Object.assign({'Content-Type': 'application/json'}, headers),
+        body: JSON.stringify({filename: file.name, size: file.size}),
+    });
+    let upload = await created.json();
+    if (!created.ok) {
+        throw new Error(upload.error || created.statusText);
+    }
+    const location = created.headers.get('Location');
+    let failures = 0;
+    while (!upload.complete) {
+        const chunk = file.slice(upload.offset, upload.offset + upload.chunk_size);
+        let response;
+        try {
+            response = await fetch(location, {
+                method: 'PATCH',
+                headers: Object.assign({'Upload-Offset': String(upload.offset),
+                                        'Content-Type': 'application/octet-stream'}, headers),
+                body: chunk,
+            });
+        } catch (error) {
+            response = null;
+        }
+        if (response && (response.ok || response.status === 409)) {
+            // 409 carries the server's offset to carry on from
+            upload = await response.json();
+            failures = 0;
+            onProgress(upload.offset);
+            continue;
+        }
+        if (response && response.status < 500) {
+            const body = await response.json().catch(() => ({}));
+            throw new Error(body.error || response.statusText);
+        }
+        if (++failures > UPLOAD_RETRIES) {
+            throw new Error('the connection keeps failing');
+        }
+        await new Promise(resolve => setTimeout(resolve, 1000 * 2 ** failures));
+        // Resume from whatever the server actually kept
+        const current = await fetch(location).catch(() => null);
+        if (current && current.ok) {
+            upload = await current.json();
+        }
+    }
+    return upload.token;
+}
@@ -18,3 +18,42 @@ document.addEventListener('DOMContentLoaded', function() {
         }, 5000);
     });
 });
+
+// Live notifications: bump the unread badges and prepend to the list page
+document.addEventListener('DOMContentLoaded', function() {
+    const streamUrl = document.body.dataset.notificationStream;
+    if (!streamUrl || !window.EventSource) {
+        return;
+    }
+
+    const source = new EventSource(streamUrl);
+    source.addEventListener('notification', function(event) {
+        const notification = JSON.parse(event.data);
+
+        const badge = document.querySelector('[data-unread-badge]');
+        if (badge) {
+            const count = (parseInt(badge.textContent, 10) || 0) + 1;
+            badge.textContent = count;
+            badge.classList.remove('hidden');
+            const mobileCount = document.querySelector('[data-unread-count]');
+            if (mobileCount) {
+                mobileCount.textContent = '(' + count + ')';
+                mobileCount.classList.remove('hidden');
+            }
+        }
+
+        const list = document.getElementById('notification-list');
+        if (list) {
+            const item = document.createElement('li');
+            item.className = 'mb-4 font-bold';
+            const content = document.createElement('p');
+            content.textContent = notification.content;
+            const meta = document.createElement('p');
+            meta.className = 'text-sm text-gray-500';
+            meta.textContent = notification.platform + ' - ' + (notification.timestamp || '').slice(0, 16).replace('T', ' ');
+            item.appendChild(content);
+            item.appendChild(meta);
+            list.insertBefore(item, list.firstChild);
+        }
+    });
+});
@@ -0,0 +1,197 @@
+"""Incrementally maintained site statistics.
+
+``SiteStats`` holds running totals and ``DailyStats`` per-day counts of
+listings created and sold. Every write that changes them calls one of the
+``record_*`` helpers or ``change_status`` before committing, so the rollups
+move in the same transaction as the data. The listing helpers also keep
+``User.listing_count`` in step, so the navigation can tell sellers apart
+from the cached user without a query. The helpers issue relative
+``UPDATE``s, which keeps concurrent requests from losing increments.
+``flask stats rebuild`` recomputes everything from the base tables.
+"""
+from collections import Counter
+from datetime import date, datetime, timedelta
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import func, select, update
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from models import DailyStats, Listing, SiteStats, User
+from user_cache import invalidate_all_users, invalidate_user
+
+stats_cli = AppGroup('stats', help='Site statistics commands.')
+
+SITE_STATS_ID = 1
+# Statuses with their own running total
+STATUS_COUNTERS = {'active': 'active_listings', 'sold': 'sold_listings'}
+
+def _bump(model, key, **deltas):
+    """Add ``deltas`` to the counters of the ``model`` row ``key``, creating it if needed."""
+    deltas = {name: delta for name, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    pk = model.__mapper__.primary_key[0]
+    statement = (update(model).where(pk == key)
+                 .values({name: getattr(model, name) + delta for name, delta in deltas.items()}))
+    if db.session.execute(statement).rowcount:
+        return
+    try:
+        with db.session.begin_nested():
+            db.session.add(model(**{pk.key: key}, **{name: 0 for name in deltas}))
+    except IntegrityError:
+        # Another transaction created the row first
+        pass
+    db.session.execute(statement)
+
+def _bump_site(**deltas):
+    _bump(SiteStats, SITE_STATS_ID, **deltas)
+
+def _bump_day(when, **deltas):
+    if when is not None:
+        _bump(DailyStats, when.date(), **deltas)
+
+def _adjust_listing_counts(deltas):
+    for user_id, delta in deltas.items():
+        if delta:
+            db.session.execute(update(User).where(User.id == user_id)
+                               .values(listing_count=User.listing_count + delta))
+            invalidate_user(user_id)
+
+def _status_deltas(status, sign):
+    counter = STATUS_COUNTERS.get(status)
+    return {counter: sign} if counter else {}
+
+def record_user_created():
+    _bump_site(users=1)
+
+def record_user_deleted():
+    _bump_site(users=-1)
+
+def record_listing_created(listing):
+    status = listing.status or 'active'
+    _bump_site(listings=1, **_status_deltas(status, 1))
+    _bump_day(listing.created_at or datetime.utcnow(), listings_created=1)
+    _adjust_listing_counts({listing.user_id: 1})
+
+def record_listings_created(user_id, count, when):
+    """Count ``count`` new active listings of ``user_id`` created at ``when`` in one go."""
+    _bump_site(listings=count, active_listings=count)
+    _bump_day(when, listings_created=count)
+    _adjust_listing_counts({user_id: count})
+
+def _bump_days(counter, deltas):
+    for day, delta in deltas.items():
+        _bump(DailyStats, day, **{counter: delta})
+
+def record_listings_deleted(listings):
+    """Count ``listings`` out of the rollups, one update per counter and day.
+
+    Takes anything with ``user_id``, ``status``, ``created_at`` and
+    ``sold_at``, such as ``Listing`` objects or rows selected from it.
+    """
+    site = Counter()
+    created = Counter()
+    sold = Counter()
+    owners = Counter()
+    for listing in listings:
+        site['listings'] -= 1
+        owners[listing.user_id] -= 1
+        site.update(_status_deltas(listing.status, -1))
+        # Deleted listings leave the daily buckets too, so a rebuild agrees
+        if listing.created_at is not None:
+            created[listing.created_at.date()] -= 1
+        if listing.status == 'sold' and listing.sold_at is not None:
+            sold[listing.sold_at.date()] -= 1
+    _bump_site(**site)
+    _bump_days('listings_created', created)
+    _bump_days('listings_sold', sold)
+    _adjust_listing_counts(owners)
+
+def record_listing_deleted(listing):
+    record_listings_deleted([listing])
+
+def record_status_changes(listings, status, when):
+    """Count ``listings`` moving to ``status`` at ``when``.
+
+    Takes anything with ``status`` and ``sold_at`` as they were before the
+    change; the caller updates the rows.
+    """
+    site = Counter()
+    sold = Counter()
+    for listing in listings:
+        if listing.status == status:
+            continue
+        site.update(_status_deltas(listing.status, -1))
+        site.update(_status_deltas(status, 1))
+        if listing.status == 'sold' and listing.sold_at is not None:
+            sold[listing.sold_at.date()] -= 1
+        if status == 'sold':
+            sold[when.date()] += 1
+    _bump_site(**site)
+    _bump_days('listings_sold', sold)
+
+def change_status(listing, status):
+    """Set ``listing.status`` and keep the totals and sold buckets in step."""
+    if status == listing.status:
+        return
+    now = datetime.utcnow()
+    record_status_changes([listing], status, now)
+    listing.status = status
+    listing.sold_at = now if status == 'sold' else None
+
+def site_stats():
+    return db.session.get(SiteStats, SITE_STATS_ID) or SiteStats(users=0, listings=0, active_listings=0,
+                                                                sold_listings=0)
+
+def daily_stats(days=30):
+    """The last ``days`` days of activity, oldest first, with empty days filled in."""
+    today = datetime.utcnow().date()
+    start = today - timedelta(days=days - 1)
+    rows = {row.day: row for row in DailyStats.query.filter(DailyStats.day >= start)}
+    return [rows.get(start + timedelta(days=i)) or DailyStats(day=start + timedelta(days=i), listings_created=0,
+                                                              listings_sold=0)
+            for i in range(days)]
+
+def _as_date(value):
+    return date.fromisoformat(value) if isinstance(value, str) else value
+
+def rebuild_stats():
+    """Recompute every rollup from the base tables."""
+    db.session.query(SiteStats).delete()
+    db.session.query(DailyStats).delete()
+
+    status_counts = dict(db.session.query(Listing.status, func.count()).group_by(Listing.status).all())
+    db.session.add(SiteStats(
+        id=SITE_STATS_ID,
+        users=db.session.query(func.count(User.id)).scalar(),
+        listings=sum(status_counts.values()),
+        active_listings=status_counts.get('active', 0),
+        sold_listings=status_counts.get('sold', 0),
+    ))
+
+    listings = (select(func.count(Listing.id)).where(Listing.user_id == User.id).scalar_subquery())
+    db.session.execute(update(User).values(listing_count=listings))
+    invalidate_all_users()
+
+    days = {}
+    for column, counter, condition in (
+        (Listing.created_at, 'listings_created', Listing.created_at.isnot(None)),
+        (Listing.sold_at, 'listings_sold', (Listing.status == 'sold') & Listing.sold_at.isnot(None)),
+    ):
+        for day, count in (db.session.query(func.date(column), func.count())
+                           .filter(condition).group_by(func.date(column))):
+            day = _as_date(day)
+            if day not in days:
+                days[day] = DailyStats(day=day, listings_created=0, listings_sold=0)
+            setattr(days[day], counter, count)
+    db.session.add_all(days.values())
+    db.session.commit()
+    return len(days)
+
+@stats_cli.command('rebuild')
+def rebuild_command():
+    """Recompute site statistics from scratch."""
+    days = rebuild_stats()
+    click.echo(f"Rebuilt site statistics ({days} day(s) of history).")
@@ -0,0 +1,229 @@
+"""Content-addressed storage for uploaded photos.
+
+Uploads are hashed while they stream to disk and stored once under
+``uploads/blobs/ab/cd/<sha256><ext>``, so identical images share a file and
+different images can never overwrite each other. ``Blob.ref_count`` tracks
+how many ``Photo`` rows point at a blob; ``flask storage gc`` deletes blobs
+nobody references any more, together with their derivatives.
+"""
+import glob
+import hashlib
+import os
+import tempfile
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import and_, bindparam, delete, func, select, update
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from cache import invalidate_listing
+from models import Blob, Listing, Photo, PhotoVariant
+
+storage_cli = AppGroup('storage', help='Photo storage commands.')
+
+BLOB_DIR = 'blobs'
+CHUNK_SIZE = 64 * 1024
+
+def blob_path(sha256, extension):
+    """Path of a blob relative to ``UPLOAD_FOLDER``."""
+    return f'{BLOB_DIR}/{sha256[:2]}/{sha256[2:4]}/{sha256}{extension}'
+
+def _absolute(relative_path):
+    return os.path.join(current_app.config['UPLOAD_FOLDER'], relative_path)
+
+def temp_dir():
+    """Directory for files on their way into the blob store, on the same filesystem."""
+    path = _absolute(os.path.join(BLOB_DIR, 'tmp'))
+    os.makedirs(path, exist_ok=True)
+    return path
+
+def _stream_to_temp(stream):
+    """Copy ``stream`` to a temp file next to the blob store, hashing as it goes."""
+    digest = hashlib.sha256()
+    size = 0
+    fd, tmp_path = tempfile.mkstemp(dir=temp_dir())
+    with os.fdopen(fd, 'wb') as out:
+        while True:
+            chunk = stream.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+            size += len(chunk)
+            out.write(chunk)
+    return tmp_path, digest.hexdigest(), size
+
+def _get_or_create_blob(sha256, extension, size):
+    blob = Blob.query.filter_by(sha256=sha256).first()
+    if blob is not None:
+        return blob
+    try:
+        with db.session.begin_nested():
+            blob = Blob(sha256=sha256, extension=extension, size=size, ref_count=0)
+            db.session.add(blob)
+    except IntegrityError:
+        # Another request stored the same content first
+        blob = Blob.query.filter_by(sha256=sha256).one()
+    return blob
+
+def store_file(tmp_path, sha256, size, extension):
+    """Move an already hashed file from ``temp_dir()`` into the store and return its ``Blob``.
+
+    The blob is not referenced yet; pair with ``add_photo`` in the same
+    transaction.
+    """
+    extension = extension.lower()
+    # Locked until our reference to it commits, so collect_garbage skips it;
+    # if garbage collection got it first, this waits and finds nothing
+    existing = Blob.query.filter_by(sha256=sha256).with_for_update().first()
+    if existing is not None:
+        extension = existing.extension
+    final_path = _absolute(blob_path(sha256, extension))
+    if os.path.exists(final_path):
+        os.remove(tmp_path)
+    else:
+        # Also restores the file of a blob whose collection was interrupted
+        os.makedirs(os.path.dirname(final_path), exist_ok=True)
+        os.replace(tmp_path, final_path)
+    return existing or _get_or_create_blob(sha256, extension, size)
+
+def store_stream(stream, extension):
+    """Store the contents of ``stream`` and return its ``Blob``, as ``store_file``."""
+    return store_file(*_stream_to_temp(stream), extension)
+
+def _add_reference(blob):
+    db.session.execute(update(Blob).where(Blob.id == blob.id).values(
+        ref_count=Blob.ref_count + 1, updated_at=datetime.utcnow()))
+
+def adjust_references(deltas):
+    """Apply ``{blob_id: delta}`` reference count changes in one statement."""
+    deltas = [{'target_id': blob_id, 'delta': delta} for blob_id, delta in deltas.items() if delta]
+    if not deltas:
+        return
+    blob = Blob.__table__
+    db.session.execute(
+        update(blob).where(blob.c.id == bindparam('target_id'))
+        .values(ref_count=blob.c.ref_count + bindparam('delta'), updated_at=datetime.utcnow()),
+        deltas,
+    )
+
+def add_photo(listing, blob):
+    """Create a ``Photo`` of ``listing`` referencing ``blob``.
+
+    The first photo of a listing becomes its primary photo.
+    """
+    _add_reference(blob)
+    photo = Photo(filename=blob_path(blob.sha256, blob.extension), blob_id=blob.id, listing_id=listing.id)
+    db.session.add(photo)
+    if listing.primary_photo is None:
+        listing.primary_photo = photo
+    invalidate_listing(listing.id)
+    return photo
+
+def delete_photo(photo):
+    """Delete ``photo`` and drop its reference to the underlying blob.
+
+    If it was its listing's primary photo, the next remaining one takes over.
+    """
+    listing = photo.listing
+    invalidate_listing(photo.listing_id)
+    if listing is not None and listing.primary_photo is photo:
+        listing.primary_photo = next((other for other in listing.photos if other.id != photo.id), None)
+    if photo.blob_id is not None:
+        db.session.execute(update(Blob).where(Blob.id == photo.blob_id).values(
+            ref_count=Blob.ref_count - 1, updated_at=datetime.utcnow()))
+    db.session.delete(photo)
+
+def delete_listing_photos(listing_ids):
+    """``delete_photo`` for every photo of ``listing_ids``, as a few set-based statements.
+
+    Clears the listings' primary photos too, since they are about to go.
+    """
+    db.session.execute(update(Listing).where(Listing.id.in_(listing_ids)).values(primary_photo_id=None)
+                       .execution_options(synchronize_session=False))
+    references = (select(Photo.blob_id, func.count())
+                  .where(Photo.listing_id.in_(listing_ids), Photo.blob_id.isnot(None))
+                  .group_by(Photo.blob_id))
+    adjust_references({blob_id: -count for blob_id, count in db.session.execute(references)})
+    photo_ids = select(Photo.id).where(Photo.listing_id.in_(listing_ids))
+    db.session.execute(delete(PhotoVariant).where(PhotoVariant.photo_id.in_(photo_ids))
+                       .execution_options(synchronize_session=False))
+    db.session.execute(delete(Photo).where(Photo.listing_id.in_(listing_ids))
+                       .execution_options(synchronize_session=False))
+    for listing_id in listing_ids:
+        invalidate_listing(listing_id)
+
+def _remove_files(relative_path):
+    path = _absolute(relative_path)
+    stem = os.path.splitext(path)[0]
+    for filename in [path] + glob.glob(f'{stem}-*'):
+        try:
+            os.remove(filename)
+        except FileNotFoundError:
+            pass
+
+def collect_garbage(grace_seconds=3600, batch_size=500):
+    """Delete blobs that have been unreferenced for ``grace_seconds``.
+
+    The grace period keeps blobs just written by an upload whose transaction
+    has not committed yet. Candidates are locked and the delete re-checks
+    them, so a blob that ``store_file`` is reusing (and has locked) is left
+    alone. Returns the number of blobs deleted.
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=grace_seconds)
+    referenced = select(Photo.id).where(Photo.blob_id == Blob.id).exists()
+    collectable = and_(Blob.ref_count <= 0, Blob.updated_at < cutoff, ~referenced)
+    deleted = 0
+    last_id = 0
+    while True:
+        candidates = db.session.execute(
+            select(Blob.id)
+            .where(Blob.id > last_id, collectable)
+            .order_by(Blob.id)
+            .limit(batch_size)
+            .with_for_update(skip_locked=True)
+        ).scalars().all()
+        if not candidates:
+            db.session.commit()
+            break
+        last_id = candidates[-1]
+        gone = db.session.execute(
+            delete(Blob).where(Blob.id.in_(candidates), collectable)
+            .returning(Blob.sha256, Blob.extension)
+            .execution_options(synchronize_session='fetch')
+        ).all()
+        # Files go before the commit, while the rows are still locked. A
+        # crash in between leaves rows without files, which store_file
+        # fills in again if the content is uploaded once more.
+        for sha256, extension in gone:
+            _remove_files(blob_path(sha256, extension))
+        db.session.commit()
+        deleted += len(gone)
+    return deleted
+
+@storage_cli.command('gc')
+@click.option('--grace', default=3600, show_default=True, help='Keep unreferenced blobs younger than this many seconds.')
+def gc_command(grace):
+    """Delete photo blobs that are no longer referenced."""
+    deleted = collect_garbage(grace_seconds=grace)
+    click.echo(f"Deleted {deleted} unreferenced blob(s).")
+
+@storage_cli.command('adopt')
+def adopt_command():
+    """Move photos saved before content addressing into the blob store."""
+    adopted = 0
+    for photo in Photo.query.filter(Photo.blob_id.is_(None)).order_by(Photo.id).all():
+        legacy_path = _absolute(photo.filename)
+        if not os.path.exists(legacy_path):
+            current_app.logger.warning("Photo %s file is missing: %s", photo.id, legacy_path)
+            continue
+        with open(legacy_path, 'rb') as legacy:
+            blob = store_stream(legacy, os.path.splitext(photo.filename)[1])
+        _add_reference(blob)
+        photo.blob_id = blob.id
+        photo.filename = blob_path(blob.sha256, blob.extension)
+        db.session.commit()
+        adopted += 1
+    click.echo(f"Moved {adopted} photo(s) into the blob store.")
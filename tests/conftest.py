@@ -0,0 +1,34 @@
+import pytest
+from flask.testing import FlaskClient
+
+from perf import scratch_app
+from tests.factories import make_user
+
+class AppContextClient(FlaskClient):
+    """Runs every request in a fresh app context.
+
+    ``scratch_app`` keeps one pushed for the test itself; without this the
+    requests would share its ``g`` and session, and with them the login.
+    """
+
+    def open(self, *args, **kwargs):
+        with self.application.app_context():
+            return super().open(*args, **kwargs)
+
+@pytest.fixture
+def app(tmp_path):
+    with scratch_app(PASSWORD_VERIFY_WORKERS=0) as app:
+        app.config['UPLOAD_FOLDER'] = str(tmp_path)
+        app.test_client_class = AppContextClient
+        yield app
+
+@pytest.fixture
+def user(app):
+    return make_user()
+
+@pytest.fixture
+def client(app, user):
+    client = app.test_client()
+    response = client.post('/login', data={'email': user.email, 'password': 'secret'})
+    assert response.status_code == 302
+    return client
@@ -0,0 +1,16 @@
+from app import db
+from models import Listing, User
+
+def make_user(username='seller', password='secret', is_admin=False):
+    user = User(username=username, email=f'{username}@example.com', is_admin=is_admin)
+    user.set_password(password)
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+def make_listing(user, **values):
+    listing = Listing(**{'title': 'Bike', 'description': 'Red', 'price': 100.0, 'location': 'Town', **values},
+                      user_id=user.id)
+    db.session.add(listing)
+    db.session.commit()
+    return listing
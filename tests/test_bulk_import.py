@@ -0,0 +1,73 @@
+import json
+
+import pytest
+
+from app import db
+from bulk import export_listings, import_listings
+from external_platforms import get_registry
+from jobs import PENDING
+from models import CustomField, Listing, OutboundJob
+from stats import site_stats
+from tests.factories import make_user
+
+CSV = [
+    'title,description,price,location,negotiable,field:Colour\n',
+    'Bike,Red bike,100,Town,yes,Red\n',
+    ',No title,5,Town,no,\n',
+    'Lamp,Desk lamp,not a price,Town,no,\n',
+    'Desk,Oak desk,250.5,City,no,Brown\n',
+]
+
+def import_csv(user, lines=CSV, **kwargs):
+    result = import_listings(user, iter(lines), 'csv', **kwargs)
+    db.session.refresh(user)
+    return result
+
+def test_csv_import_creates_valid_rows_and_reports_the_rest(user):
+    result = import_csv(user, post=False)
+
+    assert result.created == 2
+    assert [line for line, _ in result.errors] == [3, 4]
+    assert 'title' in result.errors[0][1] and 'price' in result.errors[1][1]
+    desk = Listing.query.filter_by(title='Desk').one()
+    assert (desk.price, desk.location, desk.status) == (250.5, 'City', 'active')
+    assert [(field.name, field.value) for field in desk.custom_fields] == [('Colour', 'Brown')]
+    assert user.listing_count == 2
+    assert site_stats().listings == 2
+
+def test_import_commits_in_batches(user):
+    result = import_csv(user, batch_size=1, post=False)
+
+    assert result.created == 2
+    assert Listing.query.count() == 2
+
+def test_import_can_queue_platform_posts(user):
+    import_csv(user, post=True)
+
+    assert OutboundJob.query.filter_by(status=PENDING).count() == 2 * len(get_registry().names())
+
+def test_jsonl_import_accepts_a_field_mapping(user):
+    lines = [
+        json.dumps({'title': 'Chair', 'description': 'Wooden', 'price': 20, 'location': 'Town',
+                    'custom_fields': {'Legs': '4'}}) + '\n',
+        'not json\n',
+    ]
+
+    result = import_listings(user, iter(lines), 'jsonl', post=False)
+
+    assert result.created == 1
+    assert [line for line, _ in result.errors] == [2]
+    assert CustomField.query.one().value == '4'
+
+@pytest.mark.parametrize('fmt', ['csv', 'jsonl'])
+def test_export_round_trips_through_import(user, fmt):
+    import_csv(user, post=False)
+    exported = ''.join(export_listings(user.id, fmt)).splitlines(keepends=True)
+    other = make_user('buyer')
+
+    result = import_listings(other, iter(exported), fmt, post=False)
+
+    assert result.errors == []
+    copies = Listing.query.filter_by(user_id=other.id).order_by(Listing.id).all()
+    assert [(listing.title, listing.price) for listing in copies] == [('Bike', 100.0), ('Desk', 250.5)]
+    assert copies[1].custom_fields[0].value == 'Brown'
@@ -0,0 +1,96 @@
+from sqlalchemy.exc import OperationalError
+
+from app import db
+from bulk import apply_bulk_action, change_prices, change_statuses, delete_listings, import_listings, listing_conditions
+from jobs import CANCELLED, claim_jobs
+from models import CustomField, Listing, OutboundJob
+from stats import site_stats
+from tests.factories import make_listing, make_user
+
+CSV = [
+    'title,description,price,location,field:Colour\n',
+    'Bike,Red bike,100,Town,Red\n',
+    'Desk,Oak desk,250.5,City,Brown\n',
+]
+
+def import_csv(user, **kwargs):
+    result = import_listings(user, iter(CSV), 'csv', **kwargs)
+    db.session.refresh(user)
+    return result
+
+def test_price_change_applies_to_matching_listings_only(user):
+    bike = make_listing(user, price=100.0)
+    sold = make_listing(user, price=50.0, status='sold')
+
+    changed = change_prices(listing_conditions(user_id=user.id, status='active'), -10, post=True)
+    db.session.commit()
+
+    assert changed == 1
+    db.session.refresh(bike)
+    db.session.refresh(sold)
+    assert (bike.price, sold.price) == (90.0, 50.0)
+    assert {job.listing_id for job in OutboundJob.query} == {bike.id}
+
+def test_status_change_keeps_the_rollups_in_step(user):
+    import_csv(user, post=False)
+    bike = Listing.query.filter_by(title='Bike').one()
+
+    changed = change_statuses(listing_conditions(listing_ids=[bike.id]), 'sold')
+    db.session.commit()
+
+    assert changed == 1
+    db.session.refresh(bike)
+    assert bike.status == 'sold' and bike.sold_at is not None
+    assert (site_stats().active_listings, site_stats().sold_listings) == (1, 1)
+    # Already sold, so nothing to change
+    assert change_statuses(listing_conditions(listing_ids=[bike.id]), 'sold') == 0
+
+def test_delete_removes_listings_and_what_hangs_off_them(user):
+    import_csv(user, post=True)
+    running = claim_jobs('worker-1', batch_size=1)[0]
+
+    deleted = delete_listings(listing_conditions(user_id=user.id))
+    db.session.commit()
+
+    assert deleted == 2
+    assert Listing.query.count() == 0
+    assert CustomField.query.count() == 0
+    # The job a worker is running is cancelled, not pulled out from under it
+    job = db.session.get(OutboundJob, running.id)
+    assert (job.status, job.listing_id) == (CANCELLED, None)
+    assert OutboundJob.query.filter(OutboundJob.status != CANCELLED).count() == 0
+    db.session.refresh(user)
+    assert user.listing_count == 0
+    assert site_stats().listings == 0
+
+def test_bulk_form_only_touches_the_sellers_listings(client, user):
+    mine = make_listing(user, price=100.0)
+    theirs = make_listing(make_user('other'), price=100.0)
+
+    response = client.post('/my_listings/bulk', data={
+        'action': 'price', 'percent': '50', 'scope': 'selected', 'listing_ids': [mine.id, theirs.id],
+    })
+
+    assert response.status_code == 302
+    assert {listing.id: listing.price for listing in db.session.query(Listing.id, Listing.price)} == {
+        mine.id: 150.0, theirs.id: 100.0}
+
+def test_failed_admin_bulk_action_is_rolled_back(app, monkeypatch, user):
+    listing = make_listing(user, price=100.0)
+    make_user('admin', is_admin=True)
+    admin = app.test_client()
+    admin.post('/login', data={'email': 'admin@example.com', 'password': 'secret'})
+
+    def fail_halfway(*args, **kwargs):
+        apply_bulk_action(*args, **kwargs)
+        raise OperationalError('UPDATE listing', {}, Exception('database is locked'))
+    monkeypatch.setattr('admin.apply_bulk_action', fail_halfway)
+
+    response = admin.post('/admin/listings/bulk', data={
+        'action': 'price', 'percent': '50', 'scope': 'selected', 'listing_ids': [listing.id],
+    })
+
+    assert response.status_code == 302
+    db.session.refresh(listing)
+    assert listing.price == 100.0
+    assert 'An error occurred while updating the listings.' in admin.get('/admin/').get_data(as_text=True)
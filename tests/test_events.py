@@ -0,0 +1,59 @@
+import threading
+
+import pytest
+from werkzeug.test import EnvironBuilder
+
+from app import db
+from notifications import add_notification
+from tests.factories import make_listing
+
+@pytest.fixture
+def app(app):
+    # Streams end right after catching up instead of waiting for events
+    app.config['SSE_MAX_SECONDS'] = 0
+    app.extensions['sse_slots'] = threading.BoundedSemaphore(1)
+    return app
+
+def notify(user, content):
+    listing = make_listing(user)
+    notification = add_notification(user.id, listing.id, content, 'OfferUp')
+    db.session.commit()
+    return notification
+
+def stream(client, **headers):
+    return client.get('/notifications/stream', headers=headers, buffered=False)
+
+def test_stream_replays_notifications_after_the_last_event_id(client, user):
+    seen = notify(user, 'Is this still available?')
+    notify(user, 'Would you take 80?')
+
+    response = stream(client, **{'Last-Event-ID': str(seen.id)})
+    body = response.get_data(as_text=True)
+    response.close()
+
+    assert response.mimetype == 'text/event-stream'
+    assert body.startswith('retry: ')
+    assert 'Would you take 80?' in body
+    assert 'Is this still available?' not in body
+
+def test_connections_are_capped(client):
+    first = stream(client)
+
+    busy = stream(client)
+    assert busy.status_code == 503
+    first.close()
+
+    assert stream(client).status_code == 200
+
+def test_slot_is_released_when_the_stream_is_never_read(app, client):
+    # The test client reads the first chunk itself, so call the app directly
+    environ = EnvironBuilder(path='/notifications/stream',
+                             headers={'Cookie': f"session={client.get_cookie('session').value}"}).get_environ()
+    statuses = []
+    for _ in range(3):
+        with app.app_context():
+            body = app(environ, lambda status, headers: statuses.append(status))
+        # The client went away before the first event
+        body.close()
+
+    assert statuses == ['200 OK'] * 3
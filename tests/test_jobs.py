@@ -0,0 +1,82 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import db
+from external_platforms import get_registry
+from jobs import FAILED, PENDING, RUNNING, SUCCEEDED, claim_jobs, enqueue_listing_post, run_jobs
+from models import OutboundJob
+from tests.factories import make_listing
+
+@pytest.fixture
+def listing(user):
+    return make_listing(user)
+
+@pytest.fixture
+def queued(listing):
+    result = enqueue_listing_post(listing)
+    db.session.commit()
+    return result
+
+def fail_on(monkeypatch, platform_name):
+    def post_listing(payload):
+        raise ConnectionError('platform is down')
+    monkeypatch.setattr(get_registry().get(platform_name), 'post_listing', post_listing)
+
+def test_enqueue_queues_one_job_per_platform(queued):
+    assert sorted(job.platform for job in queued.jobs) == sorted(get_registry().names())
+    assert all(job.status == PENDING for job in queued.jobs)
+
+def test_claim_marks_jobs_running_once(queued):
+    jobs = claim_jobs('worker-1')
+
+    assert len(jobs) == len(queued.jobs)
+    assert all(job.status == RUNNING and job.locked_by == 'worker-1' and job.attempts == 1 for job in jobs)
+    assert claim_jobs('worker-2') == []
+
+def test_claim_skips_jobs_not_yet_due(queued):
+    OutboundJob.query.update({'run_at': datetime.utcnow() + timedelta(minutes=5)})
+    db.session.commit()
+
+    assert claim_jobs('worker-1') == []
+
+def test_claim_reclaims_jobs_whose_lease_expired(app, queued):
+    claim_jobs('dead-worker')
+    stale = datetime.utcnow() - timedelta(seconds=app.config['JOB_LEASE_SECONDS'] + 1)
+    OutboundJob.query.update({'locked_at': stale})
+    db.session.commit()
+
+    jobs = claim_jobs('worker-2')
+
+    assert len(jobs) == len(queued.jobs)
+    assert all(job.locked_by == 'worker-2' and job.attempts == 2 for job in jobs)
+
+def test_failed_job_is_retried_later(monkeypatch, queued):
+    fail_on(monkeypatch, 'OfferUp')
+
+    run_jobs(claim_jobs('worker-1'))
+
+    job = OutboundJob.query.filter_by(platform='OfferUp').one()
+    assert job.status == PENDING
+    assert job.attempts == 1
+    assert job.locked_by is None
+    assert 'platform is down' in job.last_error
+    assert job.run_at > datetime.utcnow()
+    assert OutboundJob.query.filter_by(platform='Facebook Marketplace').one().status == SUCCEEDED
+    # Backing off: not claimable until run_at
+    assert claim_jobs('worker-1') == []
+
+def test_job_fails_for_good_after_max_attempts(monkeypatch, queued):
+    fail_on(monkeypatch, 'OfferUp')
+    OutboundJob.query.update({'max_attempts': 2})
+    db.session.commit()
+
+    for attempt in range(2):
+        run_jobs(claim_jobs('worker-1'))
+        OutboundJob.query.filter_by(status=PENDING).update({'run_at': datetime.utcnow()})
+        db.session.commit()
+
+    job = OutboundJob.query.filter_by(platform='OfferUp').one()
+    assert job.status == FAILED
+    assert job.attempts == 2
+    assert claim_jobs('worker-1') == []
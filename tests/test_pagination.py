@@ -0,0 +1,82 @@
+import base64
+import json
+from datetime import datetime
+
+import pytest
+
+from models import Listing
+from pagination import decode_cursor, encode_cursor, keyset_page
+from perf import seed_listings
+
+def raw_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip('=')
+
+def test_cursor_round_trips():
+    created = datetime(2026, 10, 18, 12, 30, 5, 123456)
+    cursor = encode_cursor([created, 42])
+
+    assert decode_cursor(cursor, [Listing.created_at, Listing.id]) == [created, 42]
+
+def test_float_column_accepts_whole_numbers():
+    assert decode_cursor(raw_cursor([12]), [Listing.price]) == [12.0]
+
+@pytest.mark.parametrize('cursor', [
+    '',
+    None,
+    'not base64!',
+    base64.urlsafe_b64encode(b'not json').decode(),
+    raw_cursor({'id': 1}),
+    raw_cursor([1, 2]),
+    raw_cursor(['1']),
+    raw_cursor([True]),
+    raw_cursor([None]),
+])
+def test_invalid_cursors_decode_to_none(cursor):
+    assert decode_cursor(cursor, [Listing.id]) is None
+
+@pytest.mark.parametrize('values', [[1, 1], ['yesterday', 1], [{'a': 1}, 1]])
+def test_mistyped_timestamps_decode_to_none(values):
+    assert decode_cursor(raw_cursor(values), [Listing.created_at, Listing.id]) is None
+
+def test_pages_walk_the_feed_newest_first(user):
+    seed_listings(user, 5, photos_per_listing=0, fields_per_listing=0)
+    seen = []
+    cursor = None
+    while True:
+        page = keyset_page(Listing.query, [Listing.id], cursor, per_page=2)
+        seen.extend(listing.id for listing in page.items)
+        if not page.has_next:
+            break
+        cursor = page.next_cursor
+
+    ids = [listing.id for listing in Listing.query.order_by(Listing.id.desc())]
+    assert seen == ids
+
+def test_composite_key_pages_do_not_skip_ties(user):
+    seed_listings(user, 4, photos_per_listing=0, fields_per_listing=0)
+    same_time = datetime(2026, 1, 1)
+    Listing.query.update({'created_at': same_time})
+
+    first = keyset_page(Listing.query, [Listing.created_at, Listing.id], per_page=3)
+    second = keyset_page(Listing.query, [Listing.created_at, Listing.id], first.next_cursor, per_page=3)
+
+    assert first.is_first and not second.is_first
+    assert len(first.items) == 3 and len(second.items) == 1
+    assert not second.has_next
+    assert {listing.id for listing in first.items + second.items} == {listing.id for listing in Listing.query}
+
+def test_invalid_cursor_yields_the_first_page(user):
+    seed_listings(user, 3, photos_per_listing=0, fields_per_listing=0)
+
+    page = keyset_page(Listing.query, [Listing.id], raw_cursor(['oops']), per_page=2)
+
+    assert page.is_first
+    assert [listing.id for listing in page.items] == [3, 2]
+
+def test_feed_with_garbled_cursor_still_renders(client, user):
+    seed_listings(user, 2)
+
+    response = client.get('/?cursor=' + raw_cursor([True]))
+
+    assert response.status_code == 200
+    assert 'Listing 1' in response.get_data(as_text=True)
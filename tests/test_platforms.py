@@ -0,0 +1,67 @@
+import time
+
+import pytest
+
+from external_platforms import CircuitOpenError, OfferUpPlatform, PlatformRegistry
+from platform_stub import serve_in_thread
+
+LATENCY = 0.3
+
+@pytest.fixture
+def stub():
+    server, base_url = serve_in_thread(latency=LATENCY, comment_rate=0)
+    yield server.state, base_url
+    server.shutdown()
+    server.server_close()
+
+def registry(base_url, max_workers=4, wait_timeout=5, **options):
+    return PlatformRegistry([OfferUpPlatform(base_url=base_url, timeout=5, **options)],
+                            max_workers=max_workers, wait_timeout=wait_timeout)
+
+def test_calls_run_concurrently(app, stub):
+    state, base_url = stub
+    platforms = registry(base_url)
+
+    start = time.perf_counter()
+    outcomes = platforms.fan_out([('OfferUp', 'update_listing', (f'remote-{i}', {'id': i})) for i in range(4)])
+
+    assert [result for _, result in outcomes] == [{'id': f'remote-{i}'} for i in range(4)]
+    assert time.perf_counter() - start < 4 * LATENCY
+    assert state.max_in_flight == 4
+
+def test_timed_out_create_is_not_duplicated_by_its_retry(app, stub):
+    state, base_url = stub
+    payload = {'id': 7, 'title': 'Bike'}
+
+    [(success, error)] = registry(base_url, wait_timeout=LATENCY / 3).fan_out(
+        [('OfferUp', 'post_listing', (payload,))])
+    assert not success and isinstance(error, TimeoutError)
+    # The call was already running and still reaches the platform
+    time.sleep(LATENCY * 2)
+    [(success, result)] = registry(base_url).fan_out([('OfferUp', 'post_listing', (payload,))])
+
+    assert success
+    assert result == {'id': 'stub-1'}
+    assert state.created == {'listing-7': 'stub-1'}
+
+def test_calls_still_queued_at_the_timeout_never_run(app, stub):
+    state, base_url = stub
+    platforms = registry(base_url, max_workers=1, wait_timeout=LATENCY / 3)
+
+    outcomes = platforms.fan_out([('OfferUp', 'update_listing', (f'remote-{i}', {'id': i})) for i in range(3)])
+    time.sleep(LATENCY * 4)
+
+    assert [success for success, _ in outcomes] == [False, False, False]
+    assert state.stats()['requests'] == 1
+
+def test_open_circuit_skips_the_platform(app, stub):
+    state, base_url = stub
+    state.fail_rate = 1.0
+    platforms = registry(base_url, failure_threshold=2, reset_timeout=60)
+
+    for _ in range(2):
+        platforms.fan_out([('OfferUp', 'update_listing', ('remote-1', {'id': 1}))])
+    [(success, error)] = platforms.fan_out([('OfferUp', 'update_listing', ('remote-1', {'id': 1}))])
+
+    assert not success and isinstance(error, CircuitOpenError)
+    assert state.stats()['requests'] == 2
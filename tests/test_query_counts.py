@@ -0,0 +1,15 @@
+from perf import GRID_ROUTES, measure_routes, seed_listings
+
+def test_listing_grids_issue_a_constant_number_of_queries(app, client, user):
+    seed_listings(user, 3)
+    small = measure_routes(app, client, GRID_ROUTES)
+    seed_listings(user, 27)
+    large = measure_routes(app, client, GRID_ROUTES)
+
+    assert large == small
+
+def test_grid_renders_seeded_listings(client, user):
+    seed_listings(user, 2)
+    page = client.get('/my_listings').get_data(as_text=True)
+
+    assert 'Listing 0' in page and 'Listing 1' in page
@@ -0,0 +1,93 @@
+import pytest
+
+from app import db
+from external_platforms import get_registry
+from jobs import PENDING, SKIPPED, SUCCEEDED, claim_jobs, enqueue_listing_post, run_jobs
+from models import OutboundJob, PlatformSyncState
+from tests.factories import make_listing
+
+@pytest.fixture
+def calls(monkeypatch):
+    """Record platform calls; creates get a remote ID per platform."""
+    calls = []
+    for platform in get_registry().platforms.values():
+        def post_listing(payload, name=platform.name):
+            calls.append((name, 'create', payload['title']))
+            return {'id': f'{name}-1'}
+
+        def update_listing(remote_id, payload, name=platform.name):
+            calls.append((name, 'update', remote_id))
+            return {'id': remote_id}
+
+        monkeypatch.setattr(platform, 'post_listing', post_listing)
+        monkeypatch.setattr(platform, 'update_listing', update_listing)
+    return calls
+
+@pytest.fixture
+def synced(user, calls):
+    listing = make_listing(user)
+    enqueue_listing_post(listing)
+    db.session.commit()
+    run_jobs(claim_jobs('worker-1'))
+    calls.clear()
+    return listing
+
+def sync(listing):
+    result = enqueue_listing_post(listing)
+    db.session.commit()
+    run_jobs(claim_jobs('worker-1'))
+    return result
+
+def test_first_sync_creates_and_records_remote_ids(synced):
+    states = PlatformSyncState.query.filter_by(listing_id=synced.id).all()
+
+    assert sorted(state.platform for state in states) == sorted(get_registry().names())
+    assert all(state.remote_id == f'{state.platform}-1' and state.content_hash for state in states)
+    assert {job.status for job in OutboundJob.query} == {SUCCEEDED}
+
+def test_unchanged_listing_is_not_queued_again(synced, calls):
+    result = sync(synced)
+
+    assert result.jobs == [] and result.pending == []
+    assert sorted(result.synced) == sorted(get_registry().names())
+    assert calls == []
+
+def test_fields_the_platforms_ignore_do_not_trigger_a_sync(synced):
+    synced.status = 'sold'
+    db.session.commit()
+
+    assert enqueue_listing_post(synced).jobs == []
+
+def test_changed_listing_is_updated_in_place(synced, calls):
+    synced.price = 80.0
+    db.session.commit()
+
+    result = sync(synced)
+
+    assert len(result.jobs) == len(get_registry().names())
+    assert sorted(calls) == sorted((name, 'update', f'{name}-1') for name in get_registry().names())
+
+def test_platforms_with_a_pending_job_are_not_queued_twice(synced):
+    synced.title = 'Blue bike'
+    db.session.commit()
+    first = enqueue_listing_post(synced)
+    db.session.commit()
+
+    again = enqueue_listing_post(synced)
+
+    assert len(first.jobs) == len(get_registry().names())
+    assert again.jobs == []
+    assert sorted(again.pending) == sorted(get_registry().names())
+    assert OutboundJob.query.filter_by(status=PENDING).count() == len(first.jobs)
+
+def test_job_is_skipped_when_the_platform_already_has_the_content(synced, calls):
+    synced.title = 'Blue bike'
+    db.session.commit()
+    enqueue_listing_post(synced)
+    synced.title = 'Bike'
+    db.session.commit()
+
+    run_jobs(claim_jobs('worker-1'))
+
+    assert calls == []
+    assert OutboundJob.query.filter_by(status=SKIPPED).count() == len(get_registry().names())
@@ -0,0 +1,193 @@
+import io
+import os
+from datetime import datetime, timedelta
+
+import pytest
+from PIL import Image
+
+from app import db
+from models import Blob, Listing, Photo, UploadSession
+from storage import temp_dir
+from tests.factories import make_user
+
+MB = 1024 * 1024
+FORM = {'title': 'Bike', 'description': 'Red bike', 'price': '100', 'location': 'Town'}
+
+@pytest.fixture
+def app(app):
+    app.config.update(UPLOAD_MAX_FILE_SIZE=MB, UPLOAD_MAX_FILES=2, MAX_CONTENT_LENGTH=3 * MB,
+                      UPLOAD_CHUNK_SIZE=1000)
+    return app
+
+@pytest.fixture(autouse=True)
+def no_variants(monkeypatch):
+    # Variants are generated in worker processes; not what these tests are about
+    monkeypatch.setattr('routes.process_photos_async', lambda photos: None)
+
+def jpeg(shade=0, size=(64, 64), padding=0):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, (shade, 0, 0)).save(buffer, 'JPEG')
+    return buffer.getvalue() + b'\0' * padding
+
+def create_listing(client, **data):
+    return client.post('/create_listing', data={**FORM, **data}, content_type='multipart/form-data')
+
+def leftover_temp_files():
+    return [name for name in os.listdir(temp_dir()) if name.startswith('upload-')]
+
+def test_photos_are_stored_by_content_not_filename(client):
+    response = create_listing(client, photos=[(io.BytesIO(jpeg(1)), 'photo.png'),
+                                              (io.BytesIO(b'MZ not an image at all'), 'photo.jpg')])
+
+    assert response.status_code == 302
+    photo = Photo.query.one()
+    assert photo.filename.endswith('.jpg')
+    assert os.path.exists(os.path.join(client.application.config['UPLOAD_FOLDER'], photo.filename))
+    assert leftover_temp_files() == []
+
+def test_identical_photos_share_a_blob(client):
+    create_listing(client, photos=[(io.BytesIO(jpeg(2)), 'a.jpg')])
+    create_listing(client, photos=[(io.BytesIO(jpeg(2)), 'b.jpg')])
+
+    assert Photo.query.count() == 2
+    blob = Blob.query.one()
+    assert blob.ref_count == 2
+
+def test_oversized_photo_is_refused(client):
+    response = create_listing(client, photos=[(io.BytesIO(jpeg(padding=MB)), 'big.jpg')])
+
+    assert response.status_code == 302
+    assert Listing.query.count() == 0
+    assert leftover_temp_files() == []
+    assert 'Each photo can be at most 1 MB.' in client.get('/create_listing').get_data(as_text=True)
+
+def test_too_many_photos_are_refused(client):
+    response = create_listing(client, photos=[(io.BytesIO(jpeg(i)), f'{i}.jpg') for i in range(3)])
+
+    assert response.status_code == 302
+    assert Listing.query.count() == 0
+    assert leftover_temp_files() == []
+    assert 'At most 2 photos can be uploaded at once.' in client.get('/create_listing').get_data(as_text=True)
+
+def test_request_size_is_capped(client):
+    photos = [(io.BytesIO(jpeg(i, padding=MB - 2000)), f'{i}.jpg') for i in range(2)]
+    client.application.config['MAX_CONTENT_LENGTH'] = MB
+
+    response = create_listing(client, photos=photos)
+
+    assert response.status_code == 302
+    assert Listing.query.count() == 0
+    assert 'Uploads are limited to 1 MB per request.' in client.get('/create_listing').get_data(as_text=True)
+
+def start_upload(client, data):
+    response = client.post('/uploads', json={'filename': 'photo.jpg', 'size': len(data)})
+    assert response.status_code == 201
+    return response.headers['Location']
+
+def send_chunks(client, location, data, offset=0, chunk_size=1000):
+    while offset < len(data):
+        response = client.patch(location, data=data[offset:offset + chunk_size],
+                                headers={'Upload-Offset': str(offset)})
+        assert response.status_code == 200
+        offset = response.get_json()['offset']
+    return response
+
+def test_resumable_upload_is_attached_to_a_listing(client):
+    data = jpeg(3, size=(200, 200))
+    location = start_upload(client, data)
+
+    first = client.patch(location, data=data[:1000], headers={'Upload-Offset': '0'})
+    # A retried chunk is told where the server is instead of being written twice
+    retried = client.patch(location, data=data[:1000], headers={'Upload-Offset': '0'})
+    assert (first.status_code, retried.status_code) == (200, 409)
+    assert retried.get_json()['offset'] == 1000
+    assert client.get(location).get_json()['offset'] == 1000
+
+    finished = send_chunks(client, location, data, offset=1000).get_json()
+    assert finished['complete']
+
+    response = create_listing(client, uploads=[finished['token'], 'unknown-token'])
+
+    assert response.status_code == 302
+    photo = Photo.query.one()
+    with open(os.path.join(client.application.config['UPLOAD_FOLDER'], photo.filename), 'rb') as f:
+        assert f.read() == data
+    assert UploadSession.query.count() == 0
+
+def test_unfinished_upload_is_not_attached(client):
+    data = jpeg(4, size=(200, 200))
+    location = start_upload(client, data)
+    client.patch(location, data=data[:1000], headers={'Upload-Offset': '0'})
+
+    create_listing(client, uploads=[location.rsplit('/', 1)[1]])
+
+    assert Photo.query.count() == 0
+    assert UploadSession.query.count() == 1
+
+def test_resumable_upload_must_be_an_image(client):
+    location = start_upload(client, b'x' * 100)
+
+    response = client.patch(location, data=b'x' * 100, headers={'Upload-Offset': '0'})
+
+    assert response.status_code == 415
+    assert UploadSession.query.count() == 0
+
+def test_resumable_upload_limits(client):
+    assert client.post('/uploads', json={'size': MB + 1}).status_code == 413
+    assert client.post('/uploads', json={'size': 0}).status_code == 400
+
+    data = jpeg(5, size=(200, 200))
+    location = start_upload(client, data)
+    assert client.patch(location, data=data[:1001], headers={'Upload-Offset': '0'}).status_code == 413
+
+def test_uploads_belong_to_their_user(app, client):
+    location = start_upload(client, jpeg(6))
+    make_user('other')
+    other = app.test_client()
+    other.post('/login', data={'email': 'other@example.com', 'password': 'secret'})
+
+    assert other.get(location).status_code == 404
+    assert other.delete(location).status_code == 404
+    assert client.delete(location).status_code == 204
+    db.session.expire_all()
+    assert UploadSession.query.count() == 0
+
+def lock_upload(when):
+    UploadSession.query.update({'locked_at': when})
+    db.session.commit()
+
+def test_chunk_is_not_written_while_another_request_holds_the_offset(client):
+    data = jpeg(7, size=(200, 200))
+    location = start_upload(client, data)
+    lock_upload(datetime.utcnow())
+
+    response = client.patch(location, data=data[:1000], headers={'Upload-Offset': '0'})
+
+    assert response.status_code == 409
+    assert response.get_json()['offset'] == 0
+    assert os.path.getsize(os.path.join(temp_dir(), f"session-{response.get_json()['token']}")) == 0
+
+def test_abandoned_claim_expires(app, client):
+    data = jpeg(8, size=(200, 200))
+    location = start_upload(client, data)
+    lock_upload(datetime.utcnow() - timedelta(seconds=app.config['UPLOAD_CHUNK_LEASE'] + 1))
+
+    response = client.patch(location, data=data[:1000], headers={'Upload-Offset': '0'})
+
+    assert response.status_code == 200
+    db.session.expire_all()
+    assert UploadSession.query.one().locked_at is None
+
+def test_failed_chunk_write_releases_the_offset(monkeypatch, client):
+    data = jpeg(9, size=(200, 200))
+    location = start_upload(client, data)
+
+    def fail(*args):
+        raise OSError('disk full')
+    monkeypatch.setattr('uploads._write_chunk', fail)
+    with pytest.raises(OSError):
+        client.patch(location, data=data[:1000], headers={'Upload-Offset': '0'})
+
+    db.session.expire_all()
+    upload = UploadSession.query.one()
+    assert (upload.received, upload.locked_at) == (0, None)
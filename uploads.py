@@ -0,0 +1,393 @@
+"""Photo upload ingest.
+
+Views marked ``@streamed_uploads`` get their multipart file parts written
+straight to temp files next to the blob store, in the chunks Werkzeug
+parses them in, and hashed on the way. Nothing about a photo is held in
+memory or copied again: storing it is a rename. The type comes from the
+first bytes, not the filename, and limits apply while the body is read:
+
+- ``MAX_CONTENT_LENGTH`` bounds the whole request (413 before parsing when
+  the client sends a ``Content-Length``, and as it streams otherwise).
+- ``UPLOAD_MAX_FILE_SIZE`` bounds each photo and ``UPLOAD_MAX_FILES``
+  their number; going over stops the request with 413 as soon as it
+  happens.
+
+Large photo sets can instead be sent as resumable uploads, which is what
+``static/js/listing.js`` does when it can::
+
+    POST   /uploads          {"filename": ..., "size": ...} -> {"token": ..., "offset": 0}
+    PATCH  /uploads/<token>  Upload-Offset: n, body = next chunk (<= UPLOAD_CHUNK_SIZE)
+    GET    /uploads/<token>  -> {"offset": ...}, to resume after a failure
+    DELETE /uploads/<token>
+
+The listing form then sends the tokens of finished uploads as ``uploads``
+fields in place of the files. ``flask uploads prune`` deletes uploads
+untouched for ``UPLOAD_SESSION_TTL`` seconds.
+"""
+import glob
+import hashlib
+import os
+import secrets
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import click
+from flask import Blueprint, Request, current_app, flash, jsonify, redirect, request, url_for
+from flask.cli import AppGroup
+from flask_login import current_user, login_required
+from sqlalchemy import and_, or_, update
+from werkzeug.exceptions import RequestEntityTooLarge
+
+from app import db
+from models import UploadSession
+from storage import CHUNK_SIZE, store_file, store_stream, temp_dir
+
+uploads = Blueprint('uploads', __name__)
+uploads_cli = AppGroup('uploads', help='Photo upload commands.')
+
+MB = 1024 * 1024
+
+# Enough of the start of a file to tell the formats below apart
+SNIFF_BYTES = 12
+
+IMAGE_SIGNATURES = (
+    (b'\xff\xd8\xff', '.jpg'),
+    (b'\x89PNG\r\n\x1a\n', '.png'),
+    (b'GIF87a', '.gif'),
+    (b'GIF89a', '.gif'),
+    (b'BM', '.bmp'),
+)
+
+def sniff_image(head):
+    """File extension for an image starting with ``head``, or None if it isn't one we take."""
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return '.webp'
+    for signature, extension in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return extension
+    return None
+
+class UploadFile:
+    """Target Werkzeug writes one streamed file part to.
+
+    Parts that turn out not to be images are dropped from disk as soon as
+    their first bytes are in; the rest of them is still read, and counted,
+    but not kept.
+    """
+
+    def __init__(self, directory, max_size):
+        self.directory = directory
+        self.max_size = max_size
+        self.size = 0
+        self.head = b''
+        self.extension = None
+        self.rejected = False
+        self.path = None
+        self._file = None
+        self._claimed = False
+        self._digest = hashlib.sha256()
+
+    @property
+    def sha256(self):
+        return self._digest.hexdigest()
+
+    def write(self, data):
+        self.size += len(data)
+        if self.size > self.max_size:
+            raise RequestEntityTooLarge(f"Each photo can be at most {self.max_size // MB} MB.")
+        if self.rejected:
+            return len(data)
+        if self._file is None:
+            fd, self.path = tempfile.mkstemp(dir=self.directory, prefix='upload-')
+            self._file = os.fdopen(fd, 'w+b')
+        self._file.write(data)
+        self._digest.update(data)
+        if self.extension is None and len(self.head) < SNIFF_BYTES:
+            self.head += data[:SNIFF_BYTES - len(self.head)]
+            if len(self.head) == SNIFF_BYTES:
+                self._sniff()
+        return len(data)
+
+    def _sniff(self):
+        self.extension = sniff_image(self.head)
+        if self.extension is None:
+            self.rejected = True
+            self._discard()
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        # Werkzeug rewinds once the part is complete; short files are judged here
+        if self.extension is None and not self.rejected and self.head:
+            self._sniff()
+        return self._file.seek(offset, whence) if self._file is not None else 0
+
+    def tell(self):
+        return self._file.tell() if self._file is not None else 0
+
+    def read(self, size=-1):
+        return self._file.read(size) if self._file is not None else b''
+
+    def claim(self):
+        """Take over the temp file; returns ``(path, sha256, size)`` for ``store_file``."""
+        self._file.close()
+        self._claimed = True
+        return self.path, self.sha256, self.size
+
+    def _discard(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self.path is not None:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+            self.path = None
+
+    def close(self):
+        if self._claimed:
+            return
+        self._discard()
+
+def streamed_uploads(view):
+    """Stream the file parts of requests to ``view`` to disk (see module docstring)."""
+    view.streamed_uploads = True
+    return view
+
+class UploadRequest(Request):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._uploads = []
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        view = current_app.view_functions.get(self.endpoint)
+        if not getattr(view, 'streamed_uploads', False):
+            return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+        if len(self._uploads) >= current_app.config['UPLOAD_MAX_FILES']:
+            raise RequestEntityTooLarge(f"At most {current_app.config['UPLOAD_MAX_FILES']} photos can be "
+                                        "uploaded at once.")
+        upload = UploadFile(temp_dir(), current_app.config['UPLOAD_MAX_FILE_SIZE'])
+        self._uploads.append(upload)
+        return upload
+
+    def close(self):
+        super().close()
+        # Also covers parts of a request that was cut short, which never
+        # made it into request.files
+        for upload in self._uploads:
+            upload.close()
+
+def store_photo(file_storage):
+    """Store an uploaded photo; returns its ``Blob``, or None if it is not an image.
+
+    As with ``store_file``, the blob is not referenced yet.
+    """
+    stream = file_storage.stream
+    if isinstance(stream, UploadFile):
+        if stream.extension is None:
+            return None
+        return store_file(*stream.claim(), stream.extension)
+    extension = sniff_image(stream.read(SNIFF_BYTES))
+    stream.seek(0)
+    if extension is None:
+        return None
+    return store_stream(stream, extension)
+
+def _session_path(token):
+    return os.path.join(temp_dir(), f'session-{token}')
+
+def claim_uploads(tokens):
+    """Blobs of the current user's finished resumable uploads ``tokens``, in that order.
+
+    The upload sessions are deleted with the caller's transaction.
+    """
+    tokens = list(dict.fromkeys(tokens))
+    if not tokens:
+        return []
+    sessions = {upload.token: upload for upload in UploadSession.query.filter(
+        UploadSession.token.in_(tokens), UploadSession.user_id == current_user.id,
+        UploadSession.sha256.isnot(None))}
+    blobs = []
+    for token in tokens:
+        upload = sessions.get(token)
+        if upload is None:
+            current_app.logger.warning("Upload %s is unknown or unfinished", token)
+            continue
+        path = _session_path(token)
+        if not os.path.exists(path):
+            current_app.logger.warning("Upload %s has no file", token)
+            continue
+        blobs.append(store_file(path, upload.sha256, upload.size, upload.extension))
+        db.session.delete(upload)
+    return blobs
+
+def _status(upload, status=200):
+    response = jsonify(token=upload.token, size=upload.size, offset=upload.received,
+                       complete=upload.sha256 is not None,
+                       chunk_size=current_app.config['UPLOAD_CHUNK_SIZE'])
+    response.status_code = status
+    response.headers['Upload-Offset'] = str(upload.received)
+    return response
+
+def _error(message, status):
+    return jsonify(error=message), status
+
+def _get_upload(token):
+    return UploadSession.query.filter_by(token=token, user_id=current_user.id).first_or_404()
+
+def _hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while chunk := f.read(CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+@uploads.route('/uploads', methods=['POST'])
+@login_required
+def create_upload():
+    data = request.get_json(silent=True) or {}
+    size = data.get('size')
+    if not isinstance(size, int) or isinstance(size, bool) or size <= 0:
+        return _error("size must be a positive number of bytes", 400)
+    if size > current_app.config['UPLOAD_MAX_FILE_SIZE']:
+        return _error(f"Each photo can be at most {current_app.config['UPLOAD_MAX_FILE_SIZE'] // MB} MB.", 413)
+    if UploadSession.query.filter_by(user_id=current_user.id).count() >= current_app.config['UPLOAD_MAX_SESSIONS']:
+        return _error("Too many unfinished uploads", 429)
+    upload = UploadSession(token=secrets.token_hex(16), user_id=current_user.id,
+                           filename=str(data.get('filename') or '')[:255], size=size, received=0)
+    db.session.add(upload)
+    db.session.commit()
+    open(_session_path(upload.token), 'wb').close()
+    response = _status(upload, 201)
+    response.headers['Location'] = url_for('uploads.upload_status', token=upload.token)
+    return response
+
+@uploads.route('/uploads/<token>')
+@login_required
+def upload_status(token):
+    return _status(_get_upload(token))
+
+@uploads.route('/uploads/<token>', methods=['PATCH'])
+@login_required
+def upload_chunk(token):
+    upload = _get_upload(token)
+    offset = request.headers.get('Upload-Offset', type=int)
+    length = request.content_length
+    if offset is None or not length:
+        return _error("Upload-Offset and a non-empty body with Content-Length are required", 400)
+    if offset != upload.received:
+        # The client's idea of progress is stale; it resumes from ours
+        return _status(upload, 409)
+    if length > current_app.config['UPLOAD_CHUNK_SIZE']:
+        return _error(f"Chunks can be at most {current_app.config['UPLOAD_CHUNK_SIZE']} bytes", 413)
+    if offset + length > upload.size:
+        return _error("Chunk runs past the declared size", 400)
+
+    # Claim the offset before touching the file, so two requests for the
+    # same offset cannot both write to it
+    claimed_at = datetime.utcnow()
+    stale = claimed_at - timedelta(seconds=current_app.config['UPLOAD_CHUNK_LEASE'])
+    claimed = db.session.execute(
+        update(UploadSession)
+        .where(UploadSession.id == upload.id, UploadSession.received == offset,
+               or_(UploadSession.locked_at.is_(None), UploadSession.locked_at < stale))
+        .values(locked_at=claimed_at)
+        .execution_options(synchronize_session=False)).rowcount
+    db.session.commit()
+    if not claimed:
+        # Another request for the same offset got there first
+        return _status(_get_upload(token), 409)
+    ours = and_(UploadSession.id == upload.id, UploadSession.locked_at == claimed_at)
+    try:
+        return _write_chunk(upload, token, offset, length, ours)
+    except BaseException:
+        # Hand the offset back rather than leave it to the lease
+        db.session.rollback()
+        db.session.execute(update(UploadSession).where(ours).values(locked_at=None)
+                           .execution_options(synchronize_session=False))
+        db.session.commit()
+        raise
+
+def _write_chunk(upload, token, offset, length, ours):
+    stream = request.stream
+    values = {}
+    written = 0
+    with open(_session_path(token), 'r+b') as f:
+        f.seek(offset)
+        if offset == 0:
+            head = b''
+            while len(head) < min(SNIFF_BYTES, length) and (piece := stream.read(SNIFF_BYTES - len(head))):
+                head += piece
+            values['extension'] = sniff_image(head)
+            if values['extension'] is None:
+                _delete_upload(upload)
+                db.session.commit()
+                return _error("Not a supported image", 415)
+            f.write(head)
+            written = len(head)
+        while written < length and (chunk := stream.read(min(CHUNK_SIZE, length - written))):
+            f.write(chunk)
+            written += len(chunk)
+
+    received = offset + written
+    if received == upload.size:
+        values['sha256'] = _hash_file(_session_path(token))
+    result = db.session.execute(
+        update(UploadSession)
+        .where(ours, UploadSession.received == offset)
+        .values(received=received, locked_at=None, updated_at=datetime.utcnow(), **values)
+        .execution_options(synchronize_session=False))
+    if result.rowcount == 0:
+        # Our claim outlived its lease and another request took the offset
+        db.session.rollback()
+        return _status(_get_upload(token), 409)
+    db.session.commit()
+    if written < length:
+        return _error("Chunk was cut short", 400)
+    return _status(upload)
+
+@uploads.route('/uploads/<token>', methods=['DELETE'])
+@login_required
+def cancel_upload(token):
+    _delete_upload(_get_upload(token))
+    db.session.commit()
+    return '', 204
+
+def _delete_upload(upload):
+    db.session.delete(upload)
+    try:
+        os.remove(_session_path(upload.token))
+    except FileNotFoundError:
+        pass
+
+def _too_large(error):
+    message = error.description
+    if message == RequestEntityTooLarge.description:
+        message = f"Uploads are limited to {current_app.config['MAX_CONTENT_LENGTH'] // MB} MB per request."
+    if request.blueprint == uploads.name:
+        return _error(message, 413)
+    flash(message, 'error')
+    return redirect(request.url)
+
+def init_uploads(app):
+    app.request_class = UploadRequest
+    app.register_error_handler(RequestEntityTooLarge, _too_large)
+
+@uploads_cli.command('prune')
+@click.option('--older-than', type=int, help='Seconds since the last chunk [default: UPLOAD_SESSION_TTL].')
+def prune_command(older_than):
+    """Delete abandoned resumable uploads and leftover temp files."""
+    max_age = older_than if older_than is not None else current_app.config['UPLOAD_SESSION_TTL']
+    cutoff = datetime.utcnow() - timedelta(seconds=max_age)
+    stale = UploadSession.query.filter(UploadSession.updated_at < cutoff).all()
+    for upload in stale:
+        _delete_upload(upload)
+    db.session.commit()
+    # Streamed parts are removed when their request ends; these are from
+    # workers that died mid-request
+    leftovers = 0
+    for path in glob.glob(os.path.join(temp_dir(), 'upload-*')):
+        if os.path.getmtime(path) < time.time() - max_age:
+            os.remove(path)
+            leftovers += 1
+    click.echo(f"Deleted {len(stale)} abandoned upload(s) and {leftovers} leftover file(s).")
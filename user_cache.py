@@ -0,0 +1,89 @@
+"""Cache in front of Flask-Login's user loader.
+
+Every request from a signed-in user used to start with a primary-key
+lookup of its ``User``. The loader now keeps each user's column values in
+an in-process LRU for ``USER_CACHE_TTL`` seconds and turns a hit back
+into a session-attached ``User`` with ``merge(load=False)``, so no SQL
+runs until the request touches a relationship.
+
+Keys embed a version counter per user plus one for all users. Code that
+changes a user row calls ``invalidate_user`` (``invalidate_all_users``
+for bulk updates) and the counters are bumped once the transaction
+commits, as in cache.py. With ``USER_CACHE_BACKEND = 'redis'`` the
+counters live in Redis, so a change made by any worker or CLI command
+is seen by every worker on its next request. With the default
+``memory`` backend other processes catch up within ``USER_CACHE_TTL``.
+The rows themselves never leave the process.
+"""
+from flask import current_app, has_app_context
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, make_transient_to_detached
+
+from app import db
+from cache import LRUBackend, RedisBackend
+from models import User
+
+ALL_USERS_VERSION = 'users'
+
+def user_version(user_id):
+    return f'user:{user_id}'
+
+class UserCache:
+    def __init__(self, ttl, max_entries, versions=None):
+        self.ttl = ttl
+        self.entries = LRUBackend(max_entries)
+        # Entries are per process; versions may be shared (see RedisBackend)
+        self.versions = versions or self.entries
+
+    def key(self, user_id):
+        return (f'{user_id}:{self.versions.version(ALL_USERS_VERSION)}'
+                f':{self.versions.version(user_version(user_id))}')
+
+    def load(self, user_id):
+        key = self.key(user_id)
+        values = self.entries.get(key)
+        if values is not None:
+            user = User(**values)
+            make_transient_to_detached(user)
+            return db.session.merge(user, load=False)
+        user = db.session.get(User, user_id)
+        if user is not None:
+            self.entries.set(key, {attr.key: getattr(user, attr.key) for attr in inspect(User).column_attrs},
+                             self.ttl)
+        return user
+
+def init_user_cache(app):
+    if app.config['USER_CACHE_TTL'] <= 0:
+        return
+    versions = None
+    if app.config['USER_CACHE_BACKEND'] == 'redis':
+        versions = RedisBackend(app.config['USER_CACHE_REDIS_URL'], prefix='resell:users:')
+    app.extensions['user_cache'] = UserCache(app.config['USER_CACHE_TTL'], app.config['USER_CACHE_MAX_ENTRIES'],
+                                             versions)
+
+def load_user(user_id):
+    cache = current_app.extensions.get('user_cache')
+    if cache is None:
+        return db.session.get(User, user_id)
+    return cache.load(user_id)
+
+def invalidate_user(user_id):
+    """Drop cached copies of ``user_id`` once the session commits."""
+    db.session.info.setdefault('changed_users', set()).add(user_id)
+
+def invalidate_all_users():
+    """Drop every cached user once the session commits, after bulk updates."""
+    db.session.info.setdefault('changed_users', set()).add(None)
+
+@event.listens_for(Session, 'after_commit')
+def _bump_user_versions(session):
+    changed = session.info.pop('changed_users', None)
+    if not changed or not has_app_context() or 'user_cache' not in current_app.extensions:
+        return
+    versions = current_app.extensions['user_cache'].versions
+    for user_id in changed:
+        versions.bump(ALL_USERS_VERSION if user_id is None else user_version(user_id))
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_user_versions(session):
+    session.info.pop('changed_users', None)
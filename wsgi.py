@@ -0,0 +1,18 @@
+"""WSGI entry point for production servers.
+
+    gunicorn --preload -w 4 wsgi:app
+
+Uses ``config.ProductionConfig`` unless ``APP_CONFIG`` says otherwise, so
+startup neither touches the database nor imports the CLI-only modules.
+With ``--preload`` the app is built once in the master and forked
+workers share its imported code. Nothing built at startup holds a
+connection or a thread; pools are created on first use in each worker.
+Run ``flask db upgrade`` before starting the server.
+"""
+import os
+
+os.environ.setdefault('APP_CONFIG', 'config.ProductionConfig')
+
+from app import create_app
+
+app = create_app(cli=False)